@@ -0,0 +1,200 @@
+## \file bake.py
+#
+#  This file contains the parallel terrain prerendering (baking), e.g. of
+#  the whole world for the chunk disk cache or for minimaps.
+#
+#  The terrain is split into chunks, each chunk is loaded with a one tile
+#  ring around it (so that the borders and corners of the neighbouring
+#  tiles are composited the same way as in one big image) and composited
+#  in a process pool. The chunk images are either copied into a shared
+#  memory pixel buffer and stitched into one image, or stored straight to
+#  a TerrainDiskCache.
+#
+#  The pool uses the spawn start method (pygame and SDL don't survive
+#  forking), so the processes import the main module again, which has to
+#  be guarded by if __name__ == "__main__".
+
+import os
+import argparse
+import multiprocessing
+import multiprocessing.sharedctypes
+import numpy
+import pygame
+import general
+import world
+import graphics
+
+## default chunk width and height in tiles for bake_terrain_image
+
+CHUNK_SIZE = 32
+
+## state of a worker process: tuple (World object,shared pixel buffer or
+#  None,buffer rectangle in tiles,TerrainChunkCache or None)
+
+worker_state = None
+
+## Initialises a worker process of the pool.
+#
+#  @param world_filename name of the world file
+#  @param pixel_buffer shared RGBA pixel buffer of the stitched image or
+#         None
+#  @param rectangle tile rectangle covered by the pixel buffer in format
+#         (x,y,width,height)
+#  @param cache_directory TerrainDiskCache directory or None
+#  @param chunk_size chunk size of the TerrainChunkCache
+
+def worker_initialise(world_filename, pixel_buffer, rectangle, cache_directory, chunk_size):
+  global worker_state
+
+  os.environ["SDL_VIDEODRIVER"] = "dummy"
+  pygame.display.init()
+  pygame.display.set_mode((1,1))           # needed by convert_alpha
+
+  world_object = world.World(world_filename)
+  graphics.TileImageLoader.preload(world_object.tile_types.values())
+  chunk_cache = None
+
+  if cache_directory != None:
+    chunk_cache = graphics.TerrainChunkCache(world_object,chunk_size,0,graphics.TerrainDiskCache(cache_directory))
+
+  worker_state = (world_object,pixel_buffer,rectangle,chunk_cache)
+
+## Composites one chunk into the shared pixel buffer.
+#
+#  @param chunk chunk tile rectangle in format (x,y,width,height), it has
+#         to be inside the buffer rectangle
+#  @return the chunk rectangle
+
+def worker_composite_chunk(chunk):
+  world_object, pixel_buffer, rectangle, chunk_cache = worker_state
+
+  # the ring is clipped by the baked rectangle, like make_terrain_image clips by the area:
+  loaded_rectangle = general.rectangle_intersection((chunk[0] - 1,chunk[1] - 1,chunk[2] + 2,chunk[3] + 2),rectangle)
+  world_area = world_object.load_area(loaded_rectangle)
+
+  offset = ((loaded_rectangle[0] - chunk[0]) * general.TILE_WIDTH,(loaded_rectangle[1] - chunk[1]) * general.TILE_HEIGHT)
+  width = chunk[2] * general.TILE_WIDTH
+  height = chunk[3] * general.TILE_HEIGHT
+  image = pygame.Surface((width,height),flags = pygame.SRCALPHA)
+  image.fill((255,255,255,0))
+  graphics.blit_list(image,graphics.ImageCompositor().make_terrain_blit_list(world_area),offset)
+
+  pixels = numpy.frombuffer(pixel_buffer,dtype = numpy.uint8).reshape((rectangle[3] * general.TILE_HEIGHT,rectangle[2] * general.TILE_WIDTH,4))
+  x = (chunk[0] - rectangle[0]) * general.TILE_WIDTH
+  y = (chunk[1] - rectangle[1]) * general.TILE_HEIGHT
+  pixels[y:y + height,x:x + width] = numpy.frombuffer(pygame.image.tostring(image,"RGBA"),dtype = numpy.uint8).reshape((height,width,4))
+
+  return chunk
+
+## Composites one chunk of the TerrainChunkCache and stores it to the
+#  disk cache.
+#
+#  @param chunk chunk coordinates in format (chunk_x,chunk_y)
+#  @return the chunk coordinates
+
+def worker_cache_chunk(chunk):
+  worker_state[3].get_chunk_image(chunk[0],chunk[1])
+  return chunk
+
+## Private function, runs the chunk jobs in a process pool.
+
+def run_pool(function, jobs, initargs, processes):
+  if processes == None:
+    processes = multiprocessing.cpu_count()
+
+  context = multiprocessing.get_context("spawn")
+  pool = context.Pool(processes,worker_initialise,initargs)
+
+  try:
+    for result in pool.imap_unordered(function,jobs,chunksize = 1):
+      pass
+  finally:
+    pool.close()
+    pool.join()
+
+## Reads the world size.
+#
+#  @return tuple (width,height) in tiles
+
+def get_world_size(world_filename):
+  world_object = world.World(world_filename)
+  return (world_object.width,world_object.height)
+
+## Prerenders the terrain of given world rectangle in parallel. The
+#  result is the same as make_terrain_image of the area.
+#
+#  @param world_filename name of the world file
+#  @param rectangle tile rectangle in format (x,y,width,height), if None,
+#         the whole world is baked (mind the image size)
+#  @param chunk_size chunk width and height in tiles
+#  @param processes number of the processes, if None, the number of CPUs
+#  @return Surface object with the terrain image
+
+def bake_terrain_image(world_filename, rectangle = None, chunk_size = CHUNK_SIZE, processes = None):
+  if rectangle == None:
+    rectangle = (0,0) + get_world_size(world_filename)
+
+  width = rectangle[2] * general.TILE_WIDTH
+  height = rectangle[3] * general.TILE_HEIGHT
+  pixel_buffer = multiprocessing.sharedctypes.RawArray("B",width * height * 4)
+
+  chunks = []
+
+  for y in range(rectangle[1],rectangle[1] + rectangle[3],chunk_size):
+    for x in range(rectangle[0],rectangle[0] + rectangle[2],chunk_size):
+      chunks.append(general.rectangle_intersection((x,y,chunk_size,chunk_size),rectangle))
+
+  run_pool(worker_composite_chunk,chunks,(world_filename,pixel_buffer,rectangle,None,chunk_size),processes)
+
+  # wraps the shared buffer without copying it, the surface keeps a reference to the buffer:
+  return pygame.image.frombuffer(memoryview(pixel_buffer),(width,height),"RGBA")
+
+## Prerenders the TerrainChunkCache chunks of given world rectangle in
+#  parallel and stores them to the disk cache, so that a TerrainChunkCache
+#  with the same chunk size and disk cache directory loads them instead
+#  of compositing. The chunks that are already cached are skipped.
+#
+#  @param world_filename name of the world file
+#  @param cache_directory TerrainDiskCache directory
+#  @param chunk_size chunk size of the TerrainChunkCache
+#  @param rectangle tile rectangle in format (x,y,width,height) whose
+#         chunks are baked, if None, the whole world is baked
+#  @param processes number of the processes, if None, the number of CPUs
+#  @return number of the chunks
+
+def bake_terrain_chunks(world_filename, cache_directory = general.CACHE_PATH, chunk_size = graphics.TerrainChunkCache.CHUNK_SIZE, rectangle = None, processes = None):
+  world_size = get_world_size(world_filename)
+
+  if rectangle == None:
+    rectangle = (0,0) + world_size
+
+  chunks = [(chunk_x,chunk_y)
+            for chunk_y in range(rectangle[1] // chunk_size,(min(rectangle[1] + rectangle[3],world_size[1]) - 1) // chunk_size + 1)
+            for chunk_x in range(rectangle[0] // chunk_size,(min(rectangle[0] + rectangle[2],world_size[0]) - 1) // chunk_size + 1)]
+
+  graphics.TerrainDiskCache(cache_directory)      # create the directory before the workers start
+  run_pool(worker_cache_chunk,chunks,(world_filename,None,None,cache_directory,chunk_size),processes)
+
+  return len(chunks)
+
+def main():
+  parser = argparse.ArgumentParser(description = "Prerenders the world terrain in parallel.")
+  parser.add_argument("world",help = "world file")
+  parser.add_argument("--image",help = "write the stitched terrain image to this file instead of filling the chunk disk cache")
+  parser.add_argument("--rectangle",type = int,nargs = 4,metavar = ("X","Y","WIDTH","HEIGHT"),help = "tile rectangle to bake (the whole world by default)")
+  parser.add_argument("--cache",default = general.CACHE_PATH,help = "chunk disk cache directory")
+  parser.add_argument("--chunk-size",type = int,help = "chunk size in tiles")
+  parser.add_argument("--processes",type = int,help = "number of processes (the number of CPUs by default)")
+  arguments = parser.parse_args()
+
+  rectangle = tuple(arguments.rectangle) if arguments.rectangle != None else None
+
+  if arguments.image != None:
+    image = bake_terrain_image(arguments.world,rectangle,arguments.chunk_size or CHUNK_SIZE,arguments.processes)
+    pygame.image.save(image,arguments.image)
+  else:
+    count = bake_terrain_chunks(arguments.world,arguments.cache,arguments.chunk_size or graphics.TerrainChunkCache.CHUNK_SIZE,rectangle,arguments.processes)
+    print(str(count) + " chunks baked")
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,314 @@
+## \file benchmark.py
+#
+#  This file contains a headless benchmark suite of the world loading,
+#  terrain compositing and rendering hot paths.
+#
+#  Run it from the src directory:
+#
+#    python3 benchmark.py --output results.json
+#    python3 benchmark.py --baseline baseline.json
+#
+#  Each measurement is the minimum time of several repeats in seconds.
+#  When a baseline file (an older output) is given, the results are
+#  compared to it and the exit status is 1 if any measurement is slower
+#  than the baseline by more than the tolerance.
+
+import os
+
+os.environ.setdefault("SDL_VIDEODRIVER","dummy")   # must be set before pygame is initialised
+
+import sys
+import time
+import json
+import shutil
+import argparse
+import platform
+import tempfile
+import pygame
+import numpy
+import general
+import world
+import graphics
+import tools
+
+## synthetic world sizes (width and height in tiles) by scale name
+
+SCALES = {"small": 128,"medium": 512,"large": 2048}
+
+## scales benchmarked by default
+
+DEFAULT_SCALES = ("small","medium")
+
+## area sizes (width,height) in tiles used by the area benchmarks, the
+#  middle one is the renderer active area size
+
+AREA_SIZES = ((16,16),(graphics.WorldRenderer.ACTIVE_AREA_WIDTH,graphics.WorldRenderer.ACTIVE_AREA_HEIGHT),(64,64))
+
+## default number of repeats of each measurement
+
+REPEATS = 3
+
+## number of frames rendered by the steady state render benchmark
+
+RENDER_FRAMES = 100
+
+## default allowed slowdown against the baseline (0.2 = 20 %)
+
+TOLERANCE = 0.2
+
+#=======================================================================
+
+## Generates a synthetic world file. The metadata sections (tiles, prop
+#  classes etc.) are taken from a template world file, the terrain is
+#  made of random patches of the template tiles and the props are
+#  scattered randomly. The same seed always gives the same world.
+#
+#  @param filename name of the world file to be created
+#  @param width world width in tiles
+#  @param height world height in tiles
+#  @param seed random seed
+#  @param template_filename name of the template world file
+
+def make_synthetic_world(filename, width, height, seed = 0, template_filename = None):
+  if template_filename == None:
+    template_filename = os.path.join(general.RESOURCE_PATH,"world")
+
+  random = numpy.random.RandomState(seed)
+  tile_ids = []
+  prop_class_ids = []
+  sections = []                    # (section name,lines) of the template
+
+  with open(template_filename,"r") as template_file:
+    lines = template_file.read().split("\n")
+
+  i = 0
+
+  while i < len(lines):
+    if lines[i].endswith(":"):
+      name = lines[i][:-1]
+      end = lines.index("end",i)
+      sections.append((name,lines[i + 1:end]))
+      i = end
+
+    i += 1
+
+  for name, section_lines in sections:
+    if name == "tiles":
+      tile_ids = [int(line.split()[0]) for line in section_lines if line.strip() != ""]
+    elif name == "prop_classes":
+      prop_class_ids = [int(line.split()[0]) for line in section_lines if line.strip() != ""]
+
+  # terrain: patches of 8x8 tiles with a noisy border
+  patch_size = 8
+  patches = random.choice(tile_ids,((height + patch_size - 1) // patch_size,(width + patch_size - 1) // patch_size))
+  ids = numpy.kron(patches,numpy.ones((patch_size,patch_size),dtype = patches.dtype))[:height,:width]
+  noise = random.random_sample((height,width)) < 0.05
+  ids[noise] = random.choice(tile_ids,int(noise.sum()))
+  variants = random.randint(0,4,(height,width))
+
+  # props: about one per 200 tiles
+  prop_count = width * height // 200 if len(prop_class_ids) != 0 else 0
+  prop_lines = []
+
+  for prop_id in range(prop_count):
+    prop_lines.append("%d %d %d %d" % (prop_id,prop_class_ids[random.randint(len(prop_class_ids))],random.randint(width),random.randint(height)))
+
+  with open(filename,"w") as world_file:
+    for name, section_lines in sections:
+      world_file.write(name + ":\n")
+
+      if name == "terrain":
+        world_file.write(str(width) + "\n" + str(height) + "\n")
+
+        for y in range(height):
+          row = numpy.empty(width * 2,dtype = ids.dtype)
+          row[0::2] = ids[y]
+          row[1::2] = variants[y]
+          world_file.write(" ".join(map(str,row.tolist())) + "\n")
+      elif name == "prop_instances":
+        world_file.write("".join(line + "\n" for line in prop_lines))
+      else:
+        world_file.write("".join(line + "\n" for line in section_lines))
+
+      world_file.write("end\n\n")
+
+#=======================================================================
+
+## Measures a function.
+#
+#  @param function function to be called without arguments
+#  @param repeats number of calls
+#  @return minimum call time in seconds
+
+def measure(function, repeats = REPEATS):
+  best = None
+
+  for i in range(repeats):
+    start = time.perf_counter()
+    function()
+    duration = time.perf_counter() - start
+
+    best = duration if best == None else min(best,duration)
+
+  return best
+
+## Benchmarks the world loading and the area operations on one world.
+#
+#  @param name world name used in the result names
+#  @param filename world file name
+#  @param repeats number of repeats of each measurement
+#  @return dictionary of the results, the key is the result name
+
+def benchmark_world(name, filename, repeats = REPEATS):
+  results = {}
+
+  world_object = world.World(filename)
+
+  results[name + "/parse"] = measure(lambda: world.World(filename),repeats)
+
+  for width, height in AREA_SIZES:
+    if width > world_object.width or height > world_object.height:
+      continue
+
+    rectangle = ((world_object.width - width) // 2,(world_object.height - height) // 2,width,height)
+    size_name = str(width) + "x" + str(height)
+    results[name + "/load_area/" + size_name] = measure(lambda: world_object.load_area(rectangle),repeats)
+
+    world_area = world_object.load_area(rectangle)
+    results[name + "/make_terrain_image/" + size_name] = measure(lambda: graphics.ImageCompositor().make_terrain_image(world_area),repeats)
+
+  return results
+
+## Benchmarks the renderer on one world: the active area switches along a
+#  scripted camera path (a diagonal run and back) and the steady state
+#  rendering.
+#
+#  @param name world name used in the result names
+#  @param filename world file name
+#  @param repeats number of repeats of the steady state measurement
+#  @return dictionary of the results, the key is the result name
+
+def benchmark_renderer(name, filename, repeats = REPEATS):
+  results = {}
+
+  world_object = world.World(filename)
+  renderer = graphics.WorldRenderer(world_object)
+
+  step = 20
+  max_x = world_object.width * general.TILE_WIDTH - graphics.WorldRenderer.VIEW_WIDTH
+  max_y = world_object.height * general.TILE_HEIGHT - graphics.WorldRenderer.VIEW_HEIGHT
+  path = [(min(i * step,max_x),min(i * step,max_y)) for i in range(0,max(max_x,max_y) // step + 1)]
+  path += list(reversed(path))
+  switch_times = []
+
+  for position in path:
+    area = world_object.active_area
+    start = time.perf_counter()
+    renderer.view_top_left = position
+    duration = time.perf_counter() - start
+
+    if world_object.active_area != area:
+      switch_times.append(duration)
+
+  if len(switch_times) != 0:
+    results[name + "/area_switch/mean"] = sum(switch_times) / len(switch_times)
+    results[name + "/area_switch/max"] = max(switch_times)
+
+  def render_frames():
+    for i in range(RENDER_FRAMES):
+      renderer.render()
+
+  results[name + "/render_frame"] = measure(render_frames,repeats) / RENDER_FRAMES
+
+  return results
+
+## Runs the whole benchmark suite.
+#
+#  @param scales names of the synthetic world scales (see SCALES)
+#  @param repeats number of repeats of each measurement
+#  @return dictionary of the results, the key is the result name, the
+#          item is time in seconds
+
+def run(scales = DEFAULT_SCALES, repeats = REPEATS):
+  pygame.init()
+  pygame.display.set_mode((graphics.WorldRenderer.VIEW_WIDTH,graphics.WorldRenderer.VIEW_HEIGHT))
+  graphics.TileImageLoader.preload([])     # build the atlas outside of the measurements
+
+  results = {}
+  worlds = [("resources",os.path.join(general.RESOURCE_PATH,"world"))]
+  directory = tempfile.mkdtemp()
+
+  try:
+    for scale in scales:
+      text_filename = os.path.join(directory,scale + ".txt")
+      binary_filename = os.path.join(directory,scale + ".bin")
+      make_synthetic_world(text_filename,SCALES[scale],SCALES[scale])
+      tools.text_world_to_binary(text_filename,binary_filename)
+      worlds.append((scale,text_filename))
+      worlds.append((scale + "_binary",binary_filename))
+
+    for name, filename in worlds:
+      results.update(benchmark_world(name,filename,repeats))
+
+    results.update(benchmark_renderer("resources",worlds[0][1],repeats))
+  finally:
+    shutil.rmtree(directory)
+
+  return results
+
+## Compares results to a baseline.
+#
+#  @param results current results
+#  @param baseline baseline results
+#  @param tolerance allowed relative slowdown
+#  @return list of tuples (name,baseline time,current time) of the
+#          regressed results
+
+def compare(results, baseline, tolerance = TOLERANCE):
+  regressions = []
+
+  for name in sorted(results):
+    if name in baseline and results[name] > baseline[name] * (1.0 + tolerance):
+      regressions.append((name,baseline[name],results[name]))
+
+  return regressions
+
+def main():
+  parser = argparse.ArgumentParser(description = "Runs the headless benchmark suite.")
+  parser.add_argument("--scales",nargs = "*",choices = sorted(SCALES),default = list(DEFAULT_SCALES),help = "synthetic world scales")
+  parser.add_argument("--repeats",type = int,default = REPEATS,help = "number of repeats of each measurement")
+  parser.add_argument("--output",help = "JSON file to write the results to")
+  parser.add_argument("--baseline",help = "JSON file with the results to compare to")
+  parser.add_argument("--tolerance",type = float,default = TOLERANCE,help = "allowed relative slowdown against the baseline")
+  arguments = parser.parse_args()
+
+  results = run(arguments.scales,arguments.repeats)
+
+  output = {"meta": {"time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                     "python": platform.python_version(),
+                     "pygame": pygame.version.ver,
+                     "numpy": numpy.__version__,
+                     "platform": platform.platform()},
+            "results": results}
+
+  for name in sorted(results):
+    print("%-50s %10.3f ms" % (name,results[name] * 1000.0))
+
+  if arguments.output != None:
+    with open(arguments.output,"w") as output_file:
+      json.dump(output,output_file,indent = 2,sort_keys = True)
+
+  if arguments.baseline != None:
+    with open(arguments.baseline,"r") as baseline_file:
+      baseline = json.load(baseline_file)["results"]
+
+    regressions = compare(results,baseline,arguments.tolerance)
+
+    for name, baseline_time, current_time in regressions:
+      print("REGRESSION %s: %.3f ms -> %.3f ms" % (name,baseline_time * 1000.0,current_time * 1000.0))
+
+    if len(regressions) != 0:
+      sys.exit(1)
+
+if __name__ == "__main__":
+  main()
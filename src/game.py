@@ -7,19 +7,30 @@ import general
 import world
 import pygame
 import math
+import profiler
+import loop
 
 #=======================================================================
 
 pygame.init()
 screen = pygame.display.set_mode((800,480))
 
-done = False
+## camera speed in pixels per second
+CAMERA_SPEED = 300.0
+
+## zoom change factor per second when zooming
+ZOOM_SPEED = 2.0
+
+## maximum size of the minimap overlay in pixels
+MINIMAP_SIZE = (200,160)
 
 w = world.World(general.RESOURCE_PATH + "/world")
 
 print(w)
 
-renderer = graphics.WorldRenderer(w)
+graphics.TileImageLoader.preload(w.tile_types.values())
+
+renderer = graphics.WorldRenderer(w,prefetch = True)
 
 renderer.view_top_left = (20,50)
 
@@ -27,13 +38,43 @@ go_up = False
 go_down = False
 go_left = False
 go_right = False
+zoom_in = False
+zoom_out = False
+
+## view zoom, see WorldRenderer.zoom
+camera_zoom = 1.0
+
+## camera position in the last two simulation steps, the rendered view is
+#  interpolated between them
+camera_previous = (20.0,50.0)
+camera_current = (20.0,50.0)
+
+show_profiler = False
+profiler_rectangle = None
+
+minimap = graphics.Minimap(w)
+## the largest minimap level that fits the overlay
+minimap_level = 0
+
+while minimap.get_level_size(minimap_level)[0] > MINIMAP_SIZE[0] or minimap.get_level_size(minimap_level)[1] > MINIMAP_SIZE[1]:
+  minimap_level += 1
+
+show_minimap = False
+
+def handle_events():
+  global go_up, go_down, go_left, go_right, zoom_in, zoom_out, show_profiler, show_minimap
 
-while not done:
   for event in pygame.event.get():
     if event.type == pygame.QUIT:
-      done = True
+      game_loop.stop()
     elif event.type == pygame.KEYDOWN:
-      if event.key == pygame.K_LEFT:
+      if event.key == pygame.K_F3 and profiler.ENABLED:
+        show_profiler = not show_profiler
+        renderer.invalidate()
+      elif event.key == pygame.K_m:
+        show_minimap = not show_minimap
+        renderer.invalidate()
+      elif event.key == pygame.K_LEFT:
         go_left = True
       elif event.key == pygame.K_RIGHT:
         go_right = True
@@ -41,6 +82,10 @@ while not done:
         go_up = True
       elif event.key == pygame.K_DOWN:
         go_down = True
+      elif event.key == pygame.K_PAGEUP:
+        zoom_in = True
+      elif event.key == pygame.K_PAGEDOWN:
+        zoom_out = True
     elif event.type == pygame.KEYUP:
       if event.key == pygame.K_LEFT:
         go_left = False
@@ -50,18 +95,102 @@ while not done:
         go_up = False
       elif event.key == pygame.K_DOWN:
         go_down = False
+      elif event.key == pygame.K_PAGEUP:
+        zoom_in = False
+      elif event.key == pygame.K_PAGEDOWN:
+        zoom_out = False
+
+def update(time_step):
+  global camera_previous, camera_current, camera_zoom
+
+  distance = CAMERA_SPEED * time_step / camera_zoom
+  x, y = camera_current
+
+  if zoom_in != zoom_out:
+    new_zoom = general.saturate(camera_zoom * ZOOM_SPEED ** (time_step if zoom_in else -time_step),graphics.WorldRenderer.MIN_ZOOM,graphics.WorldRenderer.MAX_ZOOM)
+
+    # keep the view center in place:
+    x += renderer.view_width / 2.0 * (1.0 / camera_zoom - 1.0 / new_zoom)
+    y += renderer.view_height / 2.0 * (1.0 / camera_zoom - 1.0 / new_zoom)
+    camera_zoom = new_zoom
 
   if go_up:
-    renderer.view_top_left = (renderer.view_top_left[0],renderer.view_top_left[1] - 5)
+    y -= distance
   if go_down:
-    renderer.view_top_left = (renderer.view_top_left[0],renderer.view_top_left[1] + 5)
+    y += distance
   if go_left:
-    renderer.view_top_left = (renderer.view_top_left[0] - 5,renderer.view_top_left[1])
+    x -= distance
   if go_right:
-    renderer.view_top_left = (renderer.view_top_left[0] + 5,renderer.view_top_left[1])
+    x += distance
+
+  camera_previous = camera_current
+  camera_current = (x,y)
+
+## Draws the minimap overlay with the view rectangle to the top right
+#  corner of the renderer canvas.
+#
+#  @return pygame.Rect of the overlay
+
+def draw_minimap():
+  canvas = renderer.canvas
+  size = minimap.get_level_size(minimap_level)
+  position = (canvas.get_width() - size[0] - 4,4)
+  rectangle = minimap.draw(canvas,minimap_level,(0,0),position,size)
+
+  scale = minimap.get_scale(minimap_level)
+  view = pygame.Rect(position[0] + int(renderer.view_top_left[0] / general.TILE_WIDTH * scale),position[1] + int(renderer.view_top_left[1] / general.TILE_HEIGHT * scale),
+                     max(int(canvas.get_width() / renderer.zoom / general.TILE_WIDTH * scale),1),max(int(canvas.get_height() / renderer.zoom / general.TILE_HEIGHT * scale),1))
+  pygame.draw.rect(canvas,(255,255,255),view.clip(rectangle),1)
+
+  return rectangle
+
+## Renders a frame and updates the changed parts of the screen.
+#
+#  @param interpolation interpolation factor between the last two
+#         simulation steps, see loop.GameLoop
+#  @return False if nothing has been drawn and no input is held (the game
+#          loop idles), otherwise True
+
+def render(interpolation):
+  global profiler_rectangle
+
+  view_top_left = (int(round(camera_previous[0] + (camera_current[0] - camera_previous[0]) * interpolation)),
+                   int(round(camera_previous[1] + (camera_current[1] - camera_previous[1]) * interpolation)))
+
+  if view_top_left != renderer.view_top_left:
+    renderer.view_top_left = view_top_left
+
+  renderer.zoom = camera_zoom
+
+  dirty_rectangles = renderer.render_dirty()
+
+  if show_profiler:
+    if profiler_rectangle != None:      # the overlay size may change
+      dirty_rectangles.append(profiler_rectangle)
+
+    profiler_rectangle = profiler.PROFILER.draw_overlay(renderer.canvas)
+    dirty_rectangles.append(profiler_rectangle)
+    renderer.invalidate(renderer.canvas_to_world_rectangle(profiler_rectangle))
+
+  if show_minimap:
+    minimap_rectangle = draw_minimap()
+    dirty_rectangles.append(minimap_rectangle)
+    renderer.invalidate(renderer.canvas_to_world_rectangle(minimap_rectangle))
+
+  if len(dirty_rectangles) == 0:      # nothing has changed, but a held key may move the view in the next frame
+    return go_up or go_down or go_left or go_right or zoom_in or zoom_out
+
+  with profiler.section("display.update"):
+    for rectangle in dirty_rectangles:
+      screen.blit(renderer.canvas,rectangle,rectangle)
+
+    pygame.display.update(dirty_rectangles)
 
-  screen.fill((255,255,255))
+  return True
 
-  screen.blit(renderer.render(),(0,0))
+game_loop = loop.GameLoop(update,render,handle_events,skip_render = True)
+game_loop.run()
 
-  pygame.display.flip()
+if profiler.ENABLED:
+  profiler.PROFILER.export_chrome_trace("../profile_trace.json")
+  profiler.PROFILER.export_csv("../profile_frames.csv")
@@ -11,6 +11,7 @@ SUBTILE_WIDTH = TILE_WIDTH / 2    # map subtile (corners) width
 SUBTILE_HEIGHT = TILE_HEIGHT / 2  # map subtile (corners) height
 
 RESOURCE_PATH = "../resources"
+CACHE_PATH = "../cache"         # directory for persistent caches
 
 RACE_HUMAN = 0
 
@@ -22,6 +23,10 @@ ANIMATION_IDLE_RIGHT = 101
 ANIMATION_IDLE_DOWN  = 102
 ANIMATION_IDLE_LEFT  = 103
 
+MOVEMENT_WALK = 200
+MOVEMENT_FLY  = 201
+MOVEMENT_SWIM = 202
+
 def saturate(value, minimum, maximum):
   if value < minimum:
     return minimum
@@ -38,3 +43,58 @@ def saturate(value, minimum, maximum):
 
 def begins_with(what,prefix):
   return what[:len(prefix)] == prefix
+
+## Computes the intersection of two rectangles.
+#
+#  @param rectangle1 rectangle in format (x,y,width,height)
+#  @param rectangle2 rectangle in format (x,y,width,height)
+#  @return the intersection rectangle in format (x,y,width,height) or
+#          None if the rectangles don't intersect
+
+def rectangle_intersection(rectangle1, rectangle2):
+  x1 = max(rectangle1[0],rectangle2[0])
+  y1 = max(rectangle1[1],rectangle2[1])
+  x2 = min(rectangle1[0] + rectangle1[2],rectangle2[0] + rectangle2[2])
+  y2 = min(rectangle1[1] + rectangle1[3],rectangle2[1] + rectangle2[3])
+
+  if x2 <= x1 or y2 <= y1:
+    return None
+
+  return (x1,y1,x2 - x1,y2 - y1)
+
+## Computes the part of a rectangle that is not covered by another
+#  rectangle.
+#
+#  @param rectangle rectangle in format (x,y,width,height)
+#  @param covered rectangle in format (x,y,width,height) to be
+#         subtracted from rectangle
+#  @return list of non-overlapping rectangles in format (x,y,width,
+#          height) that together make up the difference (at most 4
+#          bands: upper, lower, left and right)
+
+def rectangle_difference(rectangle, covered):
+  intersection = rectangle_intersection(rectangle,covered)
+
+  if intersection == None:
+    return [rectangle]
+
+  result = []
+
+  top = intersection[1] - rectangle[1]
+  bottom = rectangle[1] + rectangle[3] - (intersection[1] + intersection[3])
+  left = intersection[0] - rectangle[0]
+  right = rectangle[0] + rectangle[2] - (intersection[0] + intersection[2])
+
+  if top > 0:
+    result.append((rectangle[0],rectangle[1],rectangle[2],top))
+
+  if bottom > 0:
+    result.append((rectangle[0],intersection[1] + intersection[3],rectangle[2],bottom))
+
+  if left > 0:
+    result.append((rectangle[0],intersection[1],left,intersection[3]))
+
+  if right > 0:
+    result.append((intersection[0] + intersection[2],intersection[1],right,intersection[3]))
+
+  return result
\ No newline at end of file
@@ -11,11 +11,142 @@ import draw
 import math
 import random
 import time
+import numpy
+import concurrent.futures
+import collections
+import hashlib
+import struct
+import threading
+import profiler
+
+## Blits a list of blits to a surface. A single Surface.blits call is
+#  used if the pygame version has it (1.9.4+).
+#
+#  @param surface Surface to blit to
+#  @param blits list of blits in format (source Surface,(x,y),area
+#         Rect), e.g. made by ImageCompositor.make_terrain_blit_list
+#  @param offset if not None, (x,y) offset added to all the blit
+#         positions
+
+def blit_list(surface, blits, offset = None):
+  if offset != None:
+    blits = [(source,(position[0] + offset[0],position[1] + offset[1]),area) for source, position, area in blits]
+
+  if profiler.ENABLED:
+    profiler.count("blits",len(blits))
+
+  if hasattr(surface,"blits"):
+    surface.blits(blits,doreturn = False)
+  else:
+    for source, position, area in blits:
+      surface.blit(source,position,area)
+
+#=======================================================================
+
+## Packs resource images into a few big atlas surfaces, so that they are
+#  all loaded at once (e.g. at startup) instead of one by one when they
+#  are first needed, and so that the blits mostly share one source
+#  surface.
+#
+#  The images are packed in shelves (rows) sorted by height. Each image
+#  is identified by its file name without the extension, e.g.
+#  "tile_grass".
+
+class TextureAtlas:
+
+  ## atlas surface width and height in pixels
+
+  ATLAS_SIZE = 2048
+
+  ## prefixes of the resource files that are packed by default
+
+  PREFIXES = ("tile_","prop_","shadow_")
+
+  def __init_attributes(self):
+    ## the atlas surfaces
+    self.surfaces = []
+    ## images packed in the atlas, the key is the image name, the item
+    #  is a tuple (index to surfaces,Rect)
+    self.rects = {}
+
+  def __init__(self):
+    self.__init_attributes()
+
+  ## Loads the images from the resource directory and packs them.
+  #
+  #  @param resource_path path to the resource directory
+  #  @param prefixes only the PNG files whose names begin with one of
+  #         these prefixes are packed
+
+  def build(self, resource_path = general.RESOURCE_PATH, prefixes = PREFIXES):
+    images = []
+
+    for filename in sorted(os.listdir(resource_path)):
+      if filename.endswith(".png") and filename.startswith(prefixes):
+        images.append((filename[:-4],pygame.image.load(os.path.join(resource_path,filename)).convert_alpha()))
+
+    images.sort(key = lambda item: -item[1].get_height())
+
+    x = 0
+    y = 0
+    shelf_height = 0
+    placement = []
+
+    for name, image in images:
+      width, height = image.get_size()
+
+      if width > TextureAtlas.ATLAS_SIZE or height > TextureAtlas.ATLAS_SIZE:   # too big, gets its own surface
+        self.surfaces.append(image)
+        self.rects[name] = (len(self.surfaces) - 1,pygame.Rect(0,0,width,height))
+        continue
+
+      if x + width > TextureAtlas.ATLAS_SIZE:       # next shelf
+        x = 0
+        y += shelf_height
+        shelf_height = 0
+
+      if len(placement) == 0 or y + height > TextureAtlas.ATLAS_SIZE:   # next atlas surface
+        placement.append([])
+        x = 0
+        y = 0
+        shelf_height = 0
+
+      placement[-1].append((name,image,pygame.Rect(x,y,width,height)))
+      x += width
+      shelf_height = max(shelf_height,height)
+
+    for items in placement:
+      atlas_width = max(rect.right for name, image, rect in items)
+      atlas_height = max(rect.bottom for name, image, rect in items)
+      surface = pygame.Surface((atlas_width,atlas_height),flags = pygame.SRCALPHA).convert_alpha()
+      surface.fill((0,0,0,0))
+
+      for name, image, rect in items:
+        surface.blit(image,rect,special_flags = pygame.BLEND_RGBA_MAX)   # copy including the alpha
+        self.rects[name] = (len(self.surfaces),rect)
+
+      self.surfaces.append(surface)
+
+  ## Checks if the atlas contains an image with given name.
+
+  def has_image(self, name):
+    return name in self.rects
+
+  ## Gets the packed image with given name.
+  #
+  #  @return subsurface of an atlas surface
+
+  def get_image(self, name):
+    index, rect = self.rects[name]
+    return self.surfaces[index].subsurface(rect)
+
+#=======================================================================
 
 ## Serves as a proxy image loader for tile images - all tile images
 #  access should be done via this class.
 #
-#  The class uses lazy image loading.
+#  The class uses lazy image loading, unless the images are preloaded
+#  with preload().
 
 class TileImageLoader:
 
@@ -23,6 +154,11 @@ class TileImageLoader:
 
   tile_images = {}
 
+  ## TextureAtlas the tile images are taken from, if None (or the image
+  #  is not in it), the tile image is loaded from its own file.
+
+  atlas = None
+
   ## Gets an TileImageContainer of a tile with given tile_id.
   #
   #  @param tile_type TileType object to get the image for
@@ -30,10 +166,29 @@ class TileImageLoader:
 
   def get_tile_image(tile_type):
     if not (tile_type.identifier in TileImageLoader.tile_images):  # lazy image loading
-      TileImageLoader.tile_images[tile_type.identifier] = TileImageContainer(os.path.join(general.RESOURCE_PATH,"tile_" + tile_type.name + ".png"))
+      name = "tile_" + tile_type.name
+
+      if TileImageLoader.atlas != None and TileImageLoader.atlas.has_image(name):
+        TileImageLoader.tile_images[tile_type.identifier] = TileImageContainer(image = TileImageLoader.atlas.get_image(name))
+      else:
+        TileImageLoader.tile_images[tile_type.identifier] = TileImageContainer(os.path.join(general.RESOURCE_PATH,name + ".png"))
 
     return TileImageLoader.tile_images[tile_type.identifier]
 
+  ## Builds the texture atlas (if there is none yet) and prepares the
+  #  images of given tile types, so that no image is loaded during
+  #  rendering.
+  #
+  #  @param tile_types iterable of TileType objects
+
+  def preload(tile_types):
+    if TileImageLoader.atlas == None:
+      TileImageLoader.atlas = TextureAtlas()
+      TileImageLoader.atlas.build()
+
+    for tile_type in tile_types:
+      TileImageLoader.get_tile_image(tile_type)
+
 #=======================================================================
 
 ## Holds images (i.e. main tile variations, corners etc.) of a game
@@ -49,6 +204,16 @@ class TileImageLoader:
 #  be drawn a corner of K with identifier corner_UL_01.
 
 class TileImageContainer:
+
+  ## Names of the corner images, the image codes used in blit lists are
+  #  0 - 3 for the main tile variants and 4 + index to this list for the
+  #  corners (see sources).
+
+  CORNER_NAMES = ["corner_UL_00","corner_UL_01","corner_UL_10","corner_UL_11",
+                  "corner_UR_00","corner_UR_01","corner_UR_10","corner_UR_11",
+                  "corner_DL_00","corner_DL_01","corner_DL_10","corner_DL_11",
+                  "corner_DR_00","corner_DR_01","corner_DR_10","corner_DR_11"]
+
   def init(self):
     self.main_tile = [None,None,None,None] # main tile variations or alternatively animation frames
     self.corner_UL_00 = None
@@ -71,14 +236,30 @@ class TileImageContainer:
     self.corner_DR_10 = None
     self.corner_DR_11 = None
 
-  def __init__(self,filename):
+    ## blit sources of the images indexed by the image code (see
+    #  CORNER_NAMES), the items are tuples (Surface,area Rect) where the
+    #  Surface is the top level surface the image is part of
+    self.sources = []
+
+  ## Initialises the container with images from a file or a surface.
+  #
+  #  @param filename name of the tile image file to load
+  #  @param image tile image Surface (e.g. a part of a TextureAtlas) to
+  #         be used instead of loading a file
+
+  def __init__(self, filename = None, image = None):
     self.init()
-    self.load_from_file(filename)
+
+    if image != None:
+      self.load_from_surface(image)
+    else:
+      self.load_from_file(filename)
 
   def load_from_file(self,filename):
     image = pygame.image.load(filename)
-    image = image.convert_alpha()
+    self.load_from_surface(image.convert_alpha())
 
+  def load_from_surface(self,image):
     self.main_tile[0] = image.subsurface(general.TILE_WIDTH * 2,0,general.TILE_WIDTH,general.TILE_HEIGHT)
     self.main_tile[1] = image.subsurface(general.TILE_WIDTH * 3,0,general.TILE_WIDTH,general.TILE_HEIGHT)
     self.main_tile[2] = image.subsurface(general.TILE_WIDTH * 2,general.TILE_HEIGHT,general.TILE_WIDTH,general.TILE_HEIGHT)
@@ -101,22 +282,53 @@ class TileImageContainer:
     self.corner_DR_10 = image.subsurface(0,28,general.SUBTILE_WIDTH,general.SUBTILE_HEIGHT)
     self.corner_DR_11 = image.subsurface(general.SUBTILE_WIDTH * 2,general.SUBTILE_HEIGHT * 2,general.SUBTILE_WIDTH,general.SUBTILE_HEIGHT)
 
+    self.sources = []
+
+    for subimage in self.main_tile + [getattr(self,name) for name in TileImageContainer.CORNER_NAMES]:
+      self.sources.append((subimage.get_abs_parent(),pygame.Rect(subimage.get_abs_offset(),subimage.get_size())))
+
 #=======================================================================
 
 ## Assembles images out of image resources.
+#
+#  The character images are memoized: the decoded resource images are
+#  kept for the whole run and the composited character images are kept in
+#  an LRU cache shared by all ImageCompositor objects.
 
 class ImageCompositor:
 
-  ## Makes a character image with given body, head, animation type, frame
-  #  and gear
-  #
-  #  @param self object pointer
-  #  @param body_name resource name of the body
+  ## maximum number of composited character images kept in the cache
+
+  CHARACTER_CACHE_SIZE = 256
+
+  ## decoded resource images used for compositing, the key is the file
+  #  name, the item is a Surface object
+
+  source_images = {}
+
+  ## composited character images in LRU order (the least recently used
+  #  first), the key is (race,gender,head,animation,frame,equipment)
+
+  character_images = collections.OrderedDict()
+
+  ## Private method, gets a decoded resource image, the file is only
+  #  loaded on the first call.
   #
-  #  @return Surface object - the generated image
+  #  @param filename file name of the image in the resource directory
+  #  @return Surface object, it must not be modified
+
+  def __get_source_image(self, filename):
+    try:
+      return ImageCompositor.source_images[filename]
+    except KeyError:
+      image = pygame.image.load(os.path.join(general.RESOURCE_PATH,filename))
+      ImageCompositor.source_images[filename] = image
+      return image
 
-  def make_character_image(self, race, gender, head_number, animation_type, animation_frame):
+  ## Private method, composites a character image out of the resource
+  #  images, see make_character_image.
 
+  def __compose_character_image(self, race, gender, head_number, animation_type, animation_frame, equipment):
     animation_string = ""
     direction_string = ""
     race_string = ""
@@ -149,22 +361,88 @@ class ImageCompositor:
       direction_string = "left"
       head_coordinates = (3,0)
 
-    image_head = pygame.image.load(os.path.join(general.RESOURCE_PATH,"character_" + race_string + "_" + gender_string + "_head_" + str(head_number) + "_" + direction_string + ".png"))
+    prefix = "character_" + race_string + "_" + gender_string
+
+    image_head = self.__get_source_image(prefix + "_head_" + str(head_number) + "_" + direction_string + ".png")
 
     if animation_type in (general.ANIMATION_IDLE_RIGHT,general.ANIMATION_IDLE_LEFT):
-      image1 = pygame.image.load(os.path.join(general.RESOURCE_PATH,"character_" + race_string + "_" + gender_string + "_body_" + animation_string + "_" + direction_string + "_layer1.png"))
-      image2 = pygame.image.load(os.path.join(general.RESOURCE_PATH,"character_" + race_string + "_" + gender_string + "_body_" + animation_string + "_" + direction_string + "_layer2.png"))
-      image3 = pygame.image.load(os.path.join(general.RESOURCE_PATH,"character_" + race_string + "_" + gender_string + "_body_" + animation_string + "_" + direction_string + "_layer3.png"))
+      image1 = self.__get_source_image(prefix + "_body_" + animation_string + "_" + direction_string + "_layer1.png").copy()
+      image2 = self.__get_source_image(prefix + "_body_" + animation_string + "_" + direction_string + "_layer2.png")
+      image3 = self.__get_source_image(prefix + "_body_" + animation_string + "_" + direction_string + "_layer3.png")
 
       image1.blit(image2,(0,0))
       image1.blit(image3,(0,0))
       image1.blit(image_head,head_coordinates)
     else:
-      image1 = pygame.image.load(os.path.join(general.RESOURCE_PATH,"character_" + race_string + "_" + gender_string + "_body_" + animation_string + "_" + direction_string + ".png"))
+      image1 = self.__get_source_image(prefix + "_body_" + animation_string + "_" + direction_string + ".png").copy()
       image1.blit(image_head,head_coordinates)
 
+    for equipment_name in equipment:
+      image1.blit(self.__get_source_image(equipment_name + ".png"),(0,0))
+
     return image1
 
+  ## Makes a character image with given body, head, animation type, frame
+  #  and gear. The image is only composited if it is not in the cache.
+  #
+  #  @param self object pointer
+  #  @param race race constant (see general.RACE_HUMAN etc.)
+  #  @param gender gender constant (see general.GENDER_MALE etc.)
+  #  @param head_number number of the head image
+  #  @param animation_type animation constant (see
+  #         general.ANIMATION_IDLE_UP etc.)
+  #  @param animation_frame animation frame number
+  #  @param equipment tuple of resource names (without the extension) of
+  #         the equipment images drawn over the character in given order
+  #
+  #  @return Surface object - the generated image, it is shared through
+  #          the cache, so it must not be modified
+
+  def make_character_image(self, race, gender, head_number, animation_type, animation_frame, equipment = ()):
+    key = (race,gender,head_number,animation_type,animation_frame,tuple(equipment))
+
+    try:
+      image = ImageCompositor.character_images.pop(key)
+
+      if profiler.ENABLED:
+        profiler.count("character_cache_hits")
+    except KeyError:
+      image = self.__compose_character_image(race,gender,head_number,animation_type,animation_frame,key[5])
+
+      if profiler.ENABLED:
+        profiler.count("character_cache_misses")
+
+    ImageCompositor.character_images[key] = image      # (re)insert as the most recently used
+
+    while len(ImageCompositor.character_images) > ImageCompositor.CHARACTER_CACHE_SIZE:
+      ImageCompositor.character_images.popitem(last = False)
+
+    return image
+
+  ## Composites the images of given characters in advance (e.g. of all
+  #  the NPCs in the active area when it is loaded), so that rendering
+  #  them doesn't load anything.
+  #
+  #  @param characters iterable of tuples with make_character_image
+  #         arguments, i.e. (race,gender,head,animation,frame) or
+  #         (race,gender,head,animation,frame,equipment)
+
+  def prewarm_character_images(self, characters):
+    for character in characters:
+      self.make_character_image(*character)
+
+  ## Names of the TileImageContainer corner images that can appear in a
+  #  terrain blit list, their index in this list plus 4 (the main tile
+  #  variants go first) is the image code used by
+  #  __make_terrain_blit_codes.
+
+  CORNER_NAMES = TileImageContainer.CORNER_NAMES
+
+  ## minimum ratio of the animated tiles of one type to their bounding
+  #  rectangle area for which make_animation_layers bakes a layer
+
+  MIN_LAYER_COVERAGE = 0.25
+
   ## Helper private method that returns the priority of given tile type
   #  or 0 if the argument is not of TileType class.
 
@@ -174,147 +452,1040 @@ class ImageCompositor:
     except Exception:
       return 0
 
-  ## Helper private method, returns ordered list of all tile priorities
-  #  that appear in given TerrainArray object.
-
-  def __make_tile_priority_list(self, terrain_array):
-    result = []
+  ## Helper private method, returns the image code (see CORNER_NAMES)
+  #  of given corner image.
 
-    for j in range(terrain_array.height):
-      for i in range(terrain_array.width):
-        tile_type = terrain_array.get_tile_type(i,j)
+  def __corner_code(self, corner_name):
+    return ImageCompositor.CORNER_NAMES.index(corner_name) + 4
 
-        if tile_type != None and tile_type.animated:    # this maked animated tiles not render, they are drawn differently (the cannot be prerendered because they are changing constantly)
-          continue
+  ## Helper private method, computes all the blits needed to draw the
+  #  terrain of given WorldArea object with whole-array operations.
+  #
+  #  A priority grid of the area is made first, the neighbour priorities
+  #  are then compared for the whole grid at once (the area is extended
+  #  by its edge tiles, just like get_tile_type does) for each of the
+  #  13 possible blits of a tile (main tile, 4 corners and 2 halves of 4
+  #  borders).
+  #
+  #  @param terrain_array WorldArea object to be drawn
+  #  @return tuple (tile_types,codes) where tile_types is a list of
+  #          TileType objects and codes is a 2D numpy array with
+  #          one row per blit in drawing order, the columns are: tile
+  #          x, tile y, index to tile_types, image code (0 - 3 for main
+  #          tile variants, see CORNER_NAMES for the rest) and blit kind
+  #          (0 to 12, the position of the blit relative to the tile)
+
+  def __make_terrain_blit_codes(self, terrain_array):
+    tile_ids = terrain_array.tile_ids
+    unique_ids, inverse = numpy.unique(tile_ids,return_inverse = True)
+    inverse = inverse.reshape(tile_ids.shape)
+    tile_types = [terrain_array.tile_types.get(int(tile_id)) for tile_id in unique_ids]
+
+    priorities = numpy.array([self.__tile_priority(tile_type) for tile_type in tile_types],dtype = numpy.int32)
+    present = numpy.array([tile_type != None for tile_type in tile_types],dtype = bool)
+    animated = numpy.array([tile_type != None and tile_type.animated for tile_type in tile_types],dtype = bool)
+
+    # animated tiles are not prerendered as they are changing constantly,
+    # so only the priority layers with a non-animated (or missing) tile
+    # are drawn:
+    used = numpy.zeros(len(tile_types),dtype = bool)
+    used[numpy.unique(inverse)] = True
+    layers = numpy.unique(priorities[used & ~animated])
+
+    p = priorities[inverse]
+    padded = numpy.pad(p,1,mode = "edge")
+    width, height = p.shape
+
+    def neighbour(dx,dy):
+      return padded[1 + dx:1 + dx + width,1 + dy:1 + dy + height]
+
+    up = p > neighbour(0,-1)
+    down = p > neighbour(0,1)
+    left = p > neighbour(-1,0)
+    right = p > neighbour(1,0)
+    up_left = p > neighbour(-1,-1)
+    up_right = p > neighbour(1,-1)
+    down_left = p > neighbour(-1,1)
+    down_right = p > neighbour(1,1)
+
+    in_layers = numpy.array([priority in layers for priority in priorities],dtype = bool)
+    drawn = (present & in_layers)[inverse]
+
+    def choose(condition,code_true,code_false):
+      return numpy.where(condition,self.__corner_code(code_true),self.__corner_code(code_false))
+
+    # (condition, image code) for each blit kind in the order they are drawn for a tile:
+    kinds = [
+      (drawn,terrain_array.tile_variants.astype(numpy.int32)),                       # main tile
+      (drawn & up_left & up & left,self.__corner_code("corner_DR_00")),             # UL corner
+      (drawn & up_right & up & right,self.__corner_code("corner_DL_00")),           # UR corner
+      (drawn & down_right & down & right,self.__corner_code("corner_UL_00")),       # DR corner
+      (drawn & down_left & down & left,self.__corner_code("corner_UR_00")),         # DL corner
+      (drawn & up,choose(up_left,"corner_DL_01","corner_DL_11")),                   # upper border, left
+      (drawn & up,choose(up_right,"corner_DR_01","corner_DR_11")),                  # upper border, right
+      (drawn & left,choose(up_left,"corner_UR_10","corner_UR_11")),                 # left border, up
+      (drawn & left,choose(down_left,"corner_DR_10","corner_DR_11")),               # left border, down
+      (drawn & right,choose(up_right,"corner_UL_10","corner_UL_11")),               # right border, up
+      (drawn & right,choose(down_right,"corner_DL_10","corner_DL_11")),             # right border, down
+      (drawn & down,choose(down_left,"corner_UL_01","corner_UL_11")),               # lower border, left
+      (drawn & down,choose(down_right,"corner_UR_01","corner_UR_11"))]              # lower border, right
+
+    rows = []
+
+    for kind in range(len(kinds)):
+      condition, code = kinds[kind]
+      xs, ys = numpy.nonzero(condition)
+      code = code[xs,ys] if isinstance(code,numpy.ndarray) else numpy.full(len(xs),code,dtype = numpy.int64)
+      rows.append(numpy.column_stack([xs,ys,inverse[xs,ys],code,numpy.full(len(xs),kind,dtype = numpy.int64),p[xs,ys]]))
+
+    codes = numpy.concatenate(rows)
+
+    # draw order: priority layer, row, column, blit kind:
+    codes = codes[numpy.lexsort((codes[:,4],codes[:,0],codes[:,1],codes[:,5]))]
+
+    return (tile_types,codes[:,:5])
+
+  ## Makes a list of blits that draw the terrain of given WorldArea
+  #  object.
+  #
+  #  @param terrain_array WorldArea object to be drawn
+  #  @param rectangle if not None, only the blits of the tiles in this
+  #         rectangle (in format (x,y,width,height) in tiles) are
+  #         returned, note that the tiles draw their borders also over
+  #         the neighbouring tiles
+  #  @return list of (Surface,(x,y),area Rect) tuples in the order in
+  #          which they have to be blitted (see blit_list)
+
+  def make_terrain_blit_list(self, terrain_array, rectangle = None):
+    tile_types, codes = self.__make_terrain_blit_codes(terrain_array)
+
+    if rectangle != None:
+      codes = codes[(codes[:,0] >= rectangle[0]) & (codes[:,0] < rectangle[0] + rectangle[2]) &
+                    (codes[:,1] >= rectangle[1]) & (codes[:,1] < rectangle[1] + rectangle[3])]
+
+    images = []                         # images[tile type index][image code]
+
+    for tile_type in tile_types:
+      if tile_type == None:
+        images.append(None)
+        continue
+
+      images.append(TileImageLoader.get_tile_image(tile_type).sources)
+
+    # blit positions relative to the tile top left corner for each blit kind:
+    offsets = [(0,0),
+               (-general.SUBTILE_WIDTH,-general.SUBTILE_HEIGHT),
+               (general.TILE_WIDTH,-general.SUBTILE_HEIGHT),
+               (general.TILE_WIDTH,general.TILE_HEIGHT),
+               (-general.SUBTILE_WIDTH,general.TILE_HEIGHT),
+               (0,-general.SUBTILE_HEIGHT),
+               (general.SUBTILE_WIDTH,-general.SUBTILE_HEIGHT),
+               (-general.SUBTILE_WIDTH,0),
+               (-general.SUBTILE_WIDTH,general.SUBTILE_HEIGHT),
+               (general.TILE_WIDTH,0),
+               (general.TILE_WIDTH,general.SUBTILE_HEIGHT),
+               (0,general.TILE_HEIGHT),
+               (general.SUBTILE_WIDTH,general.TILE_HEIGHT)]
 
-        priority = self.__tile_priority(tile_type)
+    result = []
 
-        if not priority in result:
-          result.append(priority)
+    for x, y, tile_index, code, kind in codes.tolist():
+      offset = offsets[kind]
+      source, area = images[tile_index][code]
+      result.append((source,(x * general.TILE_WIDTH + offset[0],y * general.TILE_HEIGHT + offset[1]),area))
 
-    return sorted(result)
+    return result
 
   ## Makes a terrain image.
   #
   #  @param terrain_array TerrainArray object to be drawn
   #  @return Surface object - the generated image
 
+  @profiler.timed("ImageCompositor.make_terrain_image")
   def make_terrain_image(self, terrain_array):
     result_image = pygame.Surface((terrain_array.width * general.TILE_WIDTH, terrain_array.height * general.TILE_HEIGHT),flags = pygame.SRCALPHA)
     result_image.fill((255,255,255,0))
 
-    for current_priority in self.__make_tile_priority_list(terrain_array):      # draw the terrain in layers
-      for j in range(terrain_array.height):
-        for i in range(terrain_array.width):
-          tile_type = terrain_array.get_tile_type(i,j)
+    blit_list(result_image,self.make_terrain_blit_list(terrain_array))
 
-          if tile_type == None:
-            continue
+    return result_image
 
-          tile_priority = tile_type.priority
+  ## Redraws a part of a terrain image made by make_terrain_image.
+  #
+  #  @param terrain_image terrain image (Surface) of terrain_array
+  #  @param terrain_array WorldArea object the image is drawn for
+  #  @param rectangle rectangle of tiles to be redrawn in format
+  #         (x,y,width,height)
 
-          if tile_priority != current_priority:   # only draw one priority at a time
-            continue
+  def redraw_terrain_image(self, terrain_image, terrain_array, rectangle):
+    # the tiles around the rectangle draw their borders into it too:
+    blit_rectangle = general.rectangle_intersection((rectangle[0] - 1,rectangle[1] - 1,rectangle[2] + 2,rectangle[3] + 2),(0,0,terrain_array.width,terrain_array.height))
 
-          variant = terrain_array.get_tile_variant(i,j)
-          tile_id = tile_type.identifier
+    if blit_rectangle == None:
+      return
 
-          tile_picture = TileImageLoader.get_tile_image(tile_type)
+    previous_clip = terrain_image.get_clip()
+    terrain_image.set_clip(pygame.Rect(rectangle[0] * general.TILE_WIDTH,rectangle[1] * general.TILE_HEIGHT,rectangle[2] * general.TILE_WIDTH,rectangle[3] * general.TILE_HEIGHT))
+    terrain_image.fill((255,255,255,0))
 
-          # draw the main tile:
-          result_image.blit(tile_picture.main_tile[variant],(i * general.TILE_WIDTH,j * general.TILE_HEIGHT))
+    blit_list(terrain_image,self.make_terrain_blit_list(terrain_array,blit_rectangle))
 
-          # draw corners and borders:
+    terrain_image.set_clip(previous_clip)
 
-          # UL corner:
-          if tile_priority > self.__tile_priority(terrain_array.get_tile_type(i - 1,j - 1)) and \
-             tile_priority > self.__tile_priority(terrain_array.get_tile_type(i,j - 1)) and \
-             tile_priority > self.__tile_priority(terrain_array.get_tile_type(i - 1,j)):
-           result_image.blit(tile_picture.corner_DR_00,(i * general.TILE_WIDTH - general.SUBTILE_WIDTH,j * general.TILE_HEIGHT - general.SUBTILE_HEIGHT))
+  ## Updates a terrain image after the terrain array has been shifted
+  #  (e.g. when the world active area has moved). The image content is
+  #  scrolled and only the newly exposed tiles are drawn, plus one tile
+  #  wide seam around them where the borders may have changed. The
+  #  tiles at the terrain array edge the image has been scrolled away
+  #  from are redrawn too, as their neighbours are now outside the array.
+  #
+  #  @param terrain_image terrain image (Surface) made for the terrain
+  #         array before the shift, it is updated in place
+  #  @param terrain_array the shifted WorldArea object, it has to have
+  #         the same size as before the shift
+  #  @param shift the terrain array shift in tiles in format (x,y), e.g.
+  #         (1,0) means the new terrain array begins one tile to the
+  #         right of the old one
+
+  def scroll_terrain_image(self, terrain_image, terrain_array, shift):
+    terrain_image.scroll(-shift[0] * general.TILE_WIDTH,-shift[1] * general.TILE_HEIGHT)
+
+    whole_area = (0,0,terrain_array.width,terrain_array.height)
+    kept_area = general.rectangle_intersection(whole_area,(-shift[0],-shift[1],terrain_array.width,terrain_array.height))
+
+    if kept_area == None:
+      self.redraw_terrain_image(terrain_image,terrain_array,whole_area)
+      return
+
+    for strip in general.rectangle_difference(whole_area,kept_area):
+      self.redraw_terrain_image(terrain_image,terrain_array,(strip[0] - 1,strip[1] - 1,strip[2] + 2,strip[3] + 2))
+
+    if shift[0] != 0:
+      self.redraw_terrain_image(terrain_image,terrain_array,(0 if shift[0] > 0 else terrain_array.width - 1,0,1,terrain_array.height))
+
+    if shift[1] != 0:
+      self.redraw_terrain_image(terrain_image,terrain_array,(0,0 if shift[1] > 0 else terrain_array.height - 1,terrain_array.width,1))
+
+  ## Bakes the animation frames of the animated tiles in given area into
+  #  layers, so that all the tiles of one animated tile type can be drawn
+  #  with a single blit per frame. A layer only covers the bounding
+  #  rectangle of the tiles of its type, tile types whose tiles are too
+  #  scattered (see MIN_LAYER_COVERAGE) are not baked.
+  #
+  #  @param terrain_array WorldArea object
+  #  @return dictionary whose key is the tile id and the item is a tuple
+  #          ((x,y),frames), where (x,y) is the layer position relative
+  #          to the area in pixels and frames is a list of Surface
+  #          objects, one for each animation frame
 
-          # UR corner
-          if tile_priority > self.__tile_priority(terrain_array.get_tile_type(i + 1,j - 1)) and \
-             tile_priority > self.__tile_priority(terrain_array.get_tile_type(i,j - 1)) and \
-             tile_priority > self.__tile_priority(terrain_array.get_tile_type(i + 1,j)):
-            result_image.blit(tile_picture.corner_DL_00,(i * general.TILE_WIDTH + general.TILE_WIDTH,j * general.TILE_HEIGHT - general.SUBTILE_HEIGHT))
+  def make_animation_layers(self, terrain_array):
+    result = {}
 
-          # DR corner
-          if tile_priority > self.__tile_priority(terrain_array.get_tile_type(i + 1,j + 1)) and \
-             tile_priority > self.__tile_priority(terrain_array.get_tile_type(i,j + 1)) and \
-             tile_priority > self.__tile_priority(terrain_array.get_tile_type(i + 1,j)):
-            result_image.blit(tile_picture.corner_UL_00,(i * general.TILE_WIDTH + general.TILE_WIDTH,j * general.TILE_HEIGHT + general.TILE_HEIGHT))
+    for tile_id, (xs, ys) in terrain_array.get_animated_tiles().items():
+      left = int(xs.min())
+      top = int(ys.min())
+      width = int(xs.max()) - left + 1
+      height = int(ys.max()) - top + 1
 
-          # DL corner
-          if tile_priority > self.__tile_priority(terrain_array.get_tile_type(i - 1,j + 1)) and \
-             tile_priority > self.__tile_priority(terrain_array.get_tile_type(i,j + 1)) and \
-             tile_priority > self.__tile_priority(terrain_array.get_tile_type(i - 1,j)):
-            result_image.blit(tile_picture.corner_UR_00,(i * general.TILE_WIDTH - general.SUBTILE_WIDTH,j * general.TILE_HEIGHT + general.TILE_HEIGHT))
+      if len(xs) < width * height * ImageCompositor.MIN_LAYER_COVERAGE:
+        continue
 
-          # upper border
-          if tile_priority > self.__tile_priority(terrain_array.get_tile_type(i,j - 1)):
-            if tile_priority > self.__tile_priority(terrain_array.get_tile_type(i - 1,j - 1)):  # left
-              helper_image = tile_picture.corner_DL_01
-            else:
-              helper_image = tile_picture.corner_DL_11
+      tile_type = terrain_array.tile_types[tile_id]
+      container = TileImageLoader.get_tile_image(tile_type)
+      positions = list(zip(((xs - left) * general.TILE_WIDTH).tolist(),((ys - top) * general.TILE_HEIGHT).tolist()))
+      frames = []
 
-            result_image.blit(helper_image,(i * general.TILE_WIDTH,j * general.TILE_HEIGHT - general.SUBTILE_HEIGHT))
+      for frame in range(tile_type.get_frame_count()):
+        layer = pygame.Surface((width * general.TILE_WIDTH,height * general.TILE_HEIGHT),flags = pygame.SRCALPHA)
+        layer.fill((0,0,0,0))
+        source, area = container.sources[frame]
 
-            if tile_priority > self.__tile_priority(terrain_array.get_tile_type(i + 1,j - 1)):  # right
-              helper_image = tile_picture.corner_DR_01
-            else:
-              helper_image = tile_picture.corner_DR_11
+        for position in positions:
+          layer.blit(source,position,area,special_flags = pygame.BLEND_RGBA_MAX)   # copy including the alpha
 
-            result_image.blit(helper_image,(i * general.TILE_WIDTH + general.SUBTILE_WIDTH,j * general.TILE_HEIGHT - general.SUBTILE_HEIGHT))
+        frames.append(layer)
 
-          # left border
-          if tile_priority > self.__tile_priority(terrain_array.get_tile_type(i - 1,j)):
-            if tile_priority > self.__tile_priority(terrain_array.get_tile_type(i - 1,j - 1)):  # up
-              helper_image = tile_picture.corner_UR_10
-            else:
-              helper_image = tile_picture.corner_UR_11
+      result[tile_id] = ((left * general.TILE_WIDTH,top * general.TILE_HEIGHT),frames)
 
-            result_image.blit(helper_image,(i * general.TILE_WIDTH - general.SUBTILE_WIDTH,j * general.TILE_HEIGHT))
+    return result
 
-            if tile_priority > self.__tile_priority(terrain_array.get_tile_type(i - 1,j + 1)):  # down
-              helper_image = tile_picture.corner_DR_10
-            else:
-              helper_image = tile_picture.corner_DR_11
+#=======================================================================
 
-            result_image.blit(helper_image,(i * general.TILE_WIDTH - general.SUBTILE_WIDTH,j * general.TILE_HEIGHT + general.SUBTILE_HEIGHT))
+## Persistent on-disk cache of prerendered terrain images (e.g. chunks of
+#  TerrainChunkCache), so that they don't have to be composited again
+#  after a restart.
+#
+#  Each image is stored in its own file as raw RGBA pixels with a small
+#  header. The file name is a hash of the tile data the image has been
+#  composited from and of the tile image resources, so the cache is
+#  invalidated automatically when the world terrain or the resources
+#  change (the stale files are just never used again, see clear()).
 
-          # right border
-          if tile_priority > self.__tile_priority(terrain_array.get_tile_type(i + 1,j)):
-            if tile_priority > self.__tile_priority(terrain_array.get_tile_type(i + 1,j - 1)):  # up
-              helper_image = tile_picture.corner_UL_10
-            else:
-              helper_image = tile_picture.corner_UL_11
+class TerrainDiskCache:
 
-            result_image.blit(helper_image,(i * general.TILE_WIDTH + general.TILE_WIDTH,j * general.TILE_HEIGHT))
+  ## header of the cache files: magic, image width, image height
 
-            if tile_priority > self.__tile_priority(terrain_array.get_tile_type(i + 1,j + 1)):  # down
-              helper_image = tile_picture.corner_DL_10
-            else:
-              helper_image = tile_picture.corner_DL_11
+  FILE_HEADER = struct.Struct("<8sII")
 
-            result_image.blit(helper_image,(i * general.TILE_WIDTH + general.TILE_WIDTH,j * general.TILE_HEIGHT + general.SUBTILE_HEIGHT))
+  ## magic of the cache files, change it when the compositing changes
+  #  so that the old images aren't used
 
-          # lower border
-          if tile_priority > self.__tile_priority(terrain_array.get_tile_type(i,j + 1)):
-            if tile_priority > self.__tile_priority(terrain_array.get_tile_type(i - 1,j + 1)):  # left
-              helper_image = tile_picture.corner_UL_01
-            else:
-              helper_image = tile_picture.corner_UL_11
+  FILE_MAGIC = b"RPGTERR1"
 
-            result_image.blit(helper_image,(i * general.TILE_WIDTH,j * general.TILE_HEIGHT + general.TILE_HEIGHT))
+  ## extension of the cache files
 
-            if tile_priority > self.__tile_priority(terrain_array.get_tile_type(i + 1,j + 1)):  # right
-              helper_image = tile_picture.corner_UR_01
-            else:
-              helper_image = tile_picture.corner_UR_11
+  FILE_EXTENSION = ".rgba"
 
-            result_image.blit(helper_image,(i * general.TILE_WIDTH + general.SUBTILE_WIDTH,j * general.TILE_HEIGHT + general.TILE_HEIGHT))
+  def __init_attributes(self):
+    ## path to the cache directory
+    self.directory = general.CACHE_PATH
+    ## path to the resource directory the tile images are loaded from
+    self.resource_path = general.RESOURCE_PATH
+    ## number of images loaded from the cache
+    self.hits = 0
+    ## number of requested images that were not in the cache
+    self.misses = 0
+    ## hash of the tile image resources, computed lazily
+    self.__resource_hash = None
+
+  ## Initialises a new disk cache, the cache directory is created if it
+  #  doesn't exist.
+  #
+  #  @param directory path to the cache directory
+  #  @param resource_path path to the resource directory
 
-    return result_image
+  def __init__(self, directory = general.CACHE_PATH, resource_path = general.RESOURCE_PATH):
+    self.__init_attributes()
+    self.directory = directory
+    self.resource_path = resource_path
+    os.makedirs(directory,exist_ok = True)
+
+  ## Gets the hash of the tile image resources (their names and
+  #  contents).
+  #
+  #  @return hash in bytes
+
+  def resource_hash(self):
+    if self.__resource_hash == None:
+      hash_object = hashlib.sha1()
+
+      for filename in sorted(os.listdir(self.resource_path)):
+        if filename.startswith("tile_") and filename.endswith(".png"):
+          hash_object.update(filename.encode("utf-8"))
+
+          with open(os.path.join(self.resource_path,filename),"rb") as resource_file:
+            hash_object.update(resource_file.read())
+
+      self.__resource_hash = hash_object.digest()
+
+    return self.__resource_hash
+
+  ## Computes the cache key of a terrain image.
+  #
+  #  @param world_area WorldArea object the image is composited from
+  #  @param offset offset of the area blits in the image in pixels in
+  #         format (x,y)
+  #  @param size image size in pixels in format (width,height)
+  #  @return key string (hexadecimal hash)
+
+  def make_key(self, world_area, offset, size):
+    hash_object = hashlib.sha1(TerrainDiskCache.FILE_MAGIC + self.resource_hash())
+    hash_object.update(struct.pack("<iiIIII",offset[0],offset[1],size[0],size[1],world_area.width,world_area.height))
+
+    tile_ids = numpy.ascontiguousarray(world_area.tile_ids)
+    hash_object.update(tile_ids.tobytes())
+    hash_object.update(numpy.ascontiguousarray(world_area.tile_variants).tobytes())
+
+    for tile_id in numpy.unique(tile_ids).tolist():    # the ids only make sense with the tile types they refer to
+      tile_type = world_area.tile_types.get(tile_id)
+      hash_object.update(struct.pack("<I",tile_id))
+
+      if tile_type != None:    # all the tile type fields the compositor reads
+        hash_object.update(tile_type.name.encode("utf-8") + b"\0" + struct.pack("<iBI",tile_type.priority,bool(tile_type.animated),tile_type.variants))
+      else:
+        hash_object.update(b"\0")
+
+    return hash_object.hexdigest()
+
+  ## Private method, gets the cache file path for given key.
+
+  def __path(self, key):
+    return os.path.join(self.directory,key + TerrainDiskCache.FILE_EXTENSION)
+
+  ## Loads an image from the cache.
+  #
+  #  @param key key made by make_key
+  #  @return Surface object or None if the image isn't cached
+
+  def load(self, key):
+    try:
+      with open(self.__path(key),"rb") as cache_file:
+        data = cache_file.read()
+    except OSError:
+      self.misses += 1
+
+      if profiler.ENABLED:
+        profiler.count("disk_cache_misses")
+
+      return None
+
+    header_size = TerrainDiskCache.FILE_HEADER.size
+
+    if len(data) < header_size:
+      self.misses += 1
+
+      if profiler.ENABLED:
+        profiler.count("disk_cache_misses")
+
+      return None
+
+    magic, width, height = TerrainDiskCache.FILE_HEADER.unpack_from(data)
+
+    if magic != TerrainDiskCache.FILE_MAGIC or len(data) != header_size + width * height * 4:   # foreign or truncated file
+      self.misses += 1
+
+      if profiler.ENABLED:
+        profiler.count("disk_cache_misses")
+
+      return None
+
+    self.hits += 1
+
+    if profiler.ENABLED:
+      profiler.count("disk_cache_hits")
+
+    return pygame.image.frombuffer(data[header_size:],(width,height),"RGBA")
+
+  ## Stores an image in the cache. The file is written under a temporary
+  #  name and then renamed, so that a crash never leaves a truncated
+  #  image behind.
+  #
+  #  @param key key made by make_key
+  #  @param image Surface object to store
+
+  def store(self, key, image):
+    path = self.__path(key)
+    temporary_path = path + ".tmp" + str(os.getpid())
+
+    try:
+      with open(temporary_path,"wb") as cache_file:
+        cache_file.write(TerrainDiskCache.FILE_HEADER.pack(TerrainDiskCache.FILE_MAGIC,image.get_width(),image.get_height()))
+        cache_file.write(pygame.image.tostring(image,"RGBA"))
+
+      os.replace(temporary_path,path)
+    except OSError:         # the cache is only an optimisation, a failed write is ignored
+      try:
+        os.remove(temporary_path)
+      except OSError:
+        pass
+
+  ## Removes all the cached images.
+
+  def clear(self):
+    for filename in os.listdir(self.directory):
+      if filename.endswith(TerrainDiskCache.FILE_EXTENSION):
+        os.remove(os.path.join(self.directory,filename))
+
+#=======================================================================
+
+## Keeps prerendered terrain of the world split into fixed-size square
+#  chunks.
+#
+#  Each chunk is loaded from the world and prerendered independently
+#  (with a one tile border around it so that the tile borders and
+#  corners are right) when it is first needed. The chunk images are
+#  kept in an LRU cache whose total size is limited by a memory budget,
+#  so going back and forth over the same place of the world doesn't
+#  render the terrain again. One cache can be shared by several
+#  renderers of the same world.
+
+class TerrainChunkCache:
+
+  ## default chunk size in tiles
+
+  CHUNK_SIZE = 32
+
+  ## default memory budget in bytes
+
+  MEMORY_BUDGET = 64 * 1024 * 1024
+
+  def __init_attributes(self):
+    ## World object whose terrain is cached
+    self.world = None
+    ## chunk width and height in tiles
+    self.chunk_size = TerrainChunkCache.CHUNK_SIZE
+    ## maximum total size of the cached chunk images in bytes
+    self.memory_budget = TerrainChunkCache.MEMORY_BUDGET
+    ## current total size of the cached chunk images in bytes
+    self.memory_used = 0
+    ## number of chunk requests served from the cache
+    self.hits = 0
+    ## number of chunk requests that had to render the chunk
+    self.misses = 0
+    ## the cached chunk images (Surface objects) in LRU order (the least
+    #  recently used first), the key is (chunk_x,chunk_y)
+    self.__chunks = collections.OrderedDict()
+    ## TerrainDiskCache object the chunk images are persisted in, or None
+    self.disk_cache = None
+    ## number of the references to the chunks, the key is (chunk_x,
+    #  chunk_y), the referenced chunks are never dropped
+    self.__references = {}
+    ## chunks referenced by each owner, the key is the owner id, the item
+    #  is a set of (chunk_x,chunk_y)
+    self.__owner_chunks = {}
+    ## Future objects of the chunks being loaded by the loader, the key
+    #  is (chunk_x,chunk_y)
+    self.__pending = {}
+    ## executor with the single loader thread, created lazily
+    self.__loader = None
+    ## lock of the chunk dictionaries, the cache can be used from
+    #  several threads
+    self.__lock = threading.RLock()
+
+  ## Initialises a new chunk cache.
+  #
+  #  @param world World object whose terrain will be cached
+  #  @param chunk_size chunk width and height in tiles
+  #  @param memory_budget maximum total size of the cached chunk images
+  #         in bytes, the least recently used chunks are dropped when it
+  #         is exceeded
+  #  @param disk_cache TerrainDiskCache object to load the chunk images
+  #         from and store them to, if None, the chunks are always
+  #         composited
+  #
+  #  The cache can be shared by several renderers (viewports): each
+  #  renderer references the chunks around its view with
+  #  set_references() (they are then kept in memory regardless of the
+  #  budget) and requests them from the loader with request_chunks(), so
+  #  every chunk is only made once however many views show it.
+
+  def __init__(self, world, chunk_size = CHUNK_SIZE, memory_budget = MEMORY_BUDGET, disk_cache = None):
+    self.__init_attributes()
+    self.world = world
+    self.chunk_size = chunk_size
+    self.memory_budget = memory_budget
+    self.disk_cache = disk_cache
+
+  ## Gets the tile rectangle of given chunk, chunks at the world border
+  #  are cut by it.
+  #
+  #  @return rectangle in format (x,y,width,height) in tiles
+
+  def chunk_rectangle(self, chunk_x, chunk_y):
+    return general.rectangle_intersection((chunk_x * self.chunk_size,chunk_y * self.chunk_size,self.chunk_size,self.chunk_size),(0,0,self.world.width,self.world.height))
+
+  ## Private method, loads and prerenders given chunk (or loads its
+  #  image from the disk cache).
+
+  def __make_chunk_image(self, chunk_x, chunk_y):
+    rectangle = self.chunk_rectangle(chunk_x,chunk_y)
+    loaded_rectangle = general.rectangle_intersection((rectangle[0] - 1,rectangle[1] - 1,rectangle[2] + 2,rectangle[3] + 2),(0,0,self.world.width,self.world.height))
+    world_area = self.world.load_area(loaded_rectangle)
+
+    offset = ((loaded_rectangle[0] - rectangle[0]) * general.TILE_WIDTH,(loaded_rectangle[1] - rectangle[1]) * general.TILE_HEIGHT)
+    size = (rectangle[2] * general.TILE_WIDTH,rectangle[3] * general.TILE_HEIGHT)
+
+    if self.disk_cache != None:
+      key = self.disk_cache.make_key(world_area,offset,size)
+      result = self.disk_cache.load(key)
+
+      if result != None:
+        return result
+
+    result = pygame.Surface(size,flags = pygame.SRCALPHA)
+    result.fill((255,255,255,0))
+
+    blit_list(result,ImageCompositor().make_terrain_blit_list(world_area),offset)
+
+    if self.disk_cache != None:
+      self.disk_cache.store(key,result)
+
+    return result
+
+  ## Gets the prerendered image of given chunk, rendering it if it's not
+  #  cached.
+  #
+  #  @param chunk_x chunk x coordinate (in chunks)
+  #  @param chunk_y chunk y coordinate (in chunks)
+  #  @return Surface object with the chunk terrain
+
+  def get_chunk_image(self, chunk_x, chunk_y):
+    key = (chunk_x,chunk_y)
+
+    with self.__lock:
+      image = self.__chunks.pop(key,None)
+
+      if image != None:
+        self.__chunks[key] = image           # reinsert as the most recently used
+        self.hits += 1
+
+        if profiler.ENABLED:
+          profiler.count("chunk_cache_hits")
+
+        return image
+
+      future = self.__pending.get(key)
+
+    if future != None:                       # being loaded, wait for it instead of making it again
+      image = future.result()
+
+      if image != None:
+        return image
+
+    image = self.__make_chunk_image(chunk_x,chunk_y)
+    self.misses += 1
+
+    if profiler.ENABLED:
+      profiler.count("chunk_cache_misses")
+
+    self.__store(key,image)
+    return image
+
+  ## Private method, inserts a chunk image as the most recently used and
+  #  drops the least recently used unreferenced chunks over the budget.
+
+  def __store(self, key, image):
+    with self.__lock:
+      if key in self.__chunks:
+        self.memory_used -= self.__image_size(self.__chunks.pop(key))
+
+      self.__chunks[key] = image
+      self.memory_used += self.__image_size(image)
+      self.__drop_over_budget()
+
+  ## Private method, gets the size of an image in bytes.
+
+  def __image_size(self, image):
+    return image.get_width() * image.get_height() * image.get_bytesize()
+
+  ## Private method, drops the least recently used unreferenced chunks
+  #  while the memory budget is exceeded (the lock must be held).
+
+  def __drop_over_budget(self):
+    if self.memory_used <= self.memory_budget:
+      return
+
+    for key in list(self.__chunks):
+      if len(self.__chunks) <= 1 or self.memory_used <= self.memory_budget:
+        break
+
+      if not key in self.__references:
+        self.memory_used -= self.__image_size(self.__chunks.pop(key))
+
+  ## Sets the chunks referenced by an owner (e.g. a renderer), replacing
+  #  the ones it referenced before. The chunks referenced by any owner
+  #  are not dropped from the cache.
+  #
+  #  @param owner the owner object
+  #  @param chunks iterable of chunk coordinates in format (chunk_x,
+  #         chunk_y), empty to release all the owner's chunks
+
+  def set_references(self, owner, chunks):
+    chunks = set(chunks)
+
+    with self.__lock:
+      previous_chunks = self.__owner_chunks.pop(id(owner),set())
+
+      for key in chunks - previous_chunks:
+        self.__references[key] = self.__references.get(key,0) + 1
+
+      for key in previous_chunks - chunks:
+        self.__references[key] -= 1
+
+        if self.__references[key] == 0:
+          del self.__references[key]
+
+      if len(chunks) != 0:
+        self.__owner_chunks[id(owner)] = chunks
+
+      self.__drop_over_budget()
+
+  ## Gets the number of the references to a chunk.
+
+  def get_reference_count(self, chunk_x, chunk_y):
+    with self.__lock:
+      return self.__references.get((chunk_x,chunk_y),0)
+
+  ## Private method, the loader job, makes a chunk image unless it is no
+  #  longer referenced.
+  #
+  #  @return the chunk image or None if it hasn't been made
+
+  def __load_job(self, key):
+    try:
+      with self.__lock:
+        if not key in self.__references:
+          return None
+
+      image = self.__make_chunk_image(key[0],key[1])
+      self.misses += 1
+      self.__store(key,image)
+      return image
+    finally:
+      with self.__lock:
+        del self.__pending[key]
+
+  ## Requests chunks to be made in the background by the loader thread
+  #  (one for all the users of the cache). The chunks that are cached or
+  #  already requested are skipped, the requested chunks that are no
+  #  longer referenced when their turn comes are skipped too.
+  #
+  #  @param chunks iterable of chunk coordinates in format (chunk_x,
+  #         chunk_y) in the order they should be made
+
+  def request_chunks(self, chunks):
+    with self.__lock:
+      if self.__loader == None:
+        self.__loader = concurrent.futures.ThreadPoolExecutor(max_workers = 1)
+
+      for key in chunks:
+        if not key in self.__chunks and not key in self.__pending:
+          self.__pending[key] = self.__loader.submit(self.__load_job,key)
+
+  ## Gets the chunks that intersect given rectangle.
+  #
+  #  @param rectangle pixel rectangle in the world in format
+  #         (x,y,width,height)
+  #  @return list of chunk coordinates in format (chunk_x,chunk_y)
+
+  def chunks_in_rectangle(self, rectangle):
+    chunk_width = self.chunk_size * general.TILE_WIDTH
+    chunk_height = self.chunk_size * general.TILE_HEIGHT
+
+    first_x = max(int(rectangle[0] // chunk_width),0)
+    first_y = max(int(rectangle[1] // chunk_height),0)
+    last_x = min(int((rectangle[0] + rectangle[2] - 1) // chunk_width),(self.world.width - 1) // self.chunk_size)
+    last_y = min(int((rectangle[1] + rectangle[3] - 1) // chunk_height),(self.world.height - 1) // self.chunk_size)
+
+    return [(x,y) for y in range(first_y,last_y + 1) for x in range(first_x,last_x + 1)]
+
+  ## Draws the terrain in given view rectangle.
+  #
+  #  @param surface Surface to draw to
+  #  @param view_top_left pixel coordinates of the world point that will
+  #         be drawn at the surface top left corner, in format (x,y)
+
+  def draw(self, surface, view_top_left):
+    chunk_width = self.chunk_size * general.TILE_WIDTH
+    chunk_height = self.chunk_size * general.TILE_HEIGHT
+
+    for chunk_x, chunk_y in self.chunks_in_rectangle((view_top_left[0],view_top_left[1],surface.get_width(),surface.get_height())):
+      surface.blit(self.get_chunk_image(chunk_x,chunk_y),(chunk_x * chunk_width - view_top_left[0],chunk_y * chunk_height - view_top_left[1]))
+
+#=======================================================================
+
+## Makes downscaled overview images of the whole world (minimaps).
+#
+#  The images form a pyramid of levels, level 0 has tile_size pixels per
+#  tile and each next level has half the resolution. The images are made
+#  straight from the terrain tile ids, without compositing the terrain:
+#  the levels with more than one pixel per tile use a downscaled
+#  thumbnail of each tile type, the other levels average the colours of
+#  the tiles covered by each pixel. The terrain is streamed in bands of
+#  chunk_size rows, so only a band is loaded at a time. The props are
+#  overlaid as rectangles. Each level is made when it's first needed and
+#  kept until invalidate() is called.
+
+class Minimap:
+
+  ## default number of pixels per tile at level 0, a power of two
+
+  TILE_SIZE = 4
+
+  ## default size of the streamed terrain bands and chunks in tiles, a
+  #  power of two
+
+  CHUNK_SIZE = 256
+
+  ## default colour of the props
+
+  PROP_COLOR = (40,30,20)
+
+  ## colour of the places without a tile
+
+  BACKGROUND_COLOR = (0,0,0)
+
+  def __init_attributes(self):
+    ## World object the minimap is made for
+    self.world = None
+    ## number of pixels per tile at level 0
+    self.tile_size = Minimap.TILE_SIZE
+    ## size of the streamed terrain bands and chunks in tiles
+    self.chunk_size = Minimap.CHUNK_SIZE
+    ## colour the props are drawn with, None means the props aren't drawn
+    self.prop_color = Minimap.PROP_COLOR
+    ## made level images (Surface objects), the key is the level
+    self.__levels = {}
+
+  ## Initialises a new minimap.
+  #
+  #  @param world World object to make the minimap of
+  #  @param tile_size number of pixels per tile at level 0, a power of
+  #         two
+  #  @param chunk_size size of the streamed terrain bands and chunks in
+  #         tiles, a power of two
+  #  @param prop_color colour of the props or None if the props shouldn't
+  #         be drawn
+
+  def __init__(self, world, tile_size = TILE_SIZE, chunk_size = CHUNK_SIZE, prop_color = PROP_COLOR):
+    self.__init_attributes()
+    self.world = world
+    self.tile_size = tile_size
+    self.chunk_size = chunk_size
+    self.prop_color = prop_color
+
+  ## Gets the scale of given level.
+  #
+  #  @return number of pixels per tile (less than 1 for the small levels)
+
+  def get_scale(self, level):
+    return self.tile_size / float(2 ** level)
+
+  ## Gets the image size of given level.
+  #
+  #  @return tuple (width,height) in pixels
+
+  def get_level_size(self, level):
+    factor = 2 ** level
+
+    if factor < self.tile_size:
+      scale = self.tile_size // factor
+      return (self.world.width * scale,self.world.height * scale)
+
+    tiles = factor // self.tile_size
+    return ((self.world.width + tiles - 1) // tiles,(self.world.height + tiles - 1) // tiles)
+
+  ## Gets the number of the levels, the last level is one pixel in size.
+
+  def get_level_count(self):
+    level = 0
+
+    while self.get_level_size(level)[0] > 1 or self.get_level_size(level)[1] > 1:
+      level += 1
+
+    return level + 1
+
+  ## Gets the smallest level whose scale is at least given scale.
+  #
+  #  @param scale requested number of pixels per tile
+  #  @return level number
+
+  def get_level_for_scale(self, scale):
+    level = 0
+
+    while level + 1 < self.get_level_count() and self.get_scale(level + 1) >= scale:
+      level += 1
+
+    return level
+
+  ## Drops the made level images, e.g. after the terrain or the props
+  #  have changed.
+
+  def invalidate(self):
+    self.__levels = {}
+
+  ## Private method, makes the tile images of given size for all the
+  #  tile types.
+  #
+  #  @param size tile image width and height in pixels
+  #  @param last_id the ids from this one up have no tile type
+  #  @return numpy array of the images indexed [tile id,x,y,channel],
+  #          the image at last_id is the background
+
+  def __make_palette(self, size, last_id):
+    result = numpy.zeros((last_id + 1,size,size,3),dtype = numpy.uint8)
+    result[last_id] = Minimap.BACKGROUND_COLOR
+
+    for tile_id in self.world.tile_types:
+      image = TileImageLoader.get_tile_image(self.world.tile_types[tile_id]).main_tile[0]
+
+      if size == 1:
+        result[tile_id] = pygame.transform.average_color(image)[:3]
+      else:
+        result[tile_id] = pygame.surfarray.array3d(pygame.transform.smoothscale(image,(size,size)))
+
+    return result
+
+  ## Private method, sums the values in blocks of given size, the values
+  #  outside the array count as zeros.
+  #
+  #  @param values numpy array indexed [x,y,...]
+  #  @return numpy array of the sums indexed [block x,block y,...]
+
+  def __block_sums(self, values, block_width, block_height):
+    width = (values.shape[0] + block_width - 1) // block_width
+    height = (values.shape[1] + block_height - 1) // block_height
+
+    padded = numpy.zeros((width * block_width,height * block_height) + values.shape[2:],dtype = numpy.uint64)
+    padded[:values.shape[0],:values.shape[1]] = values
+
+    return padded.reshape((width,block_width,height,block_height) + values.shape[2:]).sum(axis = 3).sum(axis = 1)
+
+  ## Private method, makes the image of given level.
+
+  def __make_level(self, level):
+    factor = 2 ** level
+    result = pygame.Surface(self.get_level_size(level),0,32)
+    pixels = pygame.surfarray.pixels3d(result)
+    last_id = max(self.world.tile_types) + 1 if len(self.world.tile_types) != 0 else 0
+
+    if factor < self.tile_size:
+      scale = self.tile_size // factor
+      palette = self.__make_palette(scale,last_id)
+
+      for y in range(0,self.world.height,self.chunk_size):
+        band = self.world.load_area((0,y,self.world.width,min(self.chunk_size,self.world.height - y)))
+
+        for x in range(0,band.width,self.chunk_size):
+          ids = numpy.minimum(band.tile_ids[x:x + self.chunk_size],last_id)
+          pixels[x * scale:(x + ids.shape[0]) * scale,y * scale:(y + ids.shape[1]) * scale] = \
+            palette[ids].transpose(0,2,1,3,4).reshape((ids.shape[0] * scale,ids.shape[1] * scale,3))
+    else:
+      tiles = factor // self.tile_size          # each pixel averages tiles x tiles tiles
+      palette = self.__make_palette(1,last_id).reshape((last_id + 1,3))
+      block_height = min(tiles,self.chunk_size)
+      column_step = max(tiles,self.chunk_size)
+      row_sums = numpy.zeros((pixels.shape[0],1,3),dtype = numpy.uint64)
+      row_counts = numpy.zeros((pixels.shape[0],1,1),dtype = numpy.uint64)
+
+      for y in range(0,self.world.height,self.chunk_size):
+        band = self.world.load_area((0,y,self.world.width,min(self.chunk_size,self.world.height - y)))
+        blocks = (band.height + block_height - 1) // block_height
+        sums = numpy.zeros((pixels.shape[0],blocks,3),dtype = numpy.uint64)
+        counts = numpy.zeros((pixels.shape[0],blocks,1),dtype = numpy.uint64)
+
+        for x in range(0,band.width,column_step):
+          ids = numpy.minimum(band.tile_ids[x:x + column_step],last_id)
+          sums[x // tiles:(x + ids.shape[0] + tiles - 1) // tiles] = self.__block_sums(palette[ids],tiles,block_height)
+          counts[x // tiles:(x + ids.shape[0] + tiles - 1) // tiles,:,0] = self.__block_sums(numpy.ones(ids.shape,dtype = numpy.uint64),tiles,block_height)
+
+        if tiles <= self.chunk_size:            # the band is made of whole pixel rows
+          pixels[:,y // tiles:y // tiles + blocks] = (sums + counts // 2) // counts
+        else:                                   # the pixel rows are made of several bands
+          row_sums += sums
+          row_counts += counts
+
+          if (y + band.height) % tiles == 0 or y + band.height == self.world.height:
+            pixels[:,y // tiles:y // tiles + 1] = (row_sums + row_counts // 2) // row_counts
+            row_sums[:] = 0
+            row_counts[:] = 0
+
+    del pixels                                  # unlocks the surface
+
+    if self.prop_color != None:
+      scale = self.get_scale(level)
+
+      for prop in self.world.prop_instances.values():
+        result.fill(self.prop_color,(int(prop.position[0] * scale),int(prop.position[1] * scale),max(int(prop.width * scale),1),max(int(prop.height * scale),1)))
+
+    if pygame.display.get_surface() != None:
+      result = result.convert()
+
+    return result
+
+  ## Gets the image of given level, making it if it hasn't been made yet.
+  #
+  #  @return Surface object
+
+  def get_level(self, level):
+    if not level in self.__levels:
+      self.__levels[level] = self.__make_level(level)
+
+    return self.__levels[level]
+
+  ## Draws a part of given level with a single blit.
+  #
+  #  @param surface Surface to draw to
+  #  @param level level to be drawn
+  #  @param top_left world coordinates in tiles (can be fractional) of
+  #         the point drawn at position, in format (x,y)
+  #  @param position position on the surface in format (x,y)
+  #  @param size size of the drawn part in pixels in format (width,
+  #         height), if None, it's the rest of the surface
+  #  @return pygame.Rect of the drawn part of the surface
+
+  def draw(self, surface, level, top_left = (0,0), position = (0,0), size = None):
+    if size == None:
+      size = (surface.get_width() - position[0],surface.get_height() - position[1])
+
+    scale = self.get_scale(level)
+    area = pygame.Rect(int(top_left[0] * scale),int(top_left[1] * scale),size[0],size[1])
+
+    return surface.blit(self.get_level(level),position,area)
+
+#=======================================================================
+
+## Keeps scaled versions of images (e.g. of the terrain for zoomed
+#  rendering) in an LRU cache with a memory budget. The cache doesn't
+#  keep the source images, the images are identified by keys given by
+#  the caller, which have to change whenever the image content changes.
+
+class ScaledImageCache:
+
+  ## default memory budget in bytes
+
+  MEMORY_BUDGET = 64 * 1024 * 1024
+
+  def __init_attributes(self):
+    ## maximum total size of the cached images in bytes
+    self.memory_budget = ScaledImageCache.MEMORY_BUDGET
+    ## current total size of the cached images in bytes
+    self.memory_used = 0
+    ## number of requests served from the cache
+    self.hits = 0
+    ## number of requests that had to scale the image
+    self.misses = 0
+    ## the cached images (Surface objects) in LRU order (the least
+    #  recently used first), the key is (image key,scale)
+    self.__images = collections.OrderedDict()
+
+  ## Initialises a new cache.
+  #
+  #  @param memory_budget maximum total size of the cached images in
+  #         bytes, the least recently used images are dropped when it is
+  #         exceeded
+
+  def __init__(self, memory_budget = MEMORY_BUDGET):
+    self.__init_attributes()
+    self.memory_budget = memory_budget
+
+  ## Gets a scaled image, scaling it if it's not cached.
+  #
+  #  @param key hashable key identifying the image content
+  #  @param scale scale factor
+  #  @param image_function function without arguments that returns the
+  #         Surface to be scaled, only called if the image isn't cached
+  #  @return Surface object with the scaled image
+
+  def get_scaled_image(self, key, scale, image_function):
+    key = (key,scale)
+
+    try:
+      result = self.__images.pop(key)
+      self.hits += 1
+    except KeyError:
+      image = image_function()
+      size = (max(int(round(image.get_width() * scale)),1),max(int(round(image.get_height() * scale)),1))
+      result = pygame.transform.smoothscale(image,size)
+      self.memory_used += result.get_width() * result.get_height() * result.get_bytesize()
+      self.misses += 1
+
+      if profiler.ENABLED:
+        profiler.count("scaled_image_misses")
+
+    self.__images[key] = result            # (re)insert as the most recently used
+
+    while self.memory_used > self.memory_budget and len(self.__images) > 1:
+      evicted = self.__images.popitem(last = False)[1]
+      self.memory_used -= evicted.get_width() * evicted.get_height() * evicted.get_bytesize()
+
+    return result
+
+  ## Drops all the cached images.
+
+  def clear(self):
+    self.__images.clear()
+    self.memory_used = 0
 
 #=======================================================================
 
@@ -325,35 +1496,60 @@ class ImageCompositor:
 #  world's active area terrain so it can be rendered quickly for
 #  real-time viewing. WorldRenderer will smartly change the world active
 #  area when the view shifts to the edge of the current area.
+#
+#  Several renderers (e.g. split screen or spectator views) can render
+#  the same world, each with its own view size and active area. Only one
+#  of them should drive the world active area (see drive_world_area), and
+#  they should share one TerrainChunkCache, which then makes each terrain
+#  chunk once for all the views.
 
 class WorldRenderer:
 
-  ## view width in pixels
+  ## default view width in pixels
   VIEW_WIDTH = 800
 
-  ## view height in pixels
+  ## default view height in pixels
   VIEW_HEIGHT = 480
 
-  ## view width in pixels
+  ## default view width in tiles
   VIEW_WIDTH_TILES = math.ceil(VIEW_WIDTH / general.TILE_WIDTH)
 
-  ## view height in pixels
+  ## default view height in tiles
   VIEW_HEIGHT_TILES = math.ceil(VIEW_HEIGHT / general.TILE_HEIGHT)
 
-  ## along with VIEW_WIDTH and VIEW_HEIGHT determines the active area
-  #  size, which is width: VIEW_WIDTH_TILES + 2 * TILE_PADDING, height:
-  #  VIEW_HEIGHT_TILES + 2 * TILE_PADDING
+  ## along with the view size determines the active area size, which is
+  #  width: view width in tiles + 2 * TILE_PADDING, height: view height
+  #  in tiles + 2 * TILE_PADDING
 
   TILE_PADDING = 15
 
-  ## active area width in tiles
+  ## default active area width in tiles
 
   ACTIVE_AREA_WIDTH = VIEW_WIDTH_TILES + 2 * TILE_PADDING
 
-  ## active area height in tiles
+  ## default active area height in tiles
 
   ACTIVE_AREA_HEIGHT = VIEW_HEIGHT_TILES + 2 * TILE_PADDING
 
+  ## when prefetching is on, the next active area starts being prepared
+  #  when the view is going to reach the active area border in less than
+  #  this many seconds (at its current speed)
+
+  PREFETCH_TIME = 2.0
+
+  ## zoom levels the scaled terrain is kept in, other zooms are scaled
+  #  from the nearest bigger level
+
+  ZOOM_LEVELS = (1.0,0.5,0.25)
+
+  ## minimum zoom (the active area grows as 1 / zoom squared)
+
+  MIN_ZOOM = 0.25
+
+  ## maximum zoom
+
+  MAX_ZOOM = 2.0
+
   def _view_top_left_tiles(self):
     return (math.floor(self._view_top_left[0] / general.TILE_WIDTH),math.floor(self._view_top_left[1] / general.TILE_HEIGHT))
 
@@ -364,28 +1560,283 @@ class WorldRenderer:
   @view_top_left.setter
   def view_top_left(self,value):
     self._view_top_left = value
-    in_tiles = self._view_top_left_tiles()
+
+    if self.prefetch:
+      self.__update_view_velocity()
 
     # here the world active area is being potentially changed if the view rectangle is at the border of the active area:
-    if ((self.world.active_area[0] > 0 and in_tiles[0] <= self.world.active_area[0]) or
-        (self.world.active_area[1] > 0 and in_tiles[1] <= self.world.active_area[1]) or
-        (self.world.active_area[0] + self.world.active_area[2] < self.world.width and in_tiles[0] + WorldRenderer.VIEW_WIDTH_TILES >= self.world.active_area[0] + self.world.active_area[2]) or
-        (self.world.active_area[1] + self.world.active_area[3] < self.world.height and in_tiles[1] + WorldRenderer.VIEW_HEIGHT_TILES >= self.world.active_area[1] + self.world.active_area[3])):
-      print("changing active area")
-      print(self.world.get_active_area_props())
+    if self.__view_at_area_border(self.active_area):
+      if not (self.prefetch and self.__use_prefetched_area()):
+        self.__change_active_area()
+    elif self.prefetch:
+      self.__prefetch_next_area()
+
+  ## view zoom, 1.0 means one world pixel per canvas pixel, less than
+  #  1.0 means zoomed out, the view shows VIEW_WIDTH / zoom x
+  #  VIEW_HEIGHT / zoom world pixels
+
+  @property
+  def zoom(self):
+    return self._zoom
+
+  @zoom.setter
+  def zoom(self,value):
+    value = general.saturate(value,WorldRenderer.MIN_ZOOM,WorldRenderer.MAX_ZOOM)
+
+    if value == self._zoom:
+      return
+
+    self._zoom = value
+    self.__update_view_size()
 
+    if (self.active_area[2:] != self.__area_for_view(self._view_top_left_tiles())[2:] or
+        self.__view_at_area_border(self.active_area)):
       self.__change_active_area()
 
+  ## view size in pixels in format (width,height), setting it makes a new
+  #  canvas
+
+  @property
+  def view_size(self):
+    return (self.view_width,self.view_height)
+
+  @view_size.setter
+  def view_size(self,value):
+    if value == self.view_size:
+      return
+
+    self.view_width, self.view_height = value
+    self.canvas = pygame.Surface(value)
+    self.__rendered_state = None
+    self.__update_view_size()
+
+    if (self.active_area[2:] != self.__area_for_view(self._view_top_left_tiles())[2:] or
+        self.__view_at_area_border(self.active_area)):
+      self.__change_active_area()
+
+  ## Private method, gets the zoom level (see ZOOM_LEVELS) the view is
+  #  drawn in: the smallest level not smaller than the zoom, or the
+  #  biggest level when zoomed in.
+
+  def __zoom_level(self):
+    return min([level for level in WorldRenderer.ZOOM_LEVELS if level >= self._zoom] or [max(WorldRenderer.ZOOM_LEVELS)])
+
+  ## Private method, updates the view and active area sizes in tiles
+  #  after the zoom has changed. The active area size is only changed
+  #  when the zoom crosses a zoom level (it's made for the next smaller
+  #  level), so that zooming smoothly doesn't change the area all the
+  #  time.
+
+  def __update_view_size(self):
+    self.view_width_tiles = int(math.ceil(self.view_width / self._zoom / general.TILE_WIDTH))
+    self.view_height_tiles = int(math.ceil(self.view_height / self._zoom / general.TILE_HEIGHT))
+
+    area_zoom = max([level for level in WorldRenderer.ZOOM_LEVELS if level <= self._zoom] or [min(WorldRenderer.ZOOM_LEVELS)])
+    self.active_area_width = min(int(math.ceil(self.view_width / area_zoom / general.TILE_WIDTH)) + 2 * WorldRenderer.TILE_PADDING,self.world.width)
+    self.active_area_height = min(int(math.ceil(self.view_height / area_zoom / general.TILE_HEIGHT)) + 2 * WorldRenderer.TILE_PADDING,self.world.height)
+
+  ## Private method, checks if the view rectangle is at the border of
+  #  given area (and so the area should be changed). The world borders
+  #  are not considered area borders.
+  #
+  #  @param area area in format (x,y,width,height) in tiles
+
+  def __view_at_area_border(self, area):
+    in_tiles = self._view_top_left_tiles()
+
+    return ((area[0] > 0 and in_tiles[0] <= area[0]) or
+            (area[1] > 0 and in_tiles[1] <= area[1]) or
+            (area[0] + area[2] < self.world.width and in_tiles[0] + self.view_width_tiles >= area[0] + area[2]) or
+            (area[1] + area[3] < self.world.height and in_tiles[1] + self.view_height_tiles >= area[1] + area[3]))
+
+  ## Private method, computes the active area for given view position.
+  #
+  #  @param view_tile_coordinates coordinates of the view top left
+  #         corner in tiles in format (x,y)
+  #  @return area in format (x,y,width,height) in tiles
+
+  def __area_for_view(self, view_tile_coordinates):
+    return (general.saturate(view_tile_coordinates[0] - WorldRenderer.TILE_PADDING,0,self.world.width - self.active_area_width),
+            general.saturate(view_tile_coordinates[1] - WorldRenderer.TILE_PADDING,0,self.world.height - self.active_area_height),
+            self.active_area_width,
+            self.active_area_height)
+
+  ## Private method, updates the view velocity from the view position
+  #  changes. The position is sampled at most every 50 ms as the view
+  #  position can be set several times per frame.
+
+  def __update_view_velocity(self):
+    now = time.time()
+
+    if self.__last_view_sample == None:
+      self.__last_view_sample = (now,self._view_top_left)
+      return
+
+    time_difference = now - self.__last_view_sample[0]
+
+    if time_difference < 0.05:
+      return
+
+    last_position = self.__last_view_sample[1]
+    velocity = ((self._view_top_left[0] - last_position[0]) / time_difference,(self._view_top_left[1] - last_position[1]) / time_difference)
+
+    # exponential smoothing:
+    self.__view_velocity = ((self.__view_velocity[0] + velocity[0]) / 2.0,(self.__view_velocity[1] + velocity[1]) / 2.0)
+    self.__last_view_sample = (now,self._view_top_left)
+
+  ## Private method, predicts the next active area from the view
+  #  velocity and if the view is going to reach the current active area
+  #  border soon, starts preparing the predicted area in the background.
+
+  def __prefetch_next_area(self):
+    area = self.active_area
+    velocity = self.__view_velocity
+    border_times = []
+
+    if velocity[0] > 1 and area[0] + area[2] < self.world.width:
+      border_times.append(((area[0] + area[2] - self.view_width_tiles) * general.TILE_WIDTH - self._view_top_left[0]) / velocity[0])
+    elif velocity[0] < -1 and area[0] > 0:
+      border_times.append((area[0] * general.TILE_WIDTH - self._view_top_left[0]) / velocity[0])
+
+    if velocity[1] > 1 and area[1] + area[3] < self.world.height:
+      border_times.append(((area[1] + area[3] - self.view_height_tiles) * general.TILE_HEIGHT - self._view_top_left[1]) / velocity[1])
+    elif velocity[1] < -1 and area[1] > 0:
+      border_times.append((area[1] * general.TILE_HEIGHT - self._view_top_left[1]) / velocity[1])
+
+    if len(border_times) == 0:
+      return
+
+    border_time = max(min(border_times),0)
+
+    if border_time > WorldRenderer.PREFETCH_TIME:
+      return
+
+    predicted_view = (self._view_top_left[0] + velocity[0] * border_time,self._view_top_left[1] + velocity[1] * border_time)
+    predicted_area = self.__area_for_view((math.floor(predicted_view[0] / general.TILE_WIDTH),math.floor(predicted_view[1] / general.TILE_HEIGHT)))
+
+    if predicted_area == area or predicted_area == self.__prefetch_area:
+      return
+
+    if self.__prefetch_future != None:
+      self.__prefetch_future.cancel()
+
+    if self.__prefetch_executor == None:
+      self.__prefetch_executor = concurrent.futures.ThreadPoolExecutor(max_workers = 1)
+
+    self.__prefetch_area = predicted_area
+    self.__prefetch_future = self.__prefetch_executor.submit(self.__prefetch_job,predicted_area)
+
+  ## Private method, the prefetch job run in the background thread,
+  #  loads given area and prerenders its terrain.
+  #
+  #  @param area area in format (x,y,width,height) in tiles
+  #  @return tuple (area,WorldArea object,terrain image,animation
+  #          layers)
+
+  def __prefetch_job(self, area):
+    world_area = self.world.load_area(area)
+    image_compositor = ImageCompositor()
+    animation_layers = image_compositor.make_animation_layers(world_area)
+
+    if self.chunk_cache != None:
+      return (area,world_area,None,animation_layers)
+
+    return (area,world_area,image_compositor.make_terrain_image(world_area),animation_layers)
+
+  ## Private method, swaps in the prefetched active area if it is ready
+  #  and suitable for the current view.
+  #
+  #  @return True if the prefetched area has been used, False otherwise
+  #          (then the area has to be changed synchronously)
+
+  def __use_prefetched_area(self):
+    future = self.__prefetch_future
+
+    if future == None or future.cancelled() or not future.done():
+      return False
+
+    self.__prefetch_future = None
+    self.__prefetch_area = None
+
+    area, world_area, terrain_image, animation_layers = future.result()
+
+    if self.__view_at_area_border(area) or area[2:] != (self.active_area_width,self.active_area_height):   # the view hasn't gone where predicted or zoomed
+      return False
+
+    self.__set_active_area(area,world_area)
+    self.terrain_image = terrain_image
+    self.__animation_layers = animation_layers
+    self.__animation_layers_area = world_area
+    return True
+
   def __init_attributes(self):
     ## prerendered terrain of the active part of the world
     self.terrain_image = None
     ## position of the top left corner of the view rectangle in pixels
     self._view_top_left = (0,0)
+    ## view width in pixels
+    self.view_width = WorldRenderer.VIEW_WIDTH
+    ## view height in pixels
+    self.view_height = WorldRenderer.VIEW_HEIGHT
     ## image to which the terrain will be rendered and which will be
     #  returned as the rendered part of the world
-    self.canvas = pygame.Surface((WorldRenderer.VIEW_WIDTH,WorldRenderer.VIEW_HEIGHT))
+    self.canvas = None
     ## world that is being rendered
     self.world = None
+    ## active area of the renderer in format (x,y,width,height) in tiles
+    self.active_area = (0,0,0,0)
+    ## WorldArea object of the renderer active area
+    self.world_area = None
+    ## whether the renderer active area is also set as the world active
+    #  area (World.active_area)
+    self.drive_world_area = True
+    ## TerrainChunkCache object the terrain is drawn from, if None, the
+    #  terrain of the whole active area is prerendered into terrain_image
+    self.chunk_cache = None
+    ## view zoom, see zoom
+    self._zoom = 1.0
+    ## view width in tiles at the current zoom
+    self.view_width_tiles = WorldRenderer.VIEW_WIDTH_TILES
+    ## view height in tiles at the current zoom
+    self.view_height_tiles = WorldRenderer.VIEW_HEIGHT_TILES
+    ## active area width in tiles at the current zoom
+    self.active_area_width = WorldRenderer.ACTIVE_AREA_WIDTH
+    ## active area height in tiles at the current zoom
+    self.active_area_height = WorldRenderer.ACTIVE_AREA_HEIGHT
+    ## ScaledImageCache object with the terrain and the animations scaled
+    #  to the zoom levels
+    self.scaled_images = ScaledImageCache()
+    ## surface the view is drawn to in the zoom level before it's scaled
+    #  to the canvas, see __draw_zoomed_view
+    self.__level_canvas = None
+    ## whether the next active area is prefetched and prerendered in a
+    #  background thread, see PREFETCH_TIME
+    self.prefetch = False
+    ## executor that runs the prefetch jobs
+    self.__prefetch_executor = None
+    ## Future object of the current prefetch job
+    self.__prefetch_future = None
+    ## area being prefetched in format (x,y,width,height) in tiles
+    self.__prefetch_area = None
+    ## smoothed view velocity in pixels per second in format (x,y)
+    self.__view_velocity = (0.0,0.0)
+    ## last view velocity sample in format (time,view top left)
+    self.__last_view_sample = None
+    ## state the canvas was last rendered in, in format (view top left,
+    #  active area,terrain image id), None means the canvas has to be
+    #  fully redrawn
+    self.__rendered_state = None
+    ## animation frames the canvas was last rendered with, see
+    #  __animation_frames
+    self.__rendered_animation_frames = None
+    ## animation layers of the active area made by
+    #  ImageCompositor.make_animation_layers
+    self.__animation_layers = {}
+    ## WorldArea object the animation layers have been made for
+    self.__animation_layers_area = None
+    ## canvas rectangles (pygame.Rect objects) invalidated since the last
+    #  rendering
+    self.__dirty_rectangles = []
 
   ## Gets the pixel coordinates of the top left corner of the view
   #  rectangle relative to the world active area.
@@ -393,7 +1844,7 @@ class WorldRenderer:
   #  @return pixel coordinates in format (x,y)
 
   def view_top_left_relative(self):
-    return (self.view_top_left[0] - self.world.active_area[0] * general.TILE_WIDTH,self.view_top_left[1] - self.world.active_area[1] * general.TILE_HEIGHT)
+    return (self.view_top_left[0] - self.active_area[0] * general.TILE_WIDTH,self.view_top_left[1] - self.active_area[1] * general.TILE_HEIGHT)
 
   ## Same as view_top_left_relative, just returns tiles plus pixel
   #  difference.
@@ -408,26 +1859,274 @@ class WorldRenderer:
     y = math.floor(pixel_coordinates[1] / general.TILE_HEIGHT)
     return (x,y,pixel_coordinates[0] - x * general.TILE_WIDTH,pixel_coordinates[1] - y * general.TILE_HEIGHT)
 
-  def __init__(self,world):
+  ## Initialises a new renderer.
+  #
+  #  @param world World object to be rendered
+  #  @param prefetch whether the next active area should be prefetched
+  #         in a background thread, so that the view can scroll without
+  #         pauses at the active area borders
+  #  @param chunk_cache TerrainChunkCache object of the world to draw the
+  #         terrain from, if None, the terrain is prerendered for the
+  #         whole active area, the renderers of the same world should
+  #         share one
+  #  @param view_size view size in pixels in format (width,height), if
+  #         None, VIEW_WIDTH and VIEW_HEIGHT are used
+  #  @param drive_world_area whether the renderer active area should
+  #         also be set as the world active area, only one renderer of a
+  #         world should do this
+  #  @param scaled_images ScaledImageCache object for the zoomed
+  #         rendering, it can be shared by the renderers of the same
+  #         world, if None, a new one is made
+
+  def __init__(self, world, prefetch = False, chunk_cache = None, view_size = None, drive_world_area = True, scaled_images = None):
     self.__init_attributes()
     self.world = world
+    self.prefetch = prefetch
+    self.chunk_cache = chunk_cache
+    self.drive_world_area = drive_world_area
+
+    if view_size != None:
+      self.view_width, self.view_height = view_size
+
+    if scaled_images != None:
+      self.scaled_images = scaled_images
+
+    self.canvas = pygame.Surface((self.view_width,self.view_height))
+    self.__update_view_size()
     self.__change_active_area()
 
+  ## Releases the shared resources of the renderer (the chunk
+  #  references and the prefetch thread), the renderer can't be used
+  #  after this.
+
+  def close(self):
+    if self.chunk_cache != None:
+      self.chunk_cache.set_references(self,())
+
+    if self.__prefetch_executor != None:
+      self.__prefetch_executor.shutdown(wait = False)
+      self.__prefetch_executor = None
+
+  ## Private method, sets the renderer active area (and the world active
+  #  area if the renderer drives it).
+  #
+  #  @param area area in format (x,y,width,height) in tiles
+  #  @param world_area WorldArea object loaded for the area
+
+  def __set_active_area(self, area, world_area):
+    self.active_area = area
+    self.world_area = world_area
+
+    if self.drive_world_area:
+      self.world.set_loaded_active_area(area,world_area)
+
+    if self.chunk_cache != None:           # keep the chunks of the area and have the loader make the missing ones
+      chunks = self.chunk_cache.chunks_in_rectangle((area[0] * general.TILE_WIDTH,area[1] * general.TILE_HEIGHT,area[2] * general.TILE_WIDTH,area[3] * general.TILE_HEIGHT))
+      center = (area[0] + area[2] / 2.0,area[1] + area[3] / 2.0)
+      chunks.sort(key = lambda chunk: abs((chunk[0] + 0.5) * self.chunk_cache.chunk_size - center[0]) + abs((chunk[1] + 0.5) * self.chunk_cache.chunk_size - center[1]))
+      self.chunk_cache.set_references(self,chunks)
+      self.chunk_cache.request_chunks(chunks)
+
   ## Private method that is called to change the world active area and
   #  prerender the terrain for it. The active area is set depending on
   #  the current view coordinates.
 
   def __change_active_area(self):
     image_compositor = ImageCompositor()
-    view_tile_coordinates = self._view_top_left_tiles()
+    previous_area = self.active_area
+    new_area = self.__area_for_view(self._view_top_left_tiles())
+
+    self.__set_active_area(new_area,self.world.load_area(new_area,previous_area,self.world_area))
+
+    if self.chunk_cache != None:            # the terrain is drawn from the chunk cache
+      return
+
+    shift = (new_area[0] - previous_area[0],new_area[1] - previous_area[1])
+
+    with profiler.section("WorldRenderer.change_active_area"):
+      if (self.terrain_image != None and previous_area[2:] == new_area[2:] and
+          abs(shift[0]) < new_area[2] and abs(shift[1]) < new_area[3]):   # the areas overlap, only render the new part
+        image_compositor.scroll_terrain_image(self.terrain_image,self.world_area,shift)
+      else:
+        self.terrain_image = image_compositor.make_terrain_image(self.world_area)
+
+  ## Private method, gets the animation frames of the animated tiles in
+  #  the active area to be shown at given time.
+  #
+  #  @param now time in seconds
+  #  @return dictionary whose key is the tile id and the item is the
+  #          frame index
+
+  def __animation_frames(self, now):
+    tile_types = self.world_area.tile_types
+    return {tile_id: tile_types[tile_id].get_animation_frame(now) for tile_id in self.world_area.get_animated_tiles()}
 
-    new_area = (general.saturate(view_tile_coordinates[0] - WorldRenderer.TILE_PADDING,0,self.world.width - WorldRenderer.ACTIVE_AREA_WIDTH),
-                general.saturate(view_tile_coordinates[1] - WorldRenderer.TILE_PADDING,0,self.world.height - WorldRenderer.ACTIVE_AREA_HEIGHT),
-                WorldRenderer.ACTIVE_AREA_WIDTH,
-                WorldRenderer.ACTIVE_AREA_HEIGHT)
+  ## Private method, gets the animated tiles in the view from the
+  #  animated tile index of the active area.
+  #
+  #  @return list of tuples (tile id,positions), where positions is a
+  #          list of the tile positions on the canvas in pixels in
+  #          format (x,y)
+
+  def __visible_animated_tiles(self):
+    view_top_left_tile = self.view_top_left_relative_tiles()
+    result = []
+
+    for tile_id, (xs, ys) in self.world_area.get_animated_tiles().items():
+      visible = ((xs >= view_top_left_tile[0]) & (xs <= view_top_left_tile[0] + self.view_width_tiles) &
+                 (ys >= view_top_left_tile[1]) & (ys <= view_top_left_tile[1] + self.view_height_tiles))
+
+      if not visible.any():
+        continue
+
+      canvas_xs = (xs[visible] - view_top_left_tile[0]) * general.TILE_WIDTH - view_top_left_tile[2]
+      canvas_ys = (ys[visible] - view_top_left_tile[1]) * general.TILE_HEIGHT - view_top_left_tile[3]
+      result.append((tile_id,list(zip(canvas_xs.tolist(),canvas_ys.tolist()))))
+
+    return result
 
-    self.world.active_area = new_area
-    self.terrain_image = image_compositor.make_terrain_image(self.world.world_area)
+  ## Private method, bakes the animation layers if the active area has
+  #  changed since they were made.
+
+  def __update_animation_layers(self):
+    if self.__animation_layers_area is not self.world_area:
+      self.__animation_layers = ImageCompositor().make_animation_layers(self.world_area)
+      self.__animation_layers_area = self.world_area
+
+  ## Private method, draws the view to the canvas (only inside the
+  #  canvas clip rectangle).
+  #
+  #  @param animation_frames animation frames of the animated tiles, see
+  #         __animation_frames
+
+  def __draw_view(self, animation_frames):
+    if self._zoom != 1.0:
+      self.__draw_zoomed_view(animation_frames)
+      return
+
+    self.canvas.fill((255,0,0,0))
+
+    self.__update_animation_layers()
+    view_relative = self.view_top_left_relative()
+
+    for tile_id in self.__animation_layers:    # one blit per baked tile type
+      position, frames = self.__animation_layers[tile_id]
+      self.canvas.blit(frames[animation_frames[tile_id]],(position[0] - view_relative[0],position[1] - view_relative[1]))
+
+    for tile_id, positions in self.__visible_animated_tiles():
+      if tile_id in self.__animation_layers:
+        continue
+
+      tile_type = self.world_area.tile_types[tile_id]
+      source, area = TileImageLoader.get_tile_image(tile_type).sources[animation_frames[tile_id]]
+      blit_list(self.canvas,[(source,position,area) for position in positions])
+
+    if self.chunk_cache != None:
+      self.chunk_cache.draw(self.canvas,self.view_top_left)
+    else:
+      self.canvas.blit(self.terrain_image,(-1 * view_relative[0],-1 * view_relative[1]))
+
+  ## Private method, draws the whole view to the canvas when zoomed. The
+  #  view is drawn from the images scaled to the zoom level (cached in
+  #  scaled_images) and if the zoom is between the levels, the result is
+  #  scaled to the canvas.
+  #
+  #  @param animation_frames animation frames of the animated tiles, see
+  #         __animation_frames
+
+  def __draw_zoomed_view(self, animation_frames):
+    level = self.__zoom_level()
+
+    if level == self._zoom:
+      target = self.canvas
+    else:
+      size = (int(math.ceil(self.canvas.get_width() * level / self._zoom)),int(math.ceil(self.canvas.get_height() * level / self._zoom)))
+
+      if self.__level_canvas == None or self.__level_canvas.get_size() != size:
+        self.__level_canvas = pygame.Surface(size,0,self.canvas)
+
+      target = self.__level_canvas
+
+    def scaled_image(key, image_function):
+      return image_function() if level == 1.0 else self.scaled_images.get_scaled_image(key,level,image_function)
+
+    target.fill((255,0,0,0))
+
+    self.__update_animation_layers()
+    view_relative = self.view_top_left_relative()
+    layers_key = (self.active_area,id(self.__animation_layers_area))
+
+    for tile_id in self.__animation_layers:
+      position, frames = self.__animation_layers[tile_id]
+      frame = animation_frames[tile_id]
+      image = scaled_image(("layer",layers_key,tile_id,frame),lambda: frames[frame])
+      target.blit(image,(math.floor((position[0] - view_relative[0]) * level),math.floor((position[1] - view_relative[1]) * level)))
+
+    for tile_id, positions in self.__visible_animated_tiles():
+      if tile_id in self.__animation_layers:
+        continue
+
+      tile_type = self.world_area.tile_types[tile_id]
+      frame = animation_frames[tile_id]
+      image = scaled_image(("tile",tile_id,frame),lambda: TileImageLoader.get_tile_image(tile_type).main_tile[frame])
+
+      for position in positions:
+        target.blit(image,(math.floor(position[0] * level),math.floor(position[1] * level)))
+
+    if self.chunk_cache != None:
+      chunk_width = self.chunk_cache.chunk_size * general.TILE_WIDTH
+      chunk_height = self.chunk_cache.chunk_size * general.TILE_HEIGHT
+      view_rectangle = (self._view_top_left[0],self._view_top_left[1],self.canvas.get_width() / self._zoom,self.canvas.get_height() / self._zoom)
+
+      for chunk_x, chunk_y in self.chunk_cache.chunks_in_rectangle(view_rectangle):
+        image = scaled_image(("chunk",id(self.chunk_cache),chunk_x,chunk_y),lambda: self.chunk_cache.get_chunk_image(chunk_x,chunk_y))
+        target.blit(image,(math.floor((chunk_x * chunk_width - self._view_top_left[0]) * level),math.floor((chunk_y * chunk_height - self._view_top_left[1]) * level)))
+    else:
+      image = scaled_image(("terrain",self.active_area,id(self.terrain_image)),lambda: self.terrain_image)
+      target.blit(image,(math.floor(-1 * view_relative[0] * level),math.floor(-1 * view_relative[1] * level)))
+
+    if target is not self.canvas:
+      pygame.transform.smoothscale(target,self.canvas.get_size(),self.canvas)
+
+  ## Private method, gets the current canvas state, see
+  #  __rendered_state.
+
+  def __canvas_state(self):
+    return (self._view_top_left,self._zoom,self.active_area,id(self.terrain_image))
+
+  ## Converts a world pixel rectangle to the canvas rectangle it's drawn
+  #  to at the current view position and zoom.
+  #
+  #  @param rectangle world pixel rectangle in format (x,y,width,height)
+  #  @return pygame.Rect
+
+  def world_to_canvas_rectangle(self, rectangle):
+    x = math.floor((rectangle[0] - self._view_top_left[0]) * self._zoom)
+    y = math.floor((rectangle[1] - self._view_top_left[1]) * self._zoom)
+    return pygame.Rect(x,y,math.ceil((rectangle[0] + rectangle[2] - self._view_top_left[0]) * self._zoom) - x,math.ceil((rectangle[1] + rectangle[3] - self._view_top_left[1]) * self._zoom) - y)
+
+  ## Converts a canvas rectangle to the world pixel rectangle drawn in it
+  #  at the current view position and zoom.
+  #
+  #  @param rectangle canvas rectangle in format (x,y,width,height)
+  #  @return rectangle in format (x,y,width,height)
+
+  def canvas_to_world_rectangle(self, rectangle):
+    x = self._view_top_left[0] + math.floor(rectangle[0] / self._zoom)
+    y = self._view_top_left[1] + math.floor(rectangle[1] / self._zoom)
+    return (x,y,self._view_top_left[0] + math.ceil((rectangle[0] + rectangle[2]) / self._zoom) - x,self._view_top_left[1] + math.ceil((rectangle[1] + rectangle[3]) / self._zoom) - y)
+
+  ## Marks a part of the world as changed (e.g. by a moving sprite), so
+  #  that render_dirty() redraws it.
+  #
+  #  @param rectangle world pixel rectangle in format
+  #         (x,y,width,height), if None, the whole view is invalidated
+
+  def invalidate(self, rectangle = None):
+    if rectangle == None:
+      self.__rendered_state = None
+    else:
+      self.__dirty_rectangles.append(self.world_to_canvas_rectangle(rectangle))
 
   ## Renders the current world view.
   #
@@ -436,22 +2135,74 @@ class WorldRenderer:
   #          if the image couldn't be rendered (no world assigned etc.),
   #          None is returned
 
+  @profiler.timed("WorldRenderer.render")
   def render(self):
-    self.canvas.fill((255,0,0,0))
+    animation_frames = self.__animation_frames(time.time())
+    self.__draw_view(animation_frames)
 
-    view_top_left_tile = self.view_top_left_relative_tiles()
-
-    # prepass, get objects in view to be rendered plus render animated files
-    y = -view_top_left_tile[3]
-    for j in range(view_top_left_tile[1],view_top_left_tile[1] + WorldRenderer.ACTIVE_AREA_HEIGHT):
-      x = -view_top_left_tile[2]
-      for i in range(view_top_left_tile[0],view_top_left_tile[0] + WorldRenderer.ACTIVE_AREA_WIDTH):
-        tile_type = self.world.world_area.get_tile_type(i,j)
-        if tile_type.animated:
-          self.canvas.blit(TileImageLoader.get_tile_image(tile_type).main_tile[int(time.time()) % 4],(x,y))
-        x += general.TILE_WIDTH
-      y += general.TILE_HEIGHT
+    self.__rendered_state = self.__canvas_state()
+    self.__rendered_animation_frames = animation_frames
+    self.__dirty_rectangles = []
 
-    view_relative = self.view_top_left_relative()
-    self.canvas.blit(self.terrain_image,(-1 * view_relative[0],-1 * view_relative[1]))
     return self.canvas
+
+  ## Renders the current world view like render(), but only redraws the
+  #  parts of the canvas that have changed since the last rendering (the
+  #  view has scrolled, an animation frame has changed or a part has been
+  #  invalidated with invalidate()).
+  #
+  #  @return list of the changed canvas rectangles (pygame.Rect objects),
+  #          which can be passed to pygame.display.update, empty if
+  #          nothing has changed, the rendered image is in canvas
+
+  @profiler.timed("WorldRenderer.render_dirty")
+  def render_dirty(self):
+    canvas_rectangle = self.canvas.get_rect()
+
+    if self.__canvas_state() != self.__rendered_state:    # scrolled, everything has changed
+      self.render()
+      return [canvas_rectangle]
+
+    animation_frames = self.__animation_frames(time.time())
+    rectangles = self.__dirty_rectangles
+
+    if self._zoom != 1.0:                   # the zoomed view is always redrawn whole
+      if animation_frames != self.__rendered_animation_frames or len(rectangles) != 0:
+        self.render()
+        return [canvas_rectangle]
+
+      return []
+
+    if animation_frames != self.__rendered_animation_frames:
+      for tile_id, positions in self.__visible_animated_tiles():
+        if animation_frames[tile_id] != self.__rendered_animation_frames.get(tile_id):
+          rectangles += [pygame.Rect(position,(general.TILE_WIDTH,general.TILE_HEIGHT)) for position in positions]
+
+    rectangles = [rectangle.clip(canvas_rectangle) for rectangle in rectangles]
+    rectangles = [rectangle for rectangle in rectangles if rectangle.width > 0 and rectangle.height > 0]
+
+    merged = []
+
+    for rectangle in rectangles:            # merge only the rectangles that overlap or touch, a union of distant ones would redraw everything between them
+      while True:
+        index = rectangle.inflate(2,2).collidelist(merged)
+
+        if index < 0:
+          break
+
+        rectangle = rectangle.union(merged.pop(index))
+
+      merged.append(rectangle)
+
+    rectangles = merged
+
+    for rectangle in rectangles:
+      self.canvas.set_clip(rectangle)
+      self.__draw_view(animation_frames)
+
+    self.canvas.set_clip(None)
+
+    self.__rendered_animation_frames = animation_frames
+    self.__dirty_rectangles = []
+
+    return rectangles
@@ -0,0 +1,185 @@
+## \file loop.py
+#
+#  This file contains the game main loop.
+
+import time
+import pygame
+import profiler
+
+## Fixed timestep game loop with frame pacing.
+#
+#  The simulation is advanced in fixed time steps (so that its speed
+#  doesn't depend on the frame rate) and the rendering gets the fraction
+#  of a time step by which the real time is ahead of the simulation, so
+#  it can interpolate between the last two simulation states. The frame
+#  rate is capped with pygame.time.Clock, which sleeps instead of spinning
+#  the CPU. When a frame takes long (e.g. the active area is switched),
+#  the simulation catches up with more steps in the next frame, and with
+#  render skipping on, the rendering of such frames can be skipped. When
+#  the render function reports that nothing has changed, the loop idles at
+#  a low frame rate until something does.
+
+class GameLoop:
+
+  ## default simulation updates per second
+
+  UPDATE_RATE = 60
+
+  ## default frame rate cap (frames per second), 0 means no cap
+
+  MAX_FPS = 60
+
+  ## default frame rate while idle (nothing has been drawn in the last
+  #  frame), 0 means no idling
+
+  IDLE_FPS = 20
+
+  ## maximum simulation updates per frame, if the simulation is further
+  #  behind, the rest of the time is dropped (it slows down rather than
+  #  getting stuck catching up)
+
+  MAX_UPDATES_PER_FRAME = 5
+
+  ## maximum number of consecutive frames whose rendering can be skipped
+
+  MAX_SKIPPED_RENDERS = 2
+
+  ## frame time longer than this (in seconds) is considered this long,
+  #  e.g. after the window has been dragged
+
+  MAX_FRAME_TIME = 0.25
+
+  ## weight of the newest frame time in the smoothed frame time
+
+  SMOOTHING = 0.1
+
+  def __init_attributes(self):
+    ## function called once per frame to handle the input, without
+    #  arguments, or None
+    self.events_function = None
+    ## function called for each simulation step with the time step (in
+    #  seconds) as the argument
+    self.update_function = None
+    ## function called to render a frame with the interpolation factor
+    #  in range <0,1) as the argument, it returns False if nothing has
+    #  been drawn
+    self.render_function = None
+    ## simulation time step in seconds
+    self.time_step = 1.0 / GameLoop.UPDATE_RATE
+    ## frame rate cap, 0 means no cap
+    self.max_fps = GameLoop.MAX_FPS
+    ## frame rate while idle, 0 means no idling
+    self.idle_fps = GameLoop.IDLE_FPS
+    ## whether the rendering can be skipped when the simulation is behind
+    self.skip_render = False
+    ## whether the loop is running, set to False to stop it
+    self.running = False
+    ## total simulated time in seconds
+    self.simulation_time = 0.0
+    ## exponentially smoothed frame time in seconds
+    self.smoothed_frame_time = 0.0
+    ## number of rendered frames
+    self.frames_rendered = 0
+    ## number of frames whose rendering has been skipped
+    self.frames_skipped = 0
+    ## number of frames in which nothing has been drawn
+    self.frames_idle = 0
+    ## real time not yet simulated in seconds
+    self.__accumulator = 0.0
+    ## number of consecutive frames whose rendering has been skipped
+    self.__skipped_renders = 0
+    ## whether nothing has been drawn in the last frame
+    self.__idle = False
+
+  ## Initialises a new loop.
+  #
+  #  @param update_function function called for each simulation step,
+  #         it gets the time step in seconds
+  #  @param render_function function called to render a frame, it gets
+  #         the interpolation factor in range <0,1), i.e. how far the
+  #         real time is between the last and the next simulation step,
+  #         it returns False if nothing has been drawn and nothing is
+  #         about to change (e.g. no input is held), then the loop idles
+  #         (any other value, including None, means something has been
+  #         drawn)
+  #  @param events_function function called once per frame before the
+  #         simulation steps to handle the input, or None
+  #  @param update_rate simulation updates per second
+  #  @param max_fps frame rate cap, 0 means no cap
+  #  @param idle_fps frame rate while idle, 0 means no idling
+  #  @param skip_render whether the rendering of a frame can be skipped
+  #         when the previous frame took longer than two time steps (at
+  #         most MAX_SKIPPED_RENDERS frames in a row)
+
+  def __init__(self, update_function, render_function, events_function = None, update_rate = UPDATE_RATE, max_fps = MAX_FPS, idle_fps = IDLE_FPS, skip_render = False):
+    self.__init_attributes()
+    self.update_function = update_function
+    self.render_function = render_function
+    self.events_function = events_function
+    self.time_step = 1.0 / update_rate
+    self.max_fps = max_fps
+    self.idle_fps = idle_fps
+    self.skip_render = skip_render
+
+  ## Gets the smoothed frame rate.
+
+  def get_fps(self):
+    return 1.0 / self.smoothed_frame_time if self.smoothed_frame_time > 0 else 0.0
+
+  ## Makes the loop stop after the current frame.
+
+  def stop(self):
+    self.running = False
+
+  ## Runs the loop until stop() is called.
+
+  def run(self):
+    self.running = True
+    clock = pygame.time.Clock()
+    previous_time = time.perf_counter()
+
+    while self.running:
+      profiler.begin_frame()
+
+      now = time.perf_counter()
+      frame_time = min(now - previous_time,GameLoop.MAX_FRAME_TIME)
+      previous_time = now
+
+      if self.smoothed_frame_time == 0:
+        self.smoothed_frame_time = frame_time
+      else:
+        self.smoothed_frame_time += (frame_time - self.smoothed_frame_time) * GameLoop.SMOOTHING
+
+      if self.events_function != None:
+        with profiler.section("events"):
+          self.events_function()
+
+      self.__accumulator += frame_time
+      updates = 0
+
+      with profiler.section("update"):
+        while self.__accumulator >= self.time_step and updates < GameLoop.MAX_UPDATES_PER_FRAME:
+          self.update_function(self.time_step)
+          self.simulation_time += self.time_step
+          self.__accumulator -= self.time_step
+          updates += 1
+
+      if self.__accumulator >= self.time_step:     # too far behind, drop the time
+        self.__accumulator = self.__accumulator % self.time_step
+
+      # the long frames after idling aren't load, so they are rendered:
+      if self.skip_render and not self.__idle and frame_time > 2 * self.time_step and self.__skipped_renders < GameLoop.MAX_SKIPPED_RENDERS:   # under load
+        self.__skipped_renders += 1
+        self.frames_skipped += 1
+      else:
+        self.__skipped_renders = 0
+        self.frames_rendered += 1
+        self.__idle = self.render_function(self.__accumulator / self.time_step) == False
+
+        if self.__idle:
+          self.frames_idle += 1
+
+      if self.__idle and self.idle_fps > 0:       # nothing is changing, don't waste CPU
+        clock.tick(self.idle_fps)
+      elif self.max_fps > 0:
+        clock.tick(self.max_fps)
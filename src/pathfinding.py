@@ -0,0 +1,681 @@
+## \file pathfinding.py
+#
+#  This file contains classes for finding paths in the game world.
+
+import heapq
+import math
+import time
+import collections
+import numpy
+import general
+
+SQRT2 = math.sqrt(2)
+
+INFINITY = float("inf")
+
+## the 8 directions of a move on the tile grid in format (dx,dy)
+
+DIRECTIONS = [(1,0),(-1,0),(0,1),(0,-1),(1,1),(1,-1),(-1,1),(-1,-1)]
+
+## Computes the octile distance of two tiles, i.e. the length of the
+#  shortest path between them on an empty grid with diagonal moves.
+
+def octile_distance(a, b):
+  dx = abs(a[0] - b[0])
+  dy = abs(a[1] - b[1])
+  return max(dx,dy) + (SQRT2 - 1) * min(dx,dy)
+
+#=======================================================================
+
+## Holds the movement costs of tiles in a rectangle of the world and
+#  implements the searches on them.
+#
+#  The cost of a move is the cost of the entered tile times the move
+#  length (1 for a straight move, sqrt(2) for a diagonal move). The
+#  tile cost is the lowest cost of the allowed movement modes in which
+#  the tile is passable (see PassabilityMap), tiles that are not
+#  passable in any of the modes have infinite cost. A diagonal move is
+#  only possible if both of the tiles it goes around are passable, so
+#  paths never cut corners. All the coordinates are world tile
+#  coordinates.
+
+class CostGrid:
+
+  ## Initialises the grid for given rectangle of the world.
+  #
+  #  @param world_object World object
+  #  @param rectangle rectangle in format (x,y,width,height) in tiles
+  #  @param modes dictionary of the allowed movement modes, the key is
+  #         the mode (general.MOVEMENT_*), the item is the cost of one
+  #         tile move in this mode
+
+  def __init__(self, world_object, rectangle, modes):
+    ## rectangle of the grid in format (x,y,width,height)
+    self.rectangle = rectangle
+    costs = numpy.full((rectangle[2],rectangle[3]),numpy.inf)
+
+    for mode in modes:
+      passable = world_object.passability.get_passability(rectangle,mode)
+      costs = numpy.where(passable,numpy.minimum(costs,modes[mode]),costs)
+
+    finite = costs[numpy.isfinite(costs)]
+
+    ## the tile costs as a flat list indexed [y * width + x] (relative to the rectangle)
+    self.costs = costs.T.ravel().tolist()
+    ## the lowest tile cost (used for the heuristic)
+    self.minimum_cost = float(finite.min()) if len(finite) != 0 else 1.0
+    ## whether all the passable tiles have the same cost (so that jump point search can be used)
+    self.uniform = len(finite) == 0 or float(finite.max()) == self.minimum_cost
+
+  ## Gets the cost of entering given tile.
+  #
+  #  @return the tile cost, infinity if the tile is not passable or is
+  #          outside the grid
+
+  def cost(self, x, y):
+    x -= self.rectangle[0]
+    y -= self.rectangle[1]
+
+    if x < 0 or y < 0 or x >= self.rectangle[2] or y >= self.rectangle[3]:
+      return INFINITY
+
+    return self.costs[y * self.rectangle[2] + x]
+
+  ## Private method, checks if a tile is passable and inside given
+  #  bounds.
+
+  def __passable(self, x, y, bounds):
+    if x < bounds[0] or y < bounds[1] or x >= bounds[0] + bounds[2] or y >= bounds[1] + bounds[3]:
+      return False
+
+    return self.cost(x,y) != INFINITY
+
+  ## Gets the possible moves from a tile.
+  #
+  #  @param bounds rectangle in format (x,y,width,height) that the moves
+  #         must stay in
+  #  @return list of tuples ((x,y),move cost)
+
+  def moves(self, tile, bounds):
+    result = []
+    x, y = tile
+
+    for dx, dy in DIRECTIONS:
+      if not self.__passable(x + dx,y + dy,bounds):
+        continue
+
+      if dx != 0 and dy != 0:
+        if not (self.__passable(x + dx,y,bounds) and self.__passable(x,y + dy,bounds)):
+          continue
+
+        result.append(((x + dx,y + dy),self.cost(x + dx,y + dy) * SQRT2))
+      else:
+        result.append(((x + dx,y + dy),self.cost(x + dx,y + dy)))
+
+    return result
+
+  ## Private method, makes the path from the A* parent links.
+
+  def __make_path(self, parents, tile):
+    result = [tile]
+
+    while parents[tile] != None:
+      tile = parents[tile]
+      result.append(tile)
+
+    result.reverse()
+    return result
+
+  ## Finds the shortest path between two tiles with the A* algorithm.
+  #
+  #  @param start start tile in format (x,y)
+  #  @param goal goal tile in format (x,y)
+  #  @param bounds rectangle in format (x,y,width,height) the path must
+  #         stay in, if None, the whole grid is used
+  #  @return tuple (path,cost) where path is a list of tiles from start
+  #          to goal (both included), or None if there is no path
+
+  def find_path_astar(self, start, goal, bounds = None):
+    if bounds == None:
+      bounds = self.rectangle
+
+    if not (self.__passable(start[0],start[1],bounds) and self.__passable(goal[0],goal[1],bounds)):
+      return None
+
+    heap = [(octile_distance(start,goal) * self.minimum_cost,0.0,start)]
+    costs = {start: 0.0}
+    parents = {start: None}
+    closed = set()
+
+    while len(heap) != 0:
+      path_cost, tile = heapq.heappop(heap)[1:]
+
+      if tile in closed:
+        continue
+
+      if tile == goal:
+        return (self.__make_path(parents,goal),path_cost)
+
+      closed.add(tile)
+
+      for neighbour, move_cost in self.moves(tile,bounds):
+        new_cost = path_cost + move_cost
+
+        if new_cost < costs.get(neighbour,INFINITY):
+          costs[neighbour] = new_cost
+          parents[neighbour] = tile
+          heapq.heappush(heap,(new_cost + octile_distance(neighbour,goal) * self.minimum_cost,new_cost,neighbour))
+
+    return None
+
+  ## Computes the costs of the shortest paths from a tile to all the
+  #  reachable tiles (Dijkstra's algorithm).
+  #
+  #  @param start start tile in format (x,y)
+  #  @param bounds rectangle in format (x,y,width,height) the paths must
+  #         stay in
+  #  @return dictionary, the key is the tile, the item is the path cost
+
+  def path_costs(self, start, bounds):
+    if not self.__passable(start[0],start[1],bounds):
+      return {}
+
+    heap = [(0.0,start)]
+    result = {}
+
+    while len(heap) != 0:
+      path_cost, tile = heapq.heappop(heap)
+
+      if tile in result:
+        continue
+
+      result[tile] = path_cost
+
+      for neighbour, move_cost in self.moves(tile,bounds):
+        if neighbour not in result:
+          heapq.heappush(heap,(path_cost + move_cost,neighbour))
+
+    return result
+
+  ## Private method, the jump of the jump point search: goes from a tile
+  #  in given direction until it finds a jump point (the goal, a tile
+  #  with a forced neighbour or, when going diagonally, a tile from which
+  #  a straight jump finds a jump point).
+  #
+  #  @return the jump point tile or None
+
+  def __jump(self, x, y, dx, dy, goal, bounds):
+    passable = self.__passable
+
+    while True:
+      if not passable(x,y,bounds):
+        return None
+
+      if (x,y) == goal:
+        return (x,y)
+
+      if dx != 0 and dy != 0:
+        if self.__jump(x + dx,y,dx,0,goal,bounds) != None or self.__jump(x,y + dy,0,dy,goal,bounds) != None:
+          return (x,y)
+
+        if not (passable(x + dx,y,bounds) and passable(x,y + dy,bounds)):
+          return None
+      elif dx != 0:
+        if ((passable(x,y - 1,bounds) and not passable(x - dx,y - 1,bounds)) or
+            (passable(x,y + 1,bounds) and not passable(x - dx,y + 1,bounds))):
+          return (x,y)
+      else:
+        if ((passable(x - 1,y,bounds) and not passable(x - 1,y - dy,bounds)) or
+            (passable(x + 1,y,bounds) and not passable(x + 1,y - dy,bounds))):
+          return (x,y)
+
+      x += dx
+      y += dy
+
+  ## Private method, gets the directions in which the jump point search
+  #  continues from a tile reached from given parent.
+
+  def __jump_directions(self, tile, parent, bounds):
+    if parent == None:
+      return DIRECTIONS
+
+    x, y = tile
+    dx = (x > parent[0]) - (x < parent[0])
+    dy = (y > parent[1]) - (y < parent[1])
+    passable = self.__passable
+
+    if dx != 0 and dy != 0:
+      return [(dx,0),(0,dy),(dx,dy)]
+
+    result = [(dx,dy)]
+
+    if dx != 0:
+      for side in (-1,1):
+        if passable(x,y + side,bounds) and not passable(x - dx,y + side,bounds):
+          result.append((0,side))
+          result.append((dx,side))
+    else:
+      for side in (-1,1):
+        if passable(x + side,y,bounds) and not passable(x + side,y - dy,bounds):
+          result.append((side,0))
+          result.append((side,dy))
+
+    return result
+
+  ## Finds the shortest path between two tiles with the jump point
+  #  search, which is much faster than A* on grids with uniform cost,
+  #  it may only be used if the uniform attribute is True.
+  #
+  #  @param start start tile in format (x,y)
+  #  @param goal goal tile in format (x,y)
+  #  @param bounds rectangle in format (x,y,width,height) the path must
+  #         stay in, if None, the whole grid is used
+  #  @return tuple (path,cost) where path is a list of tiles from start
+  #          to goal (both included), or None if there is no path
+
+  def find_path_jps(self, start, goal, bounds = None):
+    if bounds == None:
+      bounds = self.rectangle
+
+    if not (self.__passable(start[0],start[1],bounds) and self.__passable(goal[0],goal[1],bounds)):
+      return None
+
+    heap = [(octile_distance(start,goal),0.0,start)]
+    distances = {start: 0.0}
+    parents = {start: None}
+    closed = set()
+
+    while len(heap) != 0:
+      distance, tile = heapq.heappop(heap)[1:]
+
+      if tile in closed:
+        continue
+
+      if tile == goal:
+        jump_points = self.__make_path(parents,goal)
+        path = [start]
+
+        for point in jump_points[1:]:           # fill in the tiles between the jump points
+          dx = (point[0] > path[-1][0]) - (point[0] < path[-1][0])
+          dy = (point[1] > path[-1][1]) - (point[1] < path[-1][1])
+
+          while path[-1] != point:
+            path.append((path[-1][0] + dx,path[-1][1] + dy))
+
+        return (path,distance * self.minimum_cost)
+
+      closed.add(tile)
+
+      for dx, dy in self.__jump_directions(tile,parents[tile],bounds):
+        if dx != 0 and dy != 0 and not (self.__passable(tile[0] + dx,tile[1],bounds) and self.__passable(tile[0],tile[1] + dy,bounds)):
+          continue
+
+        jump_point = self.__jump(tile[0] + dx,tile[1] + dy,dx,dy,goal,bounds)
+
+        if jump_point == None or jump_point in closed:
+          continue
+
+        new_distance = distance + octile_distance(tile,jump_point)
+
+        if new_distance < distances.get(jump_point,INFINITY):
+          distances[jump_point] = new_distance
+          parents[jump_point] = tile
+          heapq.heappush(heap,(new_distance + octile_distance(jump_point,goal),new_distance,jump_point))
+
+    return None
+
+  ## Finds the shortest path with the jump point search if the grid is
+  #  uniform, otherwise with A*.
+  #
+  #  @see find_path_astar
+
+  def find_path(self, start, goal, bounds = None):
+    if self.uniform:
+      return self.find_path_jps(start,goal,bounds)
+
+    return self.find_path_astar(start,goal,bounds)
+
+#=======================================================================
+
+## Represents a path query that can be processed later (see
+#  PathFinder.request_path).
+
+class PathRequest:
+  def __init__(self, start, goal):
+    ## start tile in format (x,y)
+    self.start = start
+    ## goal tile in format (x,y)
+    self.goal = goal
+    ## whether the request has been processed
+    self.done = False
+    ## the found path as a list of tiles from start to goal (both
+    #  included) or None if there is no path (or it hasn't been processed
+    #  yet)
+    self.path = None
+
+#=======================================================================
+
+## Finds paths in the world exterior for given movement modes.
+#
+#  Short paths are searched for directly on the tile grid (by the jump
+#  point search if all the allowed modes have the same cost, otherwise
+#  by A*). Long paths are searched for hierarchically: the world is
+#  divided into square clusters, the border of each pair of neighbouring
+#  clusters has entrances (one for each passable part of the border)
+#  and the costs of the paths between the entrances of each cluster are
+#  precomputed. A* then runs on the graph of the entrances and its
+#  result is refined to tiles cluster by cluster. The cluster data are
+#  computed when they are first needed and have to be invalidated when
+#  the passability of the world changes (see invalidate).
+#
+#  Many queries (e.g. of all the NPCs) can be queued with request_path
+#  and processed with process_requests within a time budget each frame.
+
+class PathFinder:
+
+  ## default cluster width and height in tiles
+
+  CLUSTER_SIZE = 16
+
+  ## Private method, initialises the default attribute values
+
+  def __init_attributes(self):
+    ## World object to search paths in
+    self.world = None
+    ## allowed movement modes, the key is the mode (general.MOVEMENT_*),
+    #  the item is the cost of one tile move in this mode
+    self.modes = {general.MOVEMENT_WALK: 1.0}
+    ## cluster width and height in tiles
+    self.cluster_size = PathFinder.CLUSTER_SIZE
+    ## cluster data, the key is (cluster_x,cluster_y), the items are
+    #  tuples (CostGrid,dictionary of entrance edges) where the
+    #  dictionary key is an entrance tile and the items are lists of
+    #  (tile,cost) edges going from it
+    self.__clusters = {}
+    ## entrances between neighbouring clusters, the key is
+    #  (cluster_x,cluster_y,direction) where direction is (1,0) or
+    #  (0,1), the items are lists of (tile,tile) pairs (the first tile is
+    #  in the cluster, the second one in its neighbour)
+    self.__borders = {}
+    ## queue of the PathRequest objects waiting to be processed
+    self.__requests = collections.deque()
+
+  ## Initialises a new path finder.
+  #
+  #  @param world_object World object to search the paths in
+  #  @param modes dictionary of the allowed movement modes, the key is
+  #         the mode (general.MOVEMENT_*), the item is the cost of one
+  #         tile move in this mode, if None, only walking with cost 1 is
+  #         allowed
+  #  @param cluster_size cluster width and height in tiles
+
+  def __init__(self, world_object, modes = None, cluster_size = CLUSTER_SIZE):
+    self.__init_attributes()
+    self.world = world_object
+    self.cluster_size = cluster_size
+
+    if modes != None:
+      self.modes = dict(modes)
+
+  ## Private method, returns the rectangle of given cluster.
+
+  def __cluster_rectangle(self, key):
+    return general.rectangle_intersection((key[0] * self.cluster_size,key[1] * self.cluster_size,self.cluster_size,self.cluster_size),(0,0,self.world.width,self.world.height))
+
+  ## Private method, returns the key of the cluster given tile is in.
+
+  def __cluster_key(self, tile):
+    return (tile[0] // self.cluster_size,tile[1] // self.cluster_size)
+
+  ## Private method, gets the cost grid of a cluster (with one tile
+  #  around it).
+
+  def __cluster_grid(self, key):
+    try:
+      return self.__clusters[key][0]
+    except KeyError:
+      rectangle = self.__cluster_rectangle(key)
+      return CostGrid(self.world,(rectangle[0] - 1,rectangle[1] - 1,rectangle[2] + 2,rectangle[3] + 2),self.modes)
+
+  ## Private method, gets the entrances on the right (direction (1,0))
+  #  or lower (direction (0,1)) border of a cluster.
+
+  def __border_entrances(self, key, direction):
+    border_key = (key[0],key[1],direction)
+
+    try:
+      return self.__borders[border_key]
+    except KeyError:
+      pass
+
+    result = []
+    rectangle = self.__cluster_rectangle(key)
+    neighbour = self.__cluster_rectangle((key[0] + direction[0],key[1] + direction[1]))
+
+    if rectangle != None and neighbour != None:
+      grid = self.__cluster_grid(key)
+
+      if direction == (1,0):
+        pairs = [((rectangle[0] + rectangle[2] - 1,y),(rectangle[0] + rectangle[2],y)) for y in range(rectangle[1],rectangle[1] + rectangle[3])]
+      else:
+        pairs = [((x,rectangle[1] + rectangle[3] - 1),(x,rectangle[1] + rectangle[3])) for x in range(rectangle[0],rectangle[0] + rectangle[2])]
+
+      run = []
+
+      for pair in pairs + [None]:                     # one entrance in the middle of each passable run
+        if pair != None and grid.cost(pair[0][0],pair[0][1]) != INFINITY and grid.cost(pair[1][0],pair[1][1]) != INFINITY:
+          run.append(pair)
+        elif len(run) != 0:
+          result.append(run[len(run) // 2])
+          run = []
+
+    self.__borders[border_key] = result
+    return result
+
+  ## Private method, gets the data of a cluster (see __clusters),
+  #  computing them if needed.
+
+  def __cluster(self, key):
+    try:
+      return self.__clusters[key]
+    except KeyError:
+      pass
+
+    grid = self.__cluster_grid(key)
+    rectangle = self.__cluster_rectangle(key)
+    edges = {}
+
+    # entrances on all four borders, the inter-cluster edges first:
+    for direction in ((1,0),(0,1)):
+      for inside, outside in self.__border_entrances(key,direction):
+        edges.setdefault(inside,[]).append((outside,grid.cost(outside[0],outside[1])))
+
+      for outside, inside in self.__border_entrances((key[0] - direction[0],key[1] - direction[1]),direction):
+        edges.setdefault(inside,[]).append((outside,grid.cost(outside[0],outside[1])))
+
+    # the intra-cluster edges:
+    entrances = list(edges)
+
+    for entrance in entrances:
+      costs = grid.path_costs(entrance,rectangle)
+
+      for other in entrances:
+        if other != entrance and other in costs:
+          edges[entrance].append((other,costs[other]))
+
+    self.__clusters[key] = (grid,edges)
+    return self.__clusters[key]
+
+  ## Invalidates the precomputed cluster data in given rectangle, this
+  #  has to be called when the passability of the world changes there
+  #  (e.g. a prop has been placed).
+  #
+  #  @param rectangle rectangle in format (x,y,width,height) in tiles
+
+  def invalidate(self, rectangle):
+    first = self.__cluster_key((rectangle[0] - 1,rectangle[1] - 1))
+    last = self.__cluster_key((rectangle[0] + rectangle[2],rectangle[1] + rectangle[3]))
+
+    for cluster_y in range(first[1],last[1] + 1):
+      for cluster_x in range(first[0],last[0] + 1):
+        self.__clusters.pop((cluster_x,cluster_y),None)
+
+        for direction in ((1,0),(0,1)):
+          self.__borders.pop((cluster_x,cluster_y,direction),None)
+
+  ## Private method, refines a path between two tiles of the same
+  #  cluster to a list of tiles (without the first tile).
+
+  def __refine(self, a, b):
+    key = self.__cluster_key(a)
+
+    if self.__cluster_key(b) != key:          # inter-cluster edge, the tiles are neighbours
+      return [b]
+
+    return self.__cluster(key)[0].find_path(a,b,self.__cluster_rectangle(key))[0][1:]
+
+  ## Finds a path hierarchically (see the class description).
+  #
+  #  @return path as a list of tiles or None
+
+  def find_path_hierarchical(self, start, goal):
+    start_key = self.__cluster_key(start)
+    goal_key = self.__cluster_key(goal)
+    start_grid, start_edges = self.__cluster(start_key)
+    goal_grid, goal_edges = self.__cluster(goal_key)
+
+    # connect the start and the goal to the entrances of their clusters:
+    start_costs = start_grid.path_costs(start,self.__cluster_rectangle(start_key))
+
+    if len(start_costs) == 0:
+      return None
+
+    if start == goal:
+      return [start]
+
+    goal_rectangle = self.__cluster_rectangle(goal_key)
+    goal_entrances = {}
+
+    for entrance in goal_edges:
+      path = goal_grid.find_path(entrance,goal,goal_rectangle)
+
+      if path != None:
+        goal_entrances[entrance] = path[1]
+
+    minimum_cost = min(self.modes.values())
+    heap = [(octile_distance(start,goal) * minimum_cost,0.0,start)]
+    costs = {start: 0.0}
+    parents = {start: None}
+    closed = set()
+
+    if goal in start_costs:                   # the goal is in the start cluster
+      costs[goal] = start_costs[goal]
+      parents[goal] = start
+      heapq.heappush(heap,(start_costs[goal],start_costs[goal],goal))
+
+    while len(heap) != 0:
+      path_cost, tile = heapq.heappop(heap)[1:]
+
+      if tile in closed:
+        continue
+
+      if tile == goal:
+        nodes = [tile]
+
+        while parents[tile] != None:
+          tile = parents[tile]
+          nodes.append(tile)
+
+        nodes.reverse()
+        path = [start]
+
+        for i in range(1,len(nodes)):
+          path.extend(self.__refine(nodes[i - 1],nodes[i]))
+
+        return path
+
+      closed.add(tile)
+
+      if tile == start:                       # the start can be an entrance itself, then it also has the inter-cluster edges
+        edges = [(entrance,start_costs[entrance]) for entrance in start_edges if entrance in start_costs and entrance != start]
+        edges += start_edges.get(start,[])
+      else:
+        edges = list(self.__cluster(self.__cluster_key(tile))[1].get(tile,[]))
+
+        if tile in goal_entrances:
+          edges.append((goal,goal_entrances[tile]))
+
+      for neighbour, edge_cost in edges:
+        new_cost = path_cost + edge_cost
+
+        if new_cost < costs.get(neighbour,INFINITY):
+          costs[neighbour] = new_cost
+          parents[neighbour] = tile
+          heapq.heappush(heap,(new_cost + octile_distance(neighbour,goal) * minimum_cost,new_cost,neighbour))
+
+    return None
+
+  ## Finds a path between two tiles. Paths between close tiles are
+  #  searched for on the tile grid around them, the other ones (and the
+  #  close ones that aren't found this way) hierarchically.
+  #
+  #  @param start start tile in format (x,y)
+  #  @param goal goal tile in format (x,y)
+  #  @return path as a list of tiles from start to goal (both included)
+  #          or None if there is no path
+
+  def find_path(self, start, goal):
+    world_rectangle = (0,0,self.world.width,self.world.height)
+
+    if general.rectangle_intersection((start[0],start[1],1,1),world_rectangle) == None or general.rectangle_intersection((goal[0],goal[1],1,1),world_rectangle) == None:
+      return None
+
+    if max(abs(start[0] - goal[0]),abs(start[1] - goal[1])) <= self.cluster_size:
+      margin = self.cluster_size // 2
+      x = min(start[0],goal[0]) - margin
+      y = min(start[1],goal[1]) - margin
+      rectangle = general.rectangle_intersection((x,y,abs(start[0] - goal[0]) + 2 * margin + 1,abs(start[1] - goal[1]) + 2 * margin + 1),world_rectangle)
+      result = CostGrid(self.world,rectangle,self.modes).find_path(start,goal)
+
+      if result != None:
+        return result[0]
+
+    return self.find_path_hierarchical(start,goal)
+
+  ## Queues a path query to be processed by process_requests.
+  #
+  #  @param start start tile in format (x,y)
+  #  @param goal goal tile in format (x,y)
+  #  @return PathRequest object whose path will be set when it's done
+
+  def request_path(self, start, goal):
+    request = PathRequest(start,goal)
+    self.__requests.append(request)
+    return request
+
+  ## Gets the number of requests waiting to be processed.
+
+  def pending_requests(self):
+    return len(self.__requests)
+
+  ## Processes the queued path requests until the time budget runs out
+  #  (at least one request is always processed), the rest stays queued
+  #  for the next call.
+  #
+  #  @param time_budget time budget in seconds
+  #  @return number of processed requests
+
+  def process_requests(self, time_budget):
+    end_time = time.time() + time_budget
+    result = 0
+
+    while len(self.__requests) != 0:
+      request = self.__requests.popleft()
+      request.path = self.find_path(request.start,request.goal)
+      request.done = True
+      result += 1
+
+      if time.time() >= end_time:
+        break
+
+    return result
@@ -0,0 +1,296 @@
+## \file profiler.py
+#
+#  This file contains a lightweight frame time profiler.
+#
+#  The profiler is switched on by setting the RPG_PROFILE environment
+#  variable to 1 before the game modules are imported. When it is off,
+#  timed() returns the decorated functions unchanged and the other module
+#  functions return immediately, so the instrumentation costs nothing
+#  (hot paths additionally check ENABLED before calling count()).
+#
+#  Timed sections are recorded as events in a ring buffer (exportable in
+#  the Chrome trace format, see chrome://tracing) and summed per frame
+#  into another ring buffer (exportable to CSV and shown by the overlay).
+
+import os
+import time
+import json
+import threading
+import collections
+import pygame
+
+## whether the profiler is on
+
+ENABLED = os.environ.get("RPG_PROFILE","0") == "1"
+
+#=======================================================================
+
+## Record of one profiled frame.
+
+class FrameRecord:
+
+  def __init_attributes(self):
+    ## frame number
+    self.number = 0
+    ## frame start time in seconds (time.perf_counter)
+    self.start = 0.0
+    ## frame duration in seconds
+    self.duration = 0.0
+    ## total time of the sections in the frame, the key is the section
+    #  name, the item is time in seconds
+    self.section_times = {}
+    ## counters of the frame, the key is the counter name
+    self.counters = {}
+
+  def __init__(self, number, start):
+    self.__init_attributes()
+    self.number = number
+    self.start = start
+
+#=======================================================================
+
+## Collects the timed sections and counters.
+
+class Profiler:
+
+  ## number of frames kept in the frame ring buffer
+
+  FRAME_HISTORY = 600
+
+  ## number of section events kept in the event ring buffer
+
+  EVENT_HISTORY = 100000
+
+  ## frames that take longer than this (in seconds) are counted as
+  #  hitches
+
+  HITCH_TIME = 1.0 / 30.0
+
+  def __init_attributes(self):
+    ## finished frames (FrameRecord objects), the oldest are dropped
+    self.frames = collections.deque(maxlen = Profiler.FRAME_HISTORY)
+    ## section events in format (name,start,duration,thread id), the
+    #  oldest are dropped
+    self.events = collections.deque(maxlen = Profiler.EVENT_HISTORY)
+    ## the frame being recorded (FrameRecord object) or None
+    self.current_frame = None
+    ## number of frames begun
+    self.frame_count = 0
+    ## profiler creation time, the trace times are relative to it
+    self.start_time = time.perf_counter()
+    ## font used by draw_overlay, created lazily
+    self.__font = None
+
+  def __init__(self):
+    self.__init_attributes()
+
+  ## Starts recording a new frame, the previous one is finished.
+
+  def begin_frame(self):
+    now = time.perf_counter()
+
+    if self.current_frame != None:
+      self.end_frame(now)
+
+    self.current_frame = FrameRecord(self.frame_count,now)
+    self.frame_count += 1
+
+  ## Finishes the frame being recorded and stores it in the frame ring
+  #  buffer.
+  #
+  #  @param now end time of the frame, if None, current time is used
+
+  def end_frame(self, now = None):
+    if self.current_frame == None:
+      return
+
+    if now == None:
+      now = time.perf_counter()
+
+    self.current_frame.duration = now - self.current_frame.start
+    self.frames.append(self.current_frame)
+    self.events.append(("frame",self.current_frame.start,self.current_frame.duration,threading.get_ident()))
+    self.current_frame = None
+
+  ## Records a finished section.
+  #
+  #  @param name section name
+  #  @param start section start time (time.perf_counter)
+  #  @param end section end time (time.perf_counter)
+
+  def add_section(self, name, start, end):
+    self.events.append((name,start,end - start,threading.get_ident()))
+
+    frame = self.current_frame
+
+    if frame != None:
+      frame.section_times[name] = frame.section_times.get(name,0.0) + end - start
+
+  ## Adds a value to a counter of the current frame.
+
+  def count(self, name, value = 1):
+    frame = self.current_frame
+
+    if frame != None:
+      frame.counters[name] = frame.counters.get(name,0) + value
+
+  ## Gets statistics of the recorded frames.
+  #
+  #  @return tuple (average frame time,maximum frame time,number of
+  #          hitches), the times are in seconds
+
+  def get_statistics(self):
+    if len(self.frames) == 0:
+      return (0.0,0.0,0)
+
+    durations = [frame.duration for frame in self.frames]
+    return (sum(durations) / len(durations),max(durations),len([duration for duration in durations if duration > Profiler.HITCH_TIME]))
+
+  ## Exports the section events in the Chrome trace format (JSON).
+  #
+  #  @param filename name of the file to be written
+
+  def export_chrome_trace(self, filename):
+    pid = os.getpid()
+    trace_events = []
+
+    for name, start, duration, thread_id in self.events:
+      trace_events.append({"name": name,"ph": "X","pid": pid,"tid": thread_id,
+                           "ts": (start - self.start_time) * 1000000.0,"dur": duration * 1000000.0})
+
+    with open(filename,"w") as trace_file:
+      json.dump({"traceEvents": trace_events,"displayTimeUnit": "ms"},trace_file)
+
+  ## Exports the frame records to CSV, one line per frame with the frame
+  #  time, the section times (all in milliseconds) and the counters.
+  #
+  #  @param filename name of the file to be written
+
+  def export_csv(self, filename):
+    section_names = sorted(set(name for frame in self.frames for name in frame.section_times))
+    counter_names = sorted(set(name for frame in self.frames for name in frame.counters))
+
+    with open(filename,"w") as csv_file:
+      csv_file.write(",".join(["frame","start_ms","frame_ms"] + [name + "_ms" for name in section_names] + counter_names) + "\n")
+
+      for frame in self.frames:
+        values = [str(frame.number),"%.3f" % ((frame.start - self.start_time) * 1000.0),"%.3f" % (frame.duration * 1000.0)]
+        values += ["%.3f" % (frame.section_times.get(name,0.0) * 1000.0) for name in section_names]
+        values += [str(frame.counters.get(name,0)) for name in counter_names]
+        csv_file.write(",".join(values) + "\n")
+
+  ## Draws the profiler overlay (frame times, the sections and the
+  #  counters of the last frame).
+  #
+  #  @param surface Surface to draw to
+  #  @param position position of the overlay top left corner in format
+  #         (x,y)
+  #  @return pygame.Rect of the drawn overlay
+
+  def draw_overlay(self, surface, position = (0,0)):
+    if self.__font == None:
+      self.__font = pygame.font.Font(None,16)
+
+    average, maximum, hitches = self.get_statistics()
+    lines = ["frame %.2f ms (max %.2f ms), %d hitches" % (average * 1000.0,maximum * 1000.0,hitches)]
+
+    if len(self.frames) != 0:
+      last_frame = self.frames[-1]
+
+      for name in sorted(last_frame.section_times,key = lambda name: -last_frame.section_times[name]):
+        lines.append("%s %.2f ms" % (name,last_frame.section_times[name] * 1000.0))
+
+      for name in sorted(last_frame.counters):
+        lines.append("%s %d" % (name,last_frame.counters[name]))
+
+    images = [self.__font.render(line,True,(255,255,255)) for line in lines]
+    line_height = self.__font.get_linesize()
+    rectangle = pygame.Rect(position,(max(image.get_width() for image in images) + 8,line_height * len(images) + 8))
+
+    surface.fill((0,0,0),rectangle)
+
+    for i in range(len(images)):
+      surface.blit(images[i],(position[0] + 4,position[1] + 4 + i * line_height))
+
+    return rectangle
+
+## the profiler used by the module functions
+
+PROFILER = Profiler()
+
+#=======================================================================
+
+## A timed section for the with statement.
+
+class Section:
+
+  def __init__(self, name):
+    ## section name
+    self.name = name
+    ## section start time
+    self.start = 0.0
+
+  def __enter__(self):
+    self.start = time.perf_counter()
+    return self
+
+  def __exit__(self, exception_type, exception_value, traceback):
+    PROFILER.add_section(self.name,self.start,time.perf_counter())
+    return False
+
+## A section that does nothing, used when the profiler is off.
+
+class NullSection:
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exception_type, exception_value, traceback):
+    return False
+
+NULL_SECTION = NullSection()
+
+#=======================================================================
+
+## Makes a decorator that times each call of the decorated function as a
+#  section. If the profiler is off, the function is returned unchanged.
+#
+#  @param name section name
+
+def timed(name):
+  def decorator(function):
+    if not ENABLED:
+      return function
+
+    def wrapper(*args, **kwargs):
+      start = time.perf_counter()
+
+      try:
+        return function(*args,**kwargs)
+      finally:
+        PROFILER.add_section(name,start,time.perf_counter())
+
+    wrapper.__name__ = function.__name__
+    wrapper.__doc__ = function.__doc__
+    return wrapper
+
+  return decorator
+
+## Gets a timed section for the with statement.
+#
+#  @param name section name
+
+def section(name):
+  return Section(name) if ENABLED else NULL_SECTION
+
+## Starts recording a new frame.
+
+def begin_frame():
+  if ENABLED:
+    PROFILER.begin_frame()
+
+## Adds a value to a counter of the current frame.
+
+def count(name, value = 1):
+  if ENABLED:
+    PROFILER.count(name,value)
@@ -2,7 +2,98 @@
 #  this file contains functions and classes for helper tools for the
 #  game
 
+import sys
+import io
+import argparse
 import pygame
+import numpy
+import world
+
+## color map used when no other is given, see image_to_map_string
+
+DEFAULT_COLOR_MAP = [
+  (pygame.Color(0,255,0),0,0),
+  (pygame.Color(0,128,0),0,1),
+  (pygame.Color(0,64,0),0,2),
+  (pygame.Color(0,32,0),0,3),
+  (pygame.Color(255,0,0),2,0),
+  (pygame.Color(128,0,0),2,1),
+  (pygame.Color(64,0,0),2,2),
+  (pygame.Color(32,0,0),2,3),
+  (pygame.Color(255,255,255),3,0),
+  (pygame.Color(128,128,128),3,1),
+  (pygame.Color(64,64,64),3,2),
+  (pygame.Color(32,32,32),3,3),
+  (pygame.Color(0,255,255),4,0),
+  (pygame.Color(0,128,128),4,1),
+  (pygame.Color(0,64,64),4,2),
+  (pygame.Color(0,32,32),4,3),
+  (pygame.Color(0,0,255),1,0),
+  (pygame.Color(128,64,0),2,0)]
+
+## Packs colors into 32 bit integers (RGBA, red in the highest byte).
+#
+#  @param r red, a number or a numpy array
+#  @param g green, same type as r
+#  @param b blue, same type as r
+#  @param a alpha, same type as r
+#  @return packed color(s)
+
+def pack_colors(r, g, b, a):
+  return (r << 24) | (g << 16) | (b << 8) | a
+
+## Maps the pixels of a bitmap image to tiles with a color map.
+#
+#  @param image_surface image (Surface) to be mapped
+#  @param color_map list of tuples (color,tile_id,tile_variant), see
+#         image_to_map_string
+#  @return 2D numpy array of indices to color_map indexed [y,x], the
+#          pixels whose color is not in the color map have the index
+#          len(color_map)
+
+def image_to_color_map_indices(image_surface, color_map):
+  pixels = pygame.surfarray.array3d(image_surface).astype(numpy.uint32)
+
+  if image_surface.get_flags() & pygame.SRCALPHA:
+    alpha = pygame.surfarray.array_alpha(image_surface).astype(numpy.uint32)
+  else:
+    alpha = numpy.uint32(255)
+
+  packed = pack_colors(pixels[:,:,0],pixels[:,:,1],pixels[:,:,2],alpha).T
+
+  # lookup table: sorted packed colors and their color map indices, the
+  # first occurence of a color wins
+  lookup = {}
+
+  for i in reversed(range(len(color_map))):
+    color = pygame.Color(*color_map[i][0]) if isinstance(color_map[i][0],tuple) else color_map[i][0]
+    lookup[pack_colors(color.r,color.g,color.b,color.a)] = i
+
+  keys = numpy.array(sorted(lookup),dtype = numpy.uint32)
+  values = numpy.array([lookup[key] for key in keys.tolist()] + [len(color_map)],dtype = numpy.int32)
+
+  positions = numpy.searchsorted(keys,packed)
+  found = keys[numpy.minimum(positions,len(keys) - 1)] == packed if len(keys) != 0 else numpy.zeros(packed.shape,dtype = bool)
+  return numpy.where(found,values[numpy.minimum(positions,len(keys))],len(color_map))
+
+## Writes the map string of given bitmap image to a text stream row by
+#  row, see image_to_map_string.
+#
+#  @param image_surface image (Surface) from which to make the map
+#  @param color_map color map, see image_to_map_string
+#  @param output_file text file object to write to
+#  @param one_line see image_to_map_string
+
+def write_map(image_surface, color_map, output_file, one_line = False):
+  separator = " " if one_line else " \n"
+  output_file.write(str(image_surface.get_width()) + separator + str(image_surface.get_height()) + separator)
+
+  indices = image_to_color_map_indices(image_surface,color_map)
+  tokens = numpy.array([str(item[1]) + " " + str(item[2]) + " " for item in color_map] + ["N 0 "],dtype = object)
+  row_end = "" if one_line else "\n"
+
+  for row in indices:
+    output_file.write("".join(tokens[row].tolist()) + row_end)
 
 ## Makes an map string from given bitmap image.
 #
@@ -18,58 +109,275 @@ import pygame
 #  @return map string
 
 def image_to_map_string(image_surface, color_map, one_line = False):
-  result = ""
-  result += str(image_surface.get_width()) + " "
+  result = io.StringIO()
+  write_map(image_surface,color_map,result,one_line)
+  return result.getvalue()
 
-  if not one_line:
-    result += "\n"
+## Reads a color map from a text file. Each line of the file is one
+#  color map item in format "red green blue tile_id tile_variant", empty
+#  lines and lines beginning with # are ignored.
+#
+#  @param filename name of the color map file
+#  @return color map, see image_to_map_string
 
-  result += str(image_surface.get_height()) + " "
+def read_color_map(filename):
+  result = []
 
-  if not one_line:
-    result += "\n"
+  with open(filename,"r") as color_map_file:
+    for line in color_map_file:
+      fields = line.split()
 
-  for j in range(image_surface.get_height()):
-    for i in range(image_surface.get_width()):
-      current_color = image_surface.get_at((i,j))
+      if len(fields) == 0 or fields[0].startswith("#"):
+        continue
 
-      found = False
+      result.append((pygame.Color(int(fields[0]),int(fields[1]),int(fields[2])),int(fields[3]),int(fields[4])))
 
-      for item in color_map:
-        if item[0] == current_color:
-          found = True
-          result += str(item[1]) + " " + str(item[2]) + " "
+  return result
+
+## Reads everything except the terrain rows from a world file.
+#
+#  @param filename name of the world file (text or binary)
+#  @return tuple (metadata,width,height,max_tile_id), where metadata is
+#          the non-terrain part of the file (bytes) in the text format
+
+def read_world_metadata(filename):
+  if world.is_binary_world_file(filename):
+    with open(filename,'rb') as binary_file:
+      magic, version, id_size, width, height, metadata_length, terrain_offset = world.BINARY_WORLD_HEADER.unpack(binary_file.read(world.BINARY_WORLD_HEADER.size))
+      metadata = binary_file.read(metadata_length)
+
+    tile_ids = [record[0] for section, record, line_number in world.WorldFileParser(io.BytesIO(metadata)).events() if section == "tiles"]
+    return (metadata,width,height,max(tile_ids) if len(tile_ids) != 0 else 0)
+
+  metadata = []
+  width = 0
+  height = 0
+  max_tile_id = 0
+
+  text_file = open(filename,'rb')
+
+  while True:
+    line = text_file.readline()
+
+    if not line:
+      break
+
+    if line.startswith(b"terrain:"):
+      width = int(text_file.readline())
+      height = int(text_file.readline())
+
+      while True:
+        line = text_file.readline()
+
+        if not line or line.startswith(b"end"):
           break
 
-      if not found:
-        result += "N 0 "
+      continue
 
-    if not one_line:
-      result += "\n"
+    if line.startswith(b"tiles:"):
+      metadata.append(line)
 
+      while True:
+        line = text_file.readline()
+        metadata.append(line)
 
-  return result
+        if not line or line.startswith(b"end"):
+          break
+
+        max_tile_id = max(max_tile_id,int(line.split()[0]))
+
+      continue
+
+    metadata.append(line)
+
+  text_file.close()
+
+  return (b"".join(metadata),width,height,max_tile_id)
+
+## Creates a binary world file with given metadata and empty terrain.
+#
+#  @param binary_filename name of the binary world file to be created
+#  @param metadata the non-terrain part of the world in the text format
+#         (bytes)
+#  @param width terrain width in tiles
+#  @param height terrain height in tiles
+#  @param max_tile_id the highest tile id used, it determines the tile id
+#         size
+#  @return tuple (ids,variants,no_tile) where ids and variants are
+#          writable memory mapped terrain planes indexed [y,x] (None if
+#          the terrain is empty) and no_tile is the id of a missing tile
+
+def create_binary_world(binary_filename, metadata, width, height, max_tile_id):
+  id_size = 1 if max_tile_id < 255 else 2
+  id_type = numpy.uint8 if id_size == 1 else numpy.uint16
+  no_tile = 255 if id_size == 1 else world.NO_TILE
+
+  terrain_offset = world.BINARY_WORLD_HEADER.size + len(metadata)
+  terrain_offset += -terrain_offset % world.BINARY_WORLD_ALIGNMENT
+  plane_size = width * height * id_size
+
+  binary_file = open(binary_filename,'wb')
+  binary_file.write(world.BINARY_WORLD_HEADER.pack(world.BINARY_WORLD_MAGIC,world.BINARY_WORLD_VERSION,id_size,width,height,len(metadata),terrain_offset))
+  binary_file.write(metadata)
+  binary_file.truncate(terrain_offset + plane_size + width * height)
+  binary_file.close()
+
+  if width * height == 0:
+    return (None,None,no_tile)
+
+  ids = numpy.memmap(binary_filename,dtype = id_type,mode = 'r+',offset = terrain_offset,shape = (height,width))
+  variants = numpy.memmap(binary_filename,dtype = numpy.uint8,mode = 'r+',offset = terrain_offset + plane_size,shape = (height,width))
+
+  return (ids,variants,no_tile)
+
+## Makes a world file with the terrain made from given bitmap image and
+#  everything else (tiles, props etc.) taken from a template world file.
+#  The output is written as a stream, row by row.
+#
+#  @param image_surface image (Surface) from which to make the terrain
+#  @param color_map color map, see image_to_map_string
+#  @param template_filename name of the template world file (text or
+#         binary)
+#  @param output_filename name of the world file to be created
+#  @param binary if True, the binary world format is written, otherwise
+#         the text format
+
+def image_to_world(image_surface, color_map, template_filename, output_filename, binary = False):
+  metadata, template_width, template_height, max_tile_id = read_world_metadata(template_filename)
+  width = image_surface.get_width()
+  height = image_surface.get_height()
+
+  if not binary:
+    with open(output_filename,"w",newline = "\n") as text_file:
+      text_file.write("terrain:\n")
+      write_map(image_surface,color_map,text_file)
+      text_file.write("end\n")
+      text_file.write(metadata.decode("utf-8"))
+
+    return
+
+  max_tile_id = max([max_tile_id] + [item[1] for item in color_map])
+  ids, variants, no_tile = create_binary_world(output_filename,metadata,width,height,max_tile_id)
+
+  if ids is None:
+    return
+
+  indices = image_to_color_map_indices(image_surface,color_map)
+  id_table = numpy.array([item[1] for item in color_map] + [no_tile],dtype = ids.dtype)
+  variant_table = numpy.array([item[2] for item in color_map] + [0],dtype = numpy.uint8)
+
+  ids[:,:] = id_table[indices]
+  variants[:,:] = variant_table[indices]
+  ids.flush()
+  variants.flush()
+  del ids
+  del variants
+
+## Converts a text world file to the binary world file format (see
+#  "world file format.txt"). The terrain is written into the output
+#  file row by row, so the world doesn't have to fit into memory.
+#
+#  @param text_filename name of the text world file to be converted
+#  @param binary_filename name of the binary world file to be created
+
+def text_world_to_binary(text_filename, binary_filename):
+  metadata, width, height, max_tile_id = read_world_metadata(text_filename)     # first pass: everything except the terrain rows
+  ids, variants, no_tile = create_binary_world(binary_filename,metadata,width,height,max_tile_id)
+
+  if ids is None:
+    return
+
+  text_file = open(text_filename,'rb')        # second pass: the terrain rows
+
+  while True:
+    line = text_file.readline()
+
+    if not line or line.startswith(b"terrain:"):
+      break
+
+  text_file.readline()                         # skip the width and height lines
+  text_file.readline()
+
+  for y in range(height):
+    fields = text_file.readline().split()[:width * 2]
+
+    try:
+      row = numpy.array(fields).astype(numpy.int64)
+    except ValueError:                         # the row contains missing tiles ("N")
+      row = numpy.array([int(field) if field != b"N" else no_tile for field in fields],dtype = numpy.int64)
+
+    ids[y,:len(row) // 2] = row[0::2]
+    variants[y,:len(row) // 2] = row[1::2]
+
+  ids.flush()
+  variants.flush()
+  del ids
+  del variants
+  text_file.close()
+
+## Converts a binary world file back to the text world file format.
+#
+#  @param binary_filename name of the binary world file to be converted
+#  @param text_filename name of the text world file to be created
+
+def binary_world_to_text(binary_filename, text_filename):
+  binary_file = open(binary_filename,'rb')
+  magic, version, id_size, width, height, metadata_length, terrain_offset = world.BINARY_WORLD_HEADER.unpack(binary_file.read(world.BINARY_WORLD_HEADER.size))
+  metadata = binary_file.read(metadata_length)
+  binary_file.close()
+
+  if magic != world.BINARY_WORLD_MAGIC or version != world.BINARY_WORLD_VERSION:
+    raise ValueError(binary_filename + " is not a supported binary world file")
+
+  id_type = numpy.uint8 if id_size == 1 else numpy.uint16
+  no_tile = 255 if id_size == 1 else world.NO_TILE
+
+  text_file = open(text_filename,'wb')
+  text_file.write(b"terrain:\n" + str(width).encode() + b"\n" + str(height).encode() + b"\n")
+
+  if width * height != 0:
+    ids = numpy.memmap(binary_filename,dtype = id_type,mode = 'r',offset = terrain_offset,shape = (height,width))
+    variants = numpy.memmap(binary_filename,dtype = numpy.uint8,mode = 'r',offset = terrain_offset + width * height * id_size,shape = (height,width))
+
+    for y in range(height):
+      fields = []
+
+      for tile_id, variant in zip(ids[y].tolist(),variants[y].tolist()):
+        fields.append("N" if tile_id == no_tile else str(tile_id))
+        fields.append(str(variant))
+
+      text_file.write((" ".join(fields) + "\n").encode())
+
+  text_file.write(b"end\n")
+  text_file.write(metadata)
+  text_file.close()
+
+## Command line entry point of the map making tool, run with --help for
+#  the usage.
+
+def main():
+  parser = argparse.ArgumentParser(description = "Makes a world terrain from a bitmap image.")
+  parser.add_argument("image",help = "bitmap image file, each pixel is one tile")
+  parser.add_argument("output",help = "output file, - means standard output")
+  parser.add_argument("--color-map",help = "color map file with lines 'red green blue tile_id tile_variant' (a built-in map is used if not given)")
+  parser.add_argument("--template",help = "template world file, if given, a whole world file with the other sections taken from it is made, otherwise only the map string")
+  parser.add_argument("--binary",action = "store_true",help = "write the binary world format (requires --template)")
+  parser.add_argument("--one-line",action = "store_true",help = "make a single line map string (as used by the interiors)")
+  arguments = parser.parse_args()
+
+  if arguments.binary and arguments.template == None:
+    parser.error("--binary requires --template")
+
+  image = pygame.image.load(arguments.image)
+  color_map = read_color_map(arguments.color_map) if arguments.color_map != None else DEFAULT_COLOR_MAP
+
+  if arguments.template != None:
+    image_to_world(image,color_map,arguments.template,arguments.output,arguments.binary)
+  elif arguments.output == "-":
+    write_map(image,color_map,sys.stdout,arguments.one_line)
+  else:
+    with open(arguments.output,"w",newline = "\n") as output_file:
+      write_map(image,color_map,output_file,arguments.one_line)
 
-img = pygame.image.load("test.bmp")
-c_map = [
-          (pygame.Color(0,255,0),0,0),
-          (pygame.Color(0,128,0),0,1),
-          (pygame.Color(0,64,0),0,2),
-          (pygame.Color(0,32,0),0,3),
-          (pygame.Color(255,0,0),2,0),
-          (pygame.Color(128,0,0),2,1),
-          (pygame.Color(64,0,0),2,2),
-          (pygame.Color(32,0,0),2,3),
-          (pygame.Color(255,255,255),3,0),
-          (pygame.Color(128,128,128),3,1),
-          (pygame.Color(64,64,64),3,2),
-          (pygame.Color(32,32,32),3,3),
-          (pygame.Color(0,255,255),4,0),
-          (pygame.Color(0,128,128),4,1),
-          (pygame.Color(0,64,64),4,2),
-          (pygame.Color(0,32,32),4,3),
-          (pygame.Color(0,0,255),1,0),
-          (pygame.Color(128,64,0),2,0)
-        ]
-
-print(image_to_map_string(img,c_map))
+if __name__ == "__main__":
+  main()
@@ -7,7 +7,37 @@ import pygame
 import general
 import time
 import sys
+import struct
+import io
+import math
+import threading
 import numpy
+import profiler
+
+## magic bytes at the beginning of a binary world file
+
+BINARY_WORLD_MAGIC = b"RPGWBIN\0"
+
+## binary world file format version
+
+BINARY_WORLD_VERSION = 1
+
+## binary world file header, the fields are: magic, version, tile id
+#  size in bytes (1 or 2), world width, world height, metadata length
+#  in bytes, terrain offset in bytes (see "world file format.txt")
+
+BINARY_WORLD_HEADER = struct.Struct("<8sHHIIIQ")
+
+## the binary terrain planes begin at an offset aligned to this many
+#  bytes
+
+BINARY_WORLD_ALIGNMENT = 16
+
+## tile id value that means there is no tile (the text format uses "N"
+#  for this), binary world files use the maximum value of their tile id
+#  type instead
+
+NO_TILE = 65535
 
 #=======================================================================
 
@@ -88,8 +118,11 @@ class TileType:
     self.name = ""
     ## whether the tile is animated
     self.animated = False
-    ## number of tile variants in range <1,4>
+    ## number of tile variants (or animation frames if the tile is
+    #  animated) in range <1,4>
     self.variants = 1
+    ## animation speed in frames per second (animated tiles only)
+    self.animation_speed = 1.0
     ## whether the tile is steppable
     self.steppable = True
     ## whether the tile can be flied over
@@ -116,17 +149,32 @@ class TileType:
   #  @param steppable whether the tile can be stepped on (bool)
   #  @param flyable whether the tile can be flied over (bool)
   #  @param swimmable whether the tile can be swimmed on (bool)
+  #  @param animation_speed animation speed in frames per second (float)
 
-  def __init__(self, priority = 0, name = "", steppable = True, variants = 1, animated = False, flyable = True, swimmable = False):
+  def __init__(self, priority = 0, name = "", steppable = True, variants = 1, animated = False, flyable = True, swimmable = False, animation_speed = 1.0):
     self.__init_attributes()
     self.priority = priority
     self.steppable = steppable
-    self.variant = variants
+    self.variants = variants
+    self.animation_speed = animation_speed
     self.animated = animated
     self.flyable = flyable
     self.name = name
     self.swimmable = swimmable
 
+  ## Gets the number of animation frames of the tile.
+
+  def get_frame_count(self):
+    return general.saturate(self.variants,1,4)
+
+  ## Gets the animation frame of the tile to be shown at given time.
+  #
+  #  @param time time in seconds
+  #  @return frame index
+
+  def get_animation_frame(self, time):
+    return int(time * self.animation_speed) % self.get_frame_count()
+
   def __str__(self):
     return "Tile: '" + self.name + "' (" + str(self.identifier) + "), prior.: " + str(self.priority) + ", step.: " + str(self.steppable) + ", fly.: " + str(self.flyable) + ", swim.: " + str(self.swimmable)
 
@@ -212,61 +260,148 @@ class PropInstance:
 ## Represents a part of world. It is basically a 2D array of triplets
 #  [TileType reference,variant (int),object list] where object list is
 #  reference to a list of objects at given tile or None.
+#
+#  The triplets are not stored as objects but in separate typed planes:
+#  a plane of tile ids (keys of the tile type dictionary, NO_TILE means
+#  no tile), a plane of tile variants and a sparse dictionary of the
+#  object lists.
 
 class WorldArea:
-  def __init__(self, width, height):
-
-    ## the terrain array, it's format is [x][y][tiletype,variant,object_list]:
-    self.terrain_array = numpy.zeros((width,height),dtype=object)
 
-    if (len(self.terrain_array) != 0):
-      for j in range(len(self.terrain_array[0])):
-        for i in range(len(self.terrain_array)):
-          self.terrain_array[i,j] = numpy.array([None,0,None])
+  ## Initialises a new world area.
+  #
+  #  @param width area width in tiles
+  #  @param height area height in tiles
+  #  @param tile_types dictionary of TileType objects with tile ids as
+  #         keys (i.e. World.tile_types) by which the tile ids in the
+  #         area are interpreted, if None, an empty dictionary is used
+
+  def __init__(self, width, height, tile_types = None):
+    ## tile types by which the tile ids are interpreted, the key is the tile id
+    self.tile_types = dict(tile_types) if tile_types != None else {}
+    ## 2D numpy array of tile ids, it's format is [x][y]
+    self.tile_ids = numpy.full((width,height),NO_TILE,dtype = numpy.uint16)
+    ## 2D numpy array of tile variants, it's format is [x][y]
+    self.tile_variants = numpy.zeros((width,height),dtype = numpy.uint8)
+    ## object lists at tiles, the key is (x,y), tiles without an object list are not present
+    self.object_lists = {}
+    ## maps TileType.identifier to the tile id
+    self.__tile_id_map = {}
+    ## index of the animated tiles (see get_animated_tiles), None if it
+    #  has to be rebuilt
+    self.__animated_tiles = None
+
+    for tile_id in self.tile_types:
+      self.__tile_id_map[self.tile_types[tile_id].identifier] = tile_id
 
   ## the area width in tiles
 
   @property
   def width(self):
-    return len(self.terrain_array)
+    return self.tile_ids.shape[0]
 
   ## the area height in tiles
 
   @property
   def height(self):
-    if self.width == 0:
-      return 0
-    else:
-      return len(self.terrain_array[0])
+    return self.tile_ids.shape[1]
+
+  ## Private method, gets the tile id of given TileType object, unknown
+  #  tile types are added to the area tile types.
+
+  def __tile_id(self, tile_type):
+    if tile_type == None:
+      return NO_TILE
+
+    try:
+      return self.__tile_id_map[tile_type.identifier]
+    except KeyError:
+      tile_id = max(self.tile_types) + 1 if len(self.tile_types) != 0 else 0
+      self.tile_types[tile_id] = tile_type
+      self.__tile_id_map[tile_type.identifier] = tile_id
+      return tile_id
 
   ## Sets the tile at given position. If the position is outside the
   #  terrain, nothing happens.
 
   def set_tile(self, x, y, tile_type, variant, object_list):
-    try:
-      self.terrain_array[x][y][0] = tile_type
-      self.terrain_array[x][y][1] = variant
-      self.terrain_array[x][y][2] = object_list
-    except IndexError:
+    if x < 0 or y < 0 or x >= self.width or y >= self.height:
       return
 
+    self.tile_ids[x,y] = self.__tile_id(tile_type)
+    self.tile_variants[x,y] = variant
+    self.__animated_tiles = None
+
+    if object_list == None:
+      self.object_lists.pop((x,y),None)
+    else:
+      self.object_lists[(x,y)] = object_list
+
   ## Gets the tile type at given position.
   #
   #  @return tile type object at [x,y], if the position is outside
   #          terrain array, closest tile type is returned
 
   def get_tile_type(self, x, y):
-    return self.terrain_array[general.saturate(x,0,self.width - 1)][general.saturate(y,0,self.height - 1)][0]
+    return self.tile_types.get(self.tile_ids.item(general.saturate(x,0,self.width - 1),general.saturate(y,0,self.height - 1)))
 
   ## Same as get_tile_type, just returns the tile variant.
 
   def get_tile_variant(self, x, y):
-    return self.terrain_array[general.saturate(x,0,self.width - 1)][general.saturate(y,0,self.height - 1)][1]
+    return self.tile_variants.item(general.saturate(x,0,self.width - 1),general.saturate(y,0,self.height - 1))
 
   ## Same as get_tile_type, just returns the object list.
 
   def get_object_list(self, x, y):
-    return self.terrain_array[general.saturate(x,0,self.width - 1)][general.saturate(y,0,self.height - 1)][2]
+    return self.object_lists.get((general.saturate(x,0,self.width - 1),general.saturate(y,0,self.height - 1)))
+
+  ## Gets the tile ids in given rectangle.
+  #
+  #  @param rectangle rectangle in format (x,y,width,height) in tiles,
+  #         it must be inside the area
+  #  @return 2D numpy array (view) of the tile ids, it's format is [x][y]
+
+  def get_tile_ids(self, rectangle):
+    return self.tile_ids[rectangle[0]:rectangle[0] + rectangle[2],rectangle[1]:rectangle[1] + rectangle[3]]
+
+  ## Same as get_tile_ids, just returns the tile variants.
+
+  def get_tile_variants(self, rectangle):
+    return self.tile_variants[rectangle[0]:rectangle[0] + rectangle[2],rectangle[1]:rectangle[1] + rectangle[3]]
+
+  ## Sets the tiles in given rectangle. Object lists are not affected.
+  #
+  #  @param rectangle rectangle in format (x,y,width,height) in tiles,
+  #         it must be inside the area
+  #  @param ids 2D array of tile ids in format [x][y] whose shape is
+  #         (width,height) of the rectangle
+  #  @param variants 2D array of tile variants, same format as ids
+
+  def set_tiles(self, rectangle, ids, variants):
+    self.tile_ids[rectangle[0]:rectangle[0] + rectangle[2],rectangle[1]:rectangle[1] + rectangle[3]] = ids
+    self.tile_variants[rectangle[0]:rectangle[0] + rectangle[2],rectangle[1]:rectangle[1] + rectangle[3]] = variants
+    self.__animated_tiles = None
+
+  ## Gets the positions of the animated tiles in the area grouped by the
+  #  tile type. The index is built on the first call and then kept until
+  #  the tiles change.
+  #
+  #  @return dictionary whose key is the tile id and the item is a tuple
+  #          (xs,ys) of 1D numpy arrays with the tile coordinates, only
+  #          the tile types present in the area are included
+
+  def get_animated_tiles(self):
+    if self.__animated_tiles == None:
+      self.__animated_tiles = {}
+
+      for tile_id in self.tile_types:
+        if self.tile_types[tile_id].animated:
+          xs, ys = numpy.nonzero(self.tile_ids == tile_id)
+
+          if len(xs) != 0:
+            self.__animated_tiles[tile_id] = (xs,ys)
+
+    return self.__animated_tiles
 
   def __str__(self):
     result = ""
@@ -300,6 +435,720 @@ class TileInfo:
 
 #=======================================================================
 
+## Checks whether given file is a binary world file.
+#
+#  @param filename name of the file to be checked
+#  @return True if the file begins with BINARY_WORLD_MAGIC, False
+#          otherwise
+
+def is_binary_world_file(filename):
+  with open(filename,'rb') as world_file:
+    return world_file.read(len(BINARY_WORLD_MAGIC)) == BINARY_WORLD_MAGIC
+
+#=======================================================================
+
+## Error in a world file, the message contains the line number.
+
+class WorldFileError(ValueError):
+
+  ## Initialises a new error.
+  #
+  #  @param message error message
+  #  @param line_number number of the line with the error (counted from
+  #         1) or None
+
+  def __init__(self, message, line_number = None):
+    ## number of the line with the error or None
+    self.line_number = line_number
+    ValueError.__init__(self,("line " + str(line_number) + ": " if line_number != None else "") + message)
+
+#=======================================================================
+
+## Holds the byte offsets of the parts of a world file so that the
+#  file can be read at given place without scanning it from the
+#  beginning. The index is built by World while it is loading the file,
+#  except for the terrain row offsets, which are indexed lazily (and only
+#  as far as the rows are needed), so the loading doesn't depend on the
+#  terrain size.
+
+class WorldFileIndex:
+
+  ## number of bytes scanned at once when indexing the terrain rows
+
+  INDEX_BLOCK_SIZE = 1024 * 1024
+
+  ## Private method, initialises the default attribute values
+
+  def __init_attributes(self):
+    ## name of the indexed world file
+    self.filename = ""
+    ## byte offsets of the first data line of each section, the key is the section name (without the colon)
+    self.section_offsets = {}
+    ## byte offsets of the terrain data lines indexed so far, the item at index i is the offset of the terrain row i
+    self.terrain_row_offsets = []
+    ## byte offset of the first terrain row
+    self.terrain_offset = 0
+    ## byte offset of the line ending the terrain section
+    self.terrain_end = 0
+    ## byte offset up to which the terrain rows have been indexed
+    self.__indexed_offset = 0
+    ## lock of the lazy indexing (the terrain may be read from several threads)
+    self.__lock = threading.Lock()
+
+  def __init__(self, filename = ""):
+    self.__init_attributes()
+    self.filename = filename
+
+  ## Sets the byte range of the terrain rows, the row index is reset.
+  #
+  #  @param offset byte offset of the first terrain row
+  #  @param end byte offset of the line ending the terrain section
+
+  def set_terrain_range(self, offset, end):
+    self.terrain_offset = offset
+    self.terrain_end = end
+    self.terrain_row_offsets = [offset] if offset < end else []
+    self.__indexed_offset = offset
+
+  ## Private method, indexes the next block of the terrain rows.
+
+  def __index_block(self, world_file):
+    block_size = WorldFileIndex.INDEX_BLOCK_SIZE
+
+    while True:
+      world_file.seek(self.__indexed_offset)
+      block = world_file.read(min(block_size,self.terrain_end - self.__indexed_offset))
+      newlines = numpy.flatnonzero(numpy.frombuffer(block,dtype = numpy.uint8) == 10)
+
+      if len(newlines) != 0 or self.__indexed_offset + len(block) >= self.terrain_end:
+        break
+
+      block_size *= 2                          # a row longer than the block
+
+    if len(newlines) == 0:                     # the last row without a newline
+      self.__indexed_offset = self.terrain_end
+      return
+
+    row_starts = (newlines + 1 + self.__indexed_offset).tolist()
+    self.terrain_row_offsets.extend([offset for offset in row_starts if offset < self.terrain_end])
+    self.__indexed_offset = row_starts[-1]
+
+  ## Gets the byte offset of given terrain row, the rows are indexed up
+  #  to it if they haven't been yet.
+  #
+  #  @param row row number
+  #  @return byte offset or None if there is no such row
+
+  def get_row_offset(self, row):
+    if row < len(self.terrain_row_offsets):
+      return self.terrain_row_offsets[row]
+
+    with self.__lock:
+      if row >= len(self.terrain_row_offsets) and self.__indexed_offset < self.terrain_end:
+        with open(self.filename,'rb') as world_file:
+          while row >= len(self.terrain_row_offsets) and self.__indexed_offset < self.terrain_end:
+            self.__index_block(world_file)
+
+    return self.terrain_row_offsets[row] if row < len(self.terrain_row_offsets) else None
+
+  def __str__(self):
+    return "world file index: sections: " + str(self.section_offsets) + ", terrain rows indexed: " + str(len(self.terrain_row_offsets))
+
+#=======================================================================
+
+## Streaming parser of the text world file format (see "world file
+#  format.txt").
+#
+#  The file is read in a single pass and turned into a sequence of
+#  (section,record,line number) events by events(). Each section that
+#  the game uses has its own record parser, the records of the other
+#  sections are skipped. The terrain rows are not parsed at all, the
+#  terrain section is skipped by searching for its end in large blocks.
+#  The records are not resolved against each other (e.g. prop instances
+#  hold only the prop class id), so the order of the sections doesn't
+#  matter.
+#
+#  The records are:
+#
+#  - "terrain": tuple (width,height,first row offset,end line offset)
+#  - "tiles": tuple (tile id,TileType object)
+#  - "shadows": tuple (shadow id,name)
+#  - "prop_classes": tuple (prop class id,PropType object)
+#  - "prop_instances": tuple (prop id,prop class id,x,y)
+
+class WorldFileParser:
+
+  ## number of bytes read at once when skipping the terrain
+
+  SKIP_BLOCK_SIZE = 1024 * 1024
+
+  ## Private method, initialises the default attribute values
+
+  def __init_attributes(self):
+    ## file object opened in binary mode
+    self.world_file = None
+    ## byte offsets of the first data line of each section, the key is the section name
+    self.section_offsets = {}
+    ## number of the last read line
+    self.line_number = 0
+    ## record parsers, the key is the section name, the item is a method that takes the list of the line fields
+    self.__record_parsers = {"tiles": self.__parse_tile,
+                             "shadows": self.__parse_shadow,
+                             "prop_classes": self.__parse_prop_class,
+                             "prop_instances": self.__parse_prop_instance}
+
+  ## Initialises a new parser.
+  #
+  #  @param world_file file object opened in binary mode (it has to
+  #         support seek and tell), it is not closed by the parser
+
+  def __init__(self, world_file):
+    self.__init_attributes()
+    self.world_file = world_file
+
+  def __parse_tile(self, fields):
+    animation_speed = float(fields[8]) if len(fields) > 8 else 1.0     # optional field
+    return (int(fields[0]),TileType(int(fields[2]),fields[1].decode("utf-8"),fields[5] == b"T",int(fields[3]),fields[4] == b"T",fields[6] == b"T",fields[7] == b"T",animation_speed))
+
+  def __parse_shadow(self, fields):
+    return (int(fields[0]),fields[1].decode("utf-8"))
+
+  def __parse_prop_class(self, fields):
+    prop_type = PropType()
+    prop_type.name = fields[1].decode("utf-8")
+    prop_type.shadow = int(fields[2])
+    prop_type.width = int(fields[3])
+    prop_type.height = int(fields[4])
+    prop_type.walkable = fields[5] == b"T"
+    prop_type.swimmable = fields[6] == b"T"
+    prop_type.flyable = fields[7] == b"T"
+    prop_type.frames = int(fields[8])
+    prop_type.animation_speed = float(fields[9])
+    prop_type.draw_in_front = fields[10] == b"T"
+
+    # the mask sequence begins at the field 11, it goes by rows:
+    mask = fields[11:11 + prop_type.width * prop_type.height]
+
+    if len(mask) != prop_type.width * prop_type.height:
+      raise ValueError("incomplete mask")
+
+    prop_type.mask = numpy.zeros((prop_type.width,prop_type.height),dtype = object)
+
+    for j in range(prop_type.height):
+      for i in range(prop_type.width):
+        prop_type.mask[i,j] = mask[j * prop_type.width + i] == b"1"
+
+    return (int(fields[0]),prop_type)
+
+  def __parse_prop_instance(self, fields):
+    return (int(fields[0]),int(fields[1]),int(fields[2]),int(fields[3]))
+
+  ## Private method, reads a line of the file.
+  #
+  #  @return the line (bytes), it is empty at the end of the file
+
+  def __read_line(self):
+    line = self.world_file.readline()
+
+    if line:
+      self.line_number += 1
+
+    return line
+
+  ## Private method, skips the terrain rows without parsing them.
+  #
+  #  @return byte offset of the line ending the terrain section
+
+  def __skip_terrain(self):
+    start = self.world_file.tell()
+    self.world_file.seek(start - 1)          # include the preceding newline, so that an immediate "end" is found
+    data = b""
+    data_start = start - 1                   # file offset of data[0]
+    counted_until = start                    # the newlines before this offset have been counted
+
+    while True:
+      block = self.world_file.read(WorldFileParser.SKIP_BLOCK_SIZE)
+
+      if not block:
+        raise WorldFileError("the terrain section has no end",self.line_number)
+
+      tail = data[-3:]                       # "\nend" can be split between the blocks
+      data_start += len(data) - len(tail)
+      data = tail + block
+      index = data.find(b"\nend")
+
+      if index >= 0:
+        end = data_start + index + 1
+        self.line_number += data.count(b"\n",counted_until - data_start,index + 1)
+        self.world_file.seek(end)
+        return end
+
+      self.line_number += data.count(b"\n",counted_until - data_start)
+      counted_until = data_start + len(data)
+
+  ## Generates the events of the file.
+  #
+  #  @return generator of tuples (section name,record,line number), see
+  #          the class description for the records
+  #  @throws WorldFileError if the file is malformed
+
+  def events(self):
+    while True:
+      line = self.__read_line()
+
+      if not line:
+        break
+
+      header = line.strip()
+
+      if not header.endswith(b":"):        # empty lines etc. between the sections
+        continue
+
+      section = header[:-1].decode("utf-8")
+      self.section_offsets[section] = self.world_file.tell()
+
+      if section == "terrain":
+        try:
+          width = int(self.__read_line())
+          height = int(self.__read_line())
+        except ValueError:
+          raise WorldFileError("invalid terrain size",self.line_number)
+
+        offset = self.world_file.tell()
+        end = self.__skip_terrain()
+        self.__read_line()                 # the end line
+        yield (section,(width,height,offset,end),self.line_number)
+        continue
+
+      record_parser = self.__record_parsers.get(section)
+
+      while True:
+        line = self.__read_line()
+
+        if not line:
+          raise WorldFileError("the section '" + section + "' has no end",self.line_number)
+
+        if line.startswith(b"end"):
+          break
+
+        if record_parser == None:
+          continue
+
+        fields = line.split()
+
+        if len(fields) == 0:
+          continue
+
+        try:
+          record = record_parser(fields)
+        except (ValueError,IndexError) as error:
+          raise WorldFileError("invalid " + section + " record (" + str(error) + ")",self.line_number)
+
+        yield (section,record,self.line_number)
+
+#=======================================================================
+
+## Spatial index of prop instances placed in the world.
+#
+#  The world is divided into square cells of a uniform grid, each cell
+#  holds the ids of the props whose rectangle intersects it. A prop
+#  occupies the rectangle (x,y,width,height) where (x,y) is its
+#  position, which tiles of the rectangle it actually occupies is given
+#  by its type mask. The queries only visit the cells around the
+#  queried place, so they don't depend on the total number of props.
+
+class PropSpatialIndex:
+
+  ## default cell width and height in tiles
+
+  CELL_SIZE = 16
+
+  ## Private method, initialises the default attribute values
+
+  def __init_attributes(self):
+    ## cell width and height in tiles
+    self.cell_size = PropSpatialIndex.CELL_SIZE
+    ## the grid cells, the key is (cell_x,cell_y), the items are sets of prop ids
+    self.__cells = {}
+    ## indexed props, the key is the prop id, the items are PropInstance objects
+    self.__props = {}
+    ## bounds of the used cells in format (min_x,min_y,max_x,max_y) or None
+    self.__cell_bounds = None
+
+  ## Initialises a new empty index.
+  #
+  #  @param cell_size cell width and height in tiles
+
+  def __init__(self, cell_size = CELL_SIZE):
+    self.__init_attributes()
+    self.cell_size = cell_size
+
+  def __len__(self):
+    return len(self.__props)
+
+  ## Private method, returns the rectangle of cells (in format
+  #  (x1,y1,x2,y2), inclusive) that a tile rectangle intersects.
+
+  def __cell_range(self, rectangle):
+    return (rectangle[0] // self.cell_size,rectangle[1] // self.cell_size,(rectangle[0] + max(rectangle[2],1) - 1) // self.cell_size,(rectangle[1] + max(rectangle[3],1) - 1) // self.cell_size)
+
+  ## Gets the rectangle occupied by given prop.
+  #
+  #  @param prop PropInstance object
+  #  @return rectangle in format (x,y,width,height) in tiles
+
+  def prop_rectangle(self, prop):
+    return (prop.position[0],prop.position[1],prop.width,prop.height)
+
+  ## Adds a prop to the index, if a prop with the same id is already
+  #  indexed, it is replaced.
+  #
+  #  @param prop_id prop instance id
+  #  @param prop PropInstance object
+
+  def add(self, prop_id, prop):
+    if prop_id in self.__props:
+      self.remove(prop_id)
+
+    self.__props[prop_id] = prop
+    cells = self.__cell_range(self.prop_rectangle(prop))
+
+    for cell_y in range(cells[1],cells[3] + 1):
+      for cell_x in range(cells[0],cells[2] + 1):
+        self.__cells.setdefault((cell_x,cell_y),set()).add(prop_id)
+
+    if self.__cell_bounds == None:
+      self.__cell_bounds = cells
+    else:
+      self.__cell_bounds = (min(self.__cell_bounds[0],cells[0]),min(self.__cell_bounds[1],cells[1]),max(self.__cell_bounds[2],cells[2]),max(self.__cell_bounds[3],cells[3]))
+
+  ## Removes a prop from the index, if it isn't indexed, nothing
+  #  happens.
+  #
+  #  @param prop_id prop instance id
+
+  def remove(self, prop_id):
+    prop = self.__props.pop(prop_id,None)
+
+    if prop == None:
+      return
+
+    cells = self.__cell_range(self.prop_rectangle(prop))
+
+    for cell_y in range(cells[1],cells[3] + 1):
+      for cell_x in range(cells[0],cells[2] + 1):
+        cell = self.__cells[(cell_x,cell_y)]
+        cell.discard(prop_id)
+
+        if len(cell) == 0:
+          del self.__cells[(cell_x,cell_y)]
+
+  ## Moves an indexed prop to a new position.
+  #
+  #  @param prop_id prop instance id
+  #  @param position new position in tiles in format (x,y)
+
+  def move(self, prop_id, position):
+    prop = self.__props[prop_id]
+    self.remove(prop_id)
+    prop.position = position
+    self.add(prop_id,prop)
+
+  ## Gets the props that intersect given rectangle (even partially).
+  #
+  #  @param rectangle rectangle in format (x,y,width,height) in tiles
+  #  @return list of ids of the props (sorted)
+
+  def query_rectangle(self, rectangle):
+    if rectangle[2] <= 0 or rectangle[3] <= 0:
+      return []
+
+    cells = self.__cell_range(rectangle)
+    candidates = set()
+
+    for cell_y in range(cells[1],cells[3] + 1):
+      for cell_x in range(cells[0],cells[2] + 1):
+        cell = self.__cells.get((cell_x,cell_y))
+
+        if cell != None:
+          candidates.update(cell)
+
+    result = []
+
+    for prop_id in candidates:
+      if general.rectangle_intersection(rectangle,self.prop_rectangle(self.__props[prop_id])) != None:
+        result.append(prop_id)
+
+    return sorted(result)
+
+  ## Gets the props that occupy given tile (according to their masks).
+  #
+  #  @param x tile x coordinate
+  #  @param y tile y coordinate
+  #  @return list of ids of the props (sorted)
+
+  def query_point(self, x, y):
+    result = []
+
+    for prop_id in self.query_rectangle((x,y,1,1)):
+      prop = self.__props[prop_id]
+
+      if prop.prop_type.mask is None or prop.prop_type.mask[x - prop.position[0],y - prop.position[1]]:
+        result.append(prop_id)
+
+    return result
+
+  ## Private method, computes the distance between a tile and the
+  #  nearest tile of a prop rectangle.
+
+  def __distance(self, x, y, prop):
+    rectangle = self.prop_rectangle(prop)
+    dx = max(rectangle[0] - x,0,x - (rectangle[0] + rectangle[2] - 1))
+    dy = max(rectangle[1] - y,0,y - (rectangle[1] + rectangle[3] - 1))
+    return math.sqrt(dx * dx + dy * dy)
+
+  ## Finds the prop nearest to given tile. The cells are searched in
+  #  growing square rings around the tile until no closer prop can be
+  #  found.
+  #
+  #  @param x tile x coordinate
+  #  @param y tile y coordinate
+  #  @param max_distance if not None, props farther than this (in tiles)
+  #         are not considered
+  #  @return tuple (prop id,distance in tiles) or None if there is no
+  #          such prop
+
+  def nearest(self, x, y, max_distance = None):
+    if self.__cell_bounds == None:
+      return None
+
+    center_x = x // self.cell_size
+    center_y = y // self.cell_size
+    bounds = self.__cell_bounds
+    max_ring = max(abs(center_x - bounds[0]),abs(center_x - bounds[2]),abs(center_y - bounds[1]),abs(center_y - bounds[3]))
+
+    if max_distance != None:
+      max_ring = min(max_ring,int(max_distance // self.cell_size) + 1)
+
+    best = None
+
+    for ring in range(max_ring + 1):
+      for cell_y in range(center_y - ring,center_y + ring + 1):
+        step = 1 if cell_y in (center_y - ring,center_y + ring) else 2 * ring   # only the ring border cells
+
+        for cell_x in range(center_x - ring,center_x + ring + 1,max(step,1)):
+          for prop_id in self.__cells.get((cell_x,cell_y),()):
+            distance = self.__distance(x,y,self.__props[prop_id])
+
+            if (max_distance == None or distance <= max_distance) and (best == None or (distance,prop_id) < best[::-1]):
+              best = (prop_id,distance)
+
+      # the props in the next rings are farther than ring * cell_size:
+      if best != None and best[1] <= ring * self.cell_size:
+        break
+
+    return best
+
+#=======================================================================
+
+## Holds the passability of the world tiles for each movement mode
+#  (walk, fly and swim, see general.MOVEMENT_*).
+#
+#  A tile is passable if its tile type allows the movement mode and no
+#  prop that occupies the tile (according to its mask) blocks it. The
+#  map is made of square chunks that are computed from the terrain and
+#  props when they are first needed. For each mode a chunk holds a
+#  boolean plane of the terrain passability and a plane that counts the
+#  props blocking each tile, so placing or removing a prop only updates
+#  the tiles it occupies. Tiles outside the world are not passable.
+
+class PassabilityMap:
+
+  ## default chunk width and height in tiles
+
+  CHUNK_SIZE = 64
+
+  ## the order of the movement modes in the chunk planes
+
+  MODES = (general.MOVEMENT_WALK,general.MOVEMENT_FLY,general.MOVEMENT_SWIM)
+
+  ## Private method, initialises the default attribute values
+
+  def __init_attributes(self):
+    ## World object the map is made for
+    self.world = None
+    ## chunk width and height in tiles
+    self.chunk_size = PassabilityMap.CHUNK_SIZE
+    ## computed chunks, the key is (chunk_x,chunk_y), the items are
+    #  tuples (passable,blocking_props,terrain_passable) of 3D numpy
+    #  arrays indexed [mode,x,y] where mode is the index to MODES
+    self.__chunks = {}
+    ## lookup table of terrain passability indexed [mode,tile id]
+    self.__tile_passability = None
+
+  ## Initialises a new passability map.
+  #
+  #  @param world World object whose passability will be held, its props
+  #         have to be indexed (World.prop_index)
+  #  @param chunk_size chunk width and height in tiles
+
+  def __init__(self, world, chunk_size = CHUNK_SIZE):
+    self.__init_attributes()
+    self.world = world
+    self.chunk_size = chunk_size
+    self.__tile_passability = numpy.zeros((len(PassabilityMap.MODES),NO_TILE + 1),dtype = bool)
+
+    for tile_id in world.tile_types:
+      tile_type = world.tile_types[tile_id]
+      self.__tile_passability[:,tile_id] = (tile_type.steppable,tile_type.flyable,tile_type.swimmable)
+
+  ## Private method, returns the indices (to MODES) of the modes that
+  #  given prop blocks.
+
+  def __blocked_modes(self, prop):
+    prop_type = prop.prop_type
+    return [i for i, allowed in enumerate((prop_type.walkable,prop_type.flyable,prop_type.swimmable)) if not allowed]
+
+  ## Private method, adds given value to the blocking prop counts of
+  #  the tiles occupied by a prop in one chunk.
+
+  def __count_prop(self, chunk_key, prop, value):
+    modes = self.__blocked_modes(prop)
+
+    if len(modes) == 0:
+      return
+
+    passable, blocking, terrain = self.__chunks[chunk_key]
+    chunk_x = chunk_key[0] * self.chunk_size
+    chunk_y = chunk_key[1] * self.chunk_size
+
+    prop_rectangle = (prop.position[0],prop.position[1],prop.width,prop.height)
+    overlap = general.rectangle_intersection(prop_rectangle,(chunk_x,chunk_y,passable.shape[1],passable.shape[2]))
+
+    if overlap == None:
+      return
+
+    mask = prop.prop_type.mask
+
+    if mask is None:
+      mask = numpy.ones((prop.width,prop.height),dtype = bool)
+
+    mask = numpy.asarray(mask,dtype = bool)[overlap[0] - prop_rectangle[0]:overlap[0] - prop_rectangle[0] + overlap[2],overlap[1] - prop_rectangle[1]:overlap[1] - prop_rectangle[1] + overlap[3]]
+
+    x1 = overlap[0] - chunk_x
+    y1 = overlap[1] - chunk_y
+    x2 = x1 + overlap[2]
+    y2 = y1 + overlap[3]
+
+    for mode in modes:
+      blocking[mode,x1:x2,y1:y2] += mask * value
+      passable[mode,x1:x2,y1:y2] = terrain[mode,x1:x2,y1:y2] & (blocking[mode,x1:x2,y1:y2] == 0)
+
+  ## Private method, gets a chunk, computing it if needed.
+
+  def __get_chunk(self, chunk_key):
+    try:
+      return self.__chunks[chunk_key]
+    except KeyError:
+      pass
+
+    rectangle = general.rectangle_intersection((chunk_key[0] * self.chunk_size,chunk_key[1] * self.chunk_size,self.chunk_size,self.chunk_size),(0,0,self.world.width,self.world.height))
+    terrain = self.__tile_passability[:,self.world.load_area(rectangle).tile_ids]
+
+    self.__chunks[chunk_key] = (terrain.copy(),numpy.zeros(terrain.shape,dtype = numpy.int16),terrain)
+
+    for prop_id in self.world.prop_index.query_rectangle(rectangle):
+      self.__count_prop(chunk_key,self.world.prop_instances[prop_id],1)
+
+    return self.__chunks[chunk_key]
+
+  ## Private method, returns the keys of the chunks that intersect
+  #  given rectangle (only those inside the world).
+
+  def __chunk_keys(self, rectangle):
+    rectangle = general.rectangle_intersection(rectangle,(0,0,self.world.width,self.world.height))
+
+    if rectangle == None:
+      return []
+
+    return [(x,y) for y in range(rectangle[1] // self.chunk_size,(rectangle[1] + rectangle[3] - 1) // self.chunk_size + 1)
+                  for x in range(rectangle[0] // self.chunk_size,(rectangle[0] + rectangle[2] - 1) // self.chunk_size + 1)]
+
+  ## Updates the map after a prop has been placed in the world. Only
+  #  the already computed chunks are updated.
+  #
+  #  @param prop PropInstance object
+
+  def prop_added(self, prop):
+    for chunk_key in self.__chunk_keys((prop.position[0],prop.position[1],prop.width,prop.height)):
+      if chunk_key in self.__chunks:
+        self.__count_prop(chunk_key,prop,1)
+
+  ## Updates the map after a prop has been removed from the world (must
+  #  be called with the prop still at the position it was removed from).
+  #
+  #  @param prop PropInstance object
+
+  def prop_removed(self, prop):
+    for chunk_key in self.__chunk_keys((prop.position[0],prop.position[1],prop.width,prop.height)):
+      if chunk_key in self.__chunks:
+        self.__count_prop(chunk_key,prop,-1)
+
+  ## Gets the passability of tiles in given rectangle.
+  #
+  #  @param rectangle rectangle in format (x,y,width,height) in tiles
+  #  @param mode movement mode (general.MOVEMENT_*)
+  #  @return 2D numpy bool array indexed [x][y], the tiles outside the
+  #          world are False
+
+  def get_passability(self, rectangle, mode):
+    mode = PassabilityMap.MODES.index(mode)
+    result = numpy.zeros((rectangle[2],rectangle[3]),dtype = bool)
+
+    for chunk_key in self.__chunk_keys(rectangle):
+      passable = self.__get_chunk(chunk_key)[0]
+      chunk_rectangle = (chunk_key[0] * self.chunk_size,chunk_key[1] * self.chunk_size,passable.shape[1],passable.shape[2])
+      overlap = general.rectangle_intersection(rectangle,chunk_rectangle)
+
+      result[overlap[0] - rectangle[0]:overlap[0] - rectangle[0] + overlap[2],overlap[1] - rectangle[1]:overlap[1] - rectangle[1] + overlap[3]] = \
+        passable[mode,overlap[0] - chunk_rectangle[0]:overlap[0] - chunk_rectangle[0] + overlap[2],overlap[1] - chunk_rectangle[1]:overlap[1] - chunk_rectangle[1] + overlap[3]]
+
+    return result
+
+  ## Checks if given tile is passable.
+  #
+  #  @param mode movement mode (general.MOVEMENT_*)
+
+  def is_passable(self, x, y, mode):
+    if x < 0 or y < 0 or x >= self.world.width or y >= self.world.height:
+      return False
+
+    passable = self.__get_chunk((x // self.chunk_size,y // self.chunk_size))[0]
+    return bool(passable[PassabilityMap.MODES.index(mode),x % self.chunk_size,y % self.chunk_size])
+
+  ## Checks if all the tiles in given rectangle are passable.
+  #
+  #  @param rectangle rectangle in format (x,y,width,height) in tiles
+  #  @param mode movement mode (general.MOVEMENT_*)
+
+  def is_rectangle_passable(self, rectangle, mode):
+    if general.rectangle_intersection(rectangle,(0,0,self.world.width,self.world.height)) != rectangle:
+      return False
+
+    mode = PassabilityMap.MODES.index(mode)
+
+    for chunk_key in self.__chunk_keys(rectangle):
+      passable = self.__get_chunk(chunk_key)[0]
+      x = chunk_key[0] * self.chunk_size
+      y = chunk_key[1] * self.chunk_size
+
+      if not passable[mode,max(rectangle[0] - x,0):rectangle[0] + rectangle[2] - x,max(rectangle[1] - y,0):rectangle[1] + rectangle[3] - y].all():
+        return False
+
+    return True
+
+#=======================================================================
+
 ## Represents the game world and a proxy for game world file.
 #
 #  The world consists of 2D array of game tiles plus NPCs, objects, items
@@ -310,170 +1159,251 @@ class TileInfo:
 class World:
 
   ## Private method, loads all the items from the world file except for
-  #  terrain, this is done with __load_active_terrain().
-
-  def __load_non_terrain(self):
-    world_file = open(self.filename,'r')
+  #  terrain, this is done with __load_active_terrain(). While reading
+  #  the file the file index (see WorldFileIndex) is being built.
+  #
+  #  @param world_file binary mode file object to read the text world
+  #         data from, it is closed after loading
 
-    for line in world_file:
+  def __load_non_terrain(self, world_file):
+    self.file_index = WorldFileIndex(self.filename)
+    parser = WorldFileParser(world_file)
+    prop_instances = []
 
-      #-------------------------
-      if general.begins_with(line,"shadows:"):            # load shadows
-        while True:
-          line2 = world_file.readline()
+    try:
+      for section, record, line_number in parser.events():
+        if section == "tiles":
+          self.tile_types[record[0]] = record[1]
+        elif section == "shadows":
+          self.shadows[record[0]] = record[1]
+        elif section == "prop_classes":
+          self.prop_types[record[0]] = record[1]
+        elif section == "prop_instances":        # resolved when all the prop classes are known
+          prop_instances.append((record,line_number))
+        elif section == "terrain":
+          self.world_width = record[0]
+          self.world_height = record[1]
+          self.file_index.set_terrain_range(record[2],record[3])
+    finally:
+      world_file.close()
+
+    self.file_index.section_offsets = parser.section_offsets
+
+    for (prop_id, prop_class_id, x, y), line_number in prop_instances:
+      if not prop_class_id in self.prop_types:
+        raise WorldFileError("unknown prop class " + str(prop_class_id),line_number)
+
+      new_instance = PropInstance()
+      new_instance.position = (x,y)
+      new_instance.prop_type = self.prop_types[prop_class_id]
+      self.prop_instances[prop_id] = new_instance
 
-          if general.begins_with(line2,"end"):
-            break
+  ## Gets the props in current active area. This include props that are
+  #  only partially contained within the area.
+  #
+  #  @return list of props in current active area
 
-          split_line = line2.split()
+  def get_active_area_props(self):
+    return self.get_props_in_rectangle(self.active_area)
 
-          self.shadows[int(split_line[0])] = split_line[1]
-      #-------------------------
-      if general.begins_with(line,"prop_instances:"):     # load prop instances
-        while True:
-          line2 = world_file.readline()
+  ## Gets the props that intersect given rectangle (even partially).
+  #
+  #  @param rectangle rectangle in format (x,y,width,height) in tiles
+  #  @return list of PropInstance objects
 
-          if general.begins_with(line2,"end"):
-            break
+  def get_props_in_rectangle(self, rectangle):
+    return [self.prop_instances[prop_id] for prop_id in self.prop_index.query_rectangle(rectangle)]
 
-          split_line = line2.split()
+  ## Gets the props that occupy given tile (according to their masks).
+  #
+  #  @return list of PropInstance objects
 
-          new_instance = PropInstance()
-          new_instance.position = (int(split_line[2]),int(split_line[3]))
-          new_instance.prop_type = self.prop_types[int(split_line[1])]
+  def get_props_at(self, x, y):
+    return [self.prop_instances[prop_id] for prop_id in self.prop_index.query_point(x,y)]
 
-          self.prop_instances[int(split_line[0])] = new_instance
-      #-------------------------
-      if general.begins_with(line,"prop_classes:"):       # load prop classes
-        while True:
-          line2 = world_file.readline()
+  ## Gets the prop nearest to given tile.
+  #
+  #  @param max_distance if not None, props farther than this (in tiles)
+  #         are not considered
+  #  @return PropInstance object or None if there is no such prop
 
-          if general.begins_with(line2,"end"):
-            break
+  def get_nearest_prop(self, x, y, max_distance = None):
+    result = self.prop_index.nearest(x,y,max_distance)
+    return self.prop_instances[result[0]] if result != None else None
 
-          split_line = line2.split()
+  ## Places a prop instance in the world.
+  #
+  #  @param prop_id unique prop instance id
+  #  @param prop PropInstance object
 
-          prop_type = PropType()
-          prop_type.name = split_line[1]
-          prop_type.shadow = int(split_line[2])
-          prop_type.width = int(split_line[3])
-          prop_type.height = int(split_line[4])
-          prop_type.walkable = split_line[5] == "T"
-          prop_type.swimmable = split_line[6] == "T"
-          prop_type.flyable = split_line[7] == "T"
-          prop_type.frames = int(split_line[8])
-          prop_type.animation_speed = float(split_line[9])
-          prop_type.draw_in_front = split_line[10] == "T"
-          # load the mask:
-          prop_type.mask = numpy.zeros((prop_type.width,prop_type.height),dtype=object)
+  def add_prop_instance(self, prop_id, prop):
+    if prop_id in self.prop_instances:
+      self.remove_prop_instance(prop_id)
 
-          helper_position = 2 # the field where the mask sequence begins
+    self.prop_instances[prop_id] = prop
+    self.prop_index.add(prop_id,prop)
+    self.passability.prop_added(prop)
 
-          for j in range(prop_type.height):
-            for i in range(prop_type.width):
-              prop_type.mask[i,j] = int(split_line[helper_position]) == 1
-              helper_position += 1
+  ## Removes a prop instance from the world.
+  #
+  #  @param prop_id prop instance id
 
-          self.prop_types[int(split_line[0])] = prop_type
-      #-------------------------
-      if general.begins_with(line,"tiles:"):              # load tiles
-        while True:
-          line2 = world_file.readline()
+  def remove_prop_instance(self, prop_id):
+    prop = self.prop_instances.pop(prop_id)
+    self.prop_index.remove(prop_id)
+    self.passability.prop_removed(prop)
 
-          if general.begins_with(line2,"end"):
-            break
+  ## Moves a prop instance placed in the world.
+  #
+  #  @param prop_id prop instance id
+  #  @param position new position in tiles in format (x,y)
 
-          split_line = line2.split()
+  def move_prop_instance(self, prop_id, position):
+    prop = self.prop_instances[prop_id]
+    self.passability.prop_removed(prop)
+    self.prop_index.move(prop_id,position)
+    self.passability.prop_added(prop)
 
-          self.tile_types[int(split_line[0])] = TileType(int(split_line[2]),split_line[1],split_line[5] == "T",int(split_line[3]),split_line[4] == "T",split_line[6] == "T",split_line[7] == "T")
-      #-------------------------
-      if general.begins_with(line,"terrain:"):            # load world size
-        self.world_width = int(world_file.readline())
-        self.world_height = int(world_file.readline())
+  ## Private method, loads the header and the metadata of a binary
+  #  world file and maps its terrain planes into memory.
 
-        while True:
-          line2 = world_file.readline()
+  def __load_binary(self):
+    world_file = open(self.filename,'rb')
+    magic, version, id_size, width, height, metadata_length, terrain_offset = BINARY_WORLD_HEADER.unpack(world_file.read(BINARY_WORLD_HEADER.size))
 
-          if general.begins_with(line2,"end"):
-            break
-      #-------------------------
+    if version != BINARY_WORLD_VERSION:
+      world_file.close()
+      raise ValueError("unsupported binary world version: " + str(version))
 
+    metadata = world_file.read(metadata_length)
     world_file.close()
 
-  ## Gets the props in current active area. This include props that are
-  #  only partially contained within the area.
+    self.__load_non_terrain(io.BytesIO(metadata))
+    self.file_index = None
+    self.world_width = width
+    self.world_height = height
+
+    id_type = numpy.uint8 if id_size == 1 else numpy.uint16
+    plane_size = width * height * id_size
+
+    if width * height != 0:
+      self.terrain_ids = numpy.memmap(self.filename,dtype = id_type,mode = 'r',offset = terrain_offset,shape = (height,width))
+      self.terrain_variants = numpy.memmap(self.filename,dtype = numpy.uint8,mode = 'r',offset = terrain_offset + plane_size,shape = (height,width))
+
+  ## Private method, reads a rectangle of the terrain from the world
+  #  file. Only the rows of the rectangle are read (the file index is
+  #  used to seek to them directly) and only the tiles in the rectangle
+  #  columns are parsed. Binary world files are only sliced.
   #
-  #  @return list of props in current active area
+  #  @param rectangle terrain rectangle in format (x,y,width,height)
+  #  @return tuple (ids,variants) of 2D numpy arrays indexed [y,x],
+  #          missing tiles have NO_TILE id
 
-  def get_active_area_props(self):
-    result = []
+  def __read_terrain(self, rectangle):
+    if self.terrain_ids is not None:
+      ids = self.terrain_ids[rectangle[1]:rectangle[1] + rectangle[3],rectangle[0]:rectangle[0] + rectangle[2]]
+      variants = self.terrain_variants[rectangle[1]:rectangle[1] + rectangle[3],rectangle[0]:rectangle[0] + rectangle[2]]
 
-    # active area in format (x1, y1, x2, y2):
-    active_area = (self.active_area[0], self.active_area[1], self.active_area[0] + self.active_area[2], self.active_area[1] + self.active_area[3])
+      if ids.dtype == numpy.uint8:
+        ids = ids.astype(numpy.uint16)
+        ids[ids == 255] = NO_TILE
 
-    for prop_id in self.prop_instances:
-      prop = self.prop_instances[prop_id]
+      return (ids,variants)
 
-      # prop position in format (x1, y1, x2, y2):
-      prop_position = (prop.position[0],prop.position[1],prop.position[0] + prop.width,prop.position[1] + prop.height)
+    ids = numpy.full((rectangle[3],rectangle[2]),NO_TILE,dtype = numpy.uint16)
+    variants = numpy.zeros((rectangle[3],rectangle[2]),dtype = numpy.uint8)
 
-      if ( (prop_position[0] > active_area[0] and prop_position[0] < active_area[2]) or
-           (prop_position[2] > active_area[0] and prop_position[2] < active_area[2]) ):
-        if ( (prop_position[1] > active_area[1] and prop_position[1] < active_area[3]) or
-             (prop_position[3] > active_area[1] and prop_position[3] < active_area[3]) ):
-          result.append(prop)
+    if self.file_index is None:
+      return (ids,variants)
 
-    return result
+    first_field = rectangle[0] * 2                # each tile takes two fields (id and variant)
+    last_field = first_field + rectangle[2] * 2
+
+    world_file = open(self.filename,'rb')
 
-  ## Private method, loads the active terrain area from the world file.
+    for y in range(rectangle[3]):
+      row_offset = self.file_index.get_row_offset(rectangle[1] + y)
 
-  def __load_active_terrain(self):
-    world_file = open(self.filename,'r')
-    end_it = False
+      if row_offset == None:
+        break
 
-    self.world_area = WorldArea(self._active_area[2],self._active_area[3])
+      world_file.seek(row_offset)
+      terrain_line = world_file.readline().split()[first_field:last_field]
 
-    helper_width = self._active_area[2]
-    helper_height = self._active_area[3]
+      for x in range(len(terrain_line) // 2):
+        try:
+          ids[y,x] = int(terrain_line[x * 2])
+          variants[y,x] = int(terrain_line[x * 2 + 1])
+        except ValueError:
+          pass
 
-    for line in world_file:
+    world_file.close()
 
-      if line[:8] == "terrain:":     # load tiles
-        world_file.readline()        # skip the width and height lines
-        world_file.readline()
+    return (ids,variants)
 
-        counter = 0
+  ## Loads given terrain area from the world file into a new WorldArea
+  #  object without changing the active area, so it can be called from
+  #  another thread (e.g. to prefetch the next active area). The part of
+  #  the area that overlaps a known (already loaded) area is copied from
+  #  it, only the rest is read from the file.
+  #
+  #  @param rectangle area to be loaded in format (x,y,width,height)
+  #  @param known_rectangle rectangle of known_area in format
+  #         (x,y,width,height) or None
+  #  @param known_area already loaded WorldArea object or None
+  #  @return new WorldArea object
 
-        while counter < self._active_area[1]:
-          world_file.readline()
-          counter += 1
+  @profiler.timed("World.load_area")
+  def load_area(self, rectangle, known_rectangle = None, known_area = None):
+    result = WorldArea(rectangle[2],rectangle[3],self.tile_types)
 
-        y = 0
+    overlap = None
 
-        while counter < self._active_area[1] + helper_height:
-          line2 = world_file.readline()
+    if known_area != None and known_rectangle != None:
+      overlap = general.rectangle_intersection(rectangle,known_rectangle)
 
-          if line2[:3] == "end":
-            end_it = True
-            break
+    if overlap == None:
+      missing = [rectangle]
+    else:
+      source = (overlap[0] - known_rectangle[0],overlap[1] - known_rectangle[1],overlap[2],overlap[3])
+      destination = (overlap[0] - rectangle[0],overlap[1] - rectangle[1],overlap[2],overlap[3])
+      result.set_tiles(destination,known_area.get_tile_ids(source),known_area.get_tile_variants(source))
 
-          terrain_line = line2.split()
+      for position in known_area.object_lists:
+        x = position[0] - source[0]
+        y = position[1] - source[1]
 
-          for x in range(0,helper_width):
-            try:
-              self.world_area.set_tile(x,y,self.tile_types[int(terrain_line[(self._active_area[0] + x) * 2])],int(terrain_line[(self._active_area[0] + x) * 2 + 1]),None)
-            except Exception:
-              pass
+        if 0 <= x < source[2] and 0 <= y < source[3]:
+          result.object_lists[(destination[0] + x,destination[1] + y)] = known_area.object_lists[position]
 
-          counter += 1
-          y += 1
+      missing = general.rectangle_difference(rectangle,overlap)
 
-        # TODO LOAD TERRAAAAAAAAAIN
+    for missing_rectangle in missing:
+      ids, variants = self.__read_terrain(missing_rectangle)
+      result.set_tiles((missing_rectangle[0] - rectangle[0],missing_rectangle[1] - rectangle[1],ids.shape[1],ids.shape[0]),ids.T,variants.T)
 
-      if end_it:
-        break
+    result.get_animated_tiles()    # build the index now rather than on the first render
 
-    world_file.close()
+    return result
+
+  ## Sets the active area to an area that has already been loaded by
+  #  load_area, so nothing is read from the world file.
+  #
+  #  @param rectangle the new active area in format (x,y,width,height)
+  #  @param world_area WorldArea object loaded for the rectangle
+
+  def set_loaded_active_area(self, rectangle, world_area):
+    self._active_area = rectangle
+    self.world_area = world_area
+
+  ## Private method, loads the active terrain area from the world file,
+  #  reusing the part that overlaps the previous active area.
+  #
+  #  @param previous_area the previous active area in format
+  #         (x,y,width,height) or None
+
+  def __load_active_terrain(self, previous_area = None):
+    self.world_area = self.load_area(self._active_area,previous_area,self.world_area)
 
   ## Private method, initialises the default attribute values
 
@@ -492,20 +1422,40 @@ class World:
     self.prop_types = {}
     ## all prop instances (RPG instances) loaded from the world file, the key is the prop instance id, the items are PropInstance objects
     self.prop_instances = {}
+    ## PropSpatialIndex of the prop instances, it has to be kept in sync with prop_instances (see add_prop_instance etc.)
+    self.prop_index = PropSpatialIndex()
+    ## PassabilityMap of the world tiles, it is updated by add_prop_instance etc.
+    self.passability = None
     ## world width in tiles
     self.world_width = 0
     ## world height in tiles
     self.world_height = 0
+    ## WorldFileIndex object with the byte offsets of the world file parts (text world files only)
+    self.file_index = None
+    ## memory mapped 2D array of terrain tile ids indexed [y,x] (binary world files only)
+    self.terrain_ids = None
+    ## memory mapped 2D array of terrain tile variants indexed [y,x] (binary world files only)
+    self.terrain_variants = None
 
   ## Initialises a new world proxy for given world file.
   #
   #  @param filename name of the world file for which the object will
-  #         be proxy
+  #         be proxy, the file can be either in text or binary format
 
   def __init__(self, filename):
     self.__init_attributes()
     self.filename = filename
-    self.__load_non_terrain()
+
+    if is_binary_world_file(filename):
+      self.__load_binary()
+    else:
+      self.__load_non_terrain(open(self.filename,'rb'))
+
+    for prop_id in self.prop_instances:
+      self.prop_index.add(prop_id,self.prop_instances[prop_id])
+
+    self.passability = PassabilityMap(self)
+
     self.__load_active_terrain()
 
   @property
@@ -527,8 +1477,9 @@ class World:
 
   @active_area.setter
   def active_area(self,value):
+    previous_area = self._active_area
     self._active_area = value
-    self.__load_active_terrain()
+    self.__load_active_terrain(previous_area)
 
   def __str__(self):
     result = ""
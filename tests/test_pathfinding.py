@@ -0,0 +1,138 @@
+## \file test_pathfinding.py
+#
+#  Regression tests of the hierarchical path finding, the results are
+#  compared to plain A* on random grids.
+
+import os
+import sys
+import random
+import unittest
+import numpy
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),"..","src"))
+
+import general
+import pathfinding
+
+## Passability of a random grid, provides what the path finder needs
+#  from PassabilityMap.
+
+class GridPassability:
+
+  def __init__(self, passable):
+    ## 2D numpy bool array indexed [x][y]
+    self.passable = passable
+
+  def get_passability(self, rectangle, mode):
+    result = numpy.zeros((rectangle[2],rectangle[3]),dtype = bool)
+    x1 = max(rectangle[0],0)
+    y1 = max(rectangle[1],0)
+    x2 = min(rectangle[0] + rectangle[2],self.passable.shape[0])
+    y2 = min(rectangle[1] + rectangle[3],self.passable.shape[1])
+
+    if x2 > x1 and y2 > y1:
+      result[x1 - rectangle[0]:x2 - rectangle[0],y1 - rectangle[1]:y2 - rectangle[1]] = self.passable[x1:x2,y1:y2]
+
+    return result
+
+## World with a random grid of passable tiles.
+
+class GridWorld:
+
+  def __init__(self, width, height, density, seed):
+    random_state = numpy.random.RandomState(seed)
+    self.width = width
+    self.height = height
+    self.passability = GridPassability(random_state.random_sample((width,height)) >= density)
+
+class HierarchicalPathTest(unittest.TestCase):
+
+  CLUSTER_SIZE = 8
+
+  ## Checks that a path is a valid walk from start to goal.
+
+  def assert_valid_path(self, grid, path, start, goal):
+    self.assertEqual(path[0],start)
+    self.assertEqual(path[-1],goal)
+
+    for i in range(1,len(path)):
+      self.assertIn(path[i],[move[0] for move in grid.moves(path[i - 1],grid.rectangle)])
+
+  ## Compares the reachability found by a search function to A* for the
+  #  given queries.
+
+  def check_queries(self, world, search, queries):
+    rectangle = (0,0,world.width,world.height)
+    grid = pathfinding.CostGrid(world,rectangle,{general.MOVEMENT_WALK: 1.0})
+
+    for start, goal in queries:
+      expected = grid.find_path_astar(start,goal)
+      result = search(start,goal)
+
+      if expected == None:
+        self.assertIsNone(result,(start,goal))
+      else:
+        self.assertIsNotNone(result,(start,goal))
+        self.assert_valid_path(grid,result,start,goal)
+
+  ## Makes random queries, half of them start on a cluster border (where
+  #  the entrances are).
+
+  def make_queries(self, world, count, seed):
+    random_generator = random.Random(seed)
+    size = HierarchicalPathTest.CLUSTER_SIZE
+    result = []
+
+    for i in range(count):
+      goal = (random_generator.randrange(world.width),random_generator.randrange(world.height))
+
+      if i % 2 == 0:
+        start = (random_generator.randrange(world.width),random_generator.randrange(world.height))
+      else:
+        start = (random_generator.randrange(world.width // size) * size + random_generator.choice((0,size - 1)),random_generator.randrange(world.height))
+
+      result.append((start,goal))
+
+    return result
+
+  def test_hierarchical_matches_astar(self):
+    for seed in range(5):
+      world = GridWorld(48,40,0.3,seed)
+      finder = pathfinding.PathFinder(world,cluster_size = HierarchicalPathTest.CLUSTER_SIZE)
+      self.check_queries(world,finder.find_path_hierarchical,self.make_queries(world,150,seed))
+
+  def test_find_path_matches_astar(self):
+    for seed in range(5):
+      world = GridWorld(48,40,0.3,seed + 100)
+      finder = pathfinding.PathFinder(world,cluster_size = HierarchicalPathTest.CLUSTER_SIZE)
+      self.check_queries(world,finder.find_path,self.make_queries(world,150,seed))
+
+  def test_start_on_entrance(self):
+    world = GridWorld(48,40,0.3,7)
+    finder = pathfinding.PathFinder(world,cluster_size = HierarchicalPathTest.CLUSTER_SIZE)
+    size = HierarchicalPathTest.CLUSTER_SIZE
+    passable = world.passability.passable
+    queries = []
+
+    # entrances are on the cluster borders, try every passable border tile:
+    for x in range(size - 1,world.width - 1,size):
+      for y in range(world.height):
+        if passable[x,y] and passable[x + 1,y]:
+          queries.append(((x,y),(world.width - 1 - x,world.height - 1 - y)))
+          queries.append(((x + 1,y),(max(x - size,0),y)))
+
+    self.check_queries(world,finder.find_path_hierarchical,queries)
+
+  def test_start_is_goal(self):
+    world = GridWorld(32,32,0.3,3)
+    finder = pathfinding.PathFinder(world,cluster_size = HierarchicalPathTest.CLUSTER_SIZE)
+    passable = world.passability.passable
+
+    for x in range(world.width):
+      for y in (0,7,8,15,20):
+        expected = [(x,y)] if passable[x,y] else None
+        self.assertEqual(finder.find_path_hierarchical((x,y),(x,y)),expected)
+        self.assertEqual(finder.find_path((x,y),(x,y)),expected)
+
+if __name__ == "__main__":
+  unittest.main()